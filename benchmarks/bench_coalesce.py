@@ -0,0 +1,184 @@
+"""
+Cost of taking in one burst of gossip datagrams that all carry the same
+members with increasing heartbeats, as a node gets fanout x N redundant
+entries per interval:
+
+* engine: every datagram decoded and merged under the lock on its own
+  (MembershipEngine.handle_datagram) against the burst pre-merged to one
+  entry per member and applied with one merge (ingest.PreMerger, as
+  drain_premerged does)
+* server.py: the lock taken and the snapshot published per datagram
+  against once per burst (receiver())
+
+Usage: python benchmarks/bench_coalesce.py [members]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+from engine import MembershipEngine  # noqa: E402
+from ingest import PreMerger, apply_merged  # noqa: E402
+from metrics import EngineMetrics  # noqa: E402
+from peers import PeerSelector  # noqa: E402
+from protocol import (  # noqa: E402
+    Command, GossipMessage, Member, Status, decode_node_table,
+    encode_message, encode_node_table
+)
+from deadlines import DeadlineQueue  # noqa: E402
+
+BURSTS = [1, 10, 50]
+ROUNDS = 5
+ADDRESS = ("127.0.0.1", 9000)
+
+
+class NullSender(object):
+    def sendto(self, data: bytes, address) -> int:
+        return len(data)
+
+
+class NullLog(object):
+    def log(self, message: str, **fields) -> None:
+        pass
+
+
+def gossip(members: int, heartbeat: int) -> bytes:
+    return encode_message(GossipMessage(
+        command=Command.GOSSIP,
+        data={
+            f"member-{i}": Member(
+                id=f"member-{i}",
+                address=("127.0.0.1", 8000 + i % 1000),
+                heartbeat=heartbeat,
+                time=0.0,
+                status=(heartbeat, Status.ALIVE),
+                failed_time=0.0
+            )
+            for i in range(1, members)
+        }
+    ))
+
+
+def engine_per_datagram(engine: MembershipEngine, burst: list[bytes]) -> None:
+    sender = NullSender()
+    for data in burst:
+        engine.handle_datagram(sender, memoryview(data), ADDRESS)
+
+
+def engine_coalesced(engine: MembershipEngine, burst: list[bytes]) -> None:
+    merger = PreMerger()
+    for data in burst:
+        merger.add(memoryview(data), ADDRESS)
+    apply_merged(engine, NullSender(), *merger.take())
+
+
+def measure_engine(members: int, burst_size: int, take_in) -> float:
+    engine = MembershipEngine("member-0", ("127.0.0.1", 8000), ADDRESS)
+    engine.merge_to_member_list({})
+    heartbeat = 1
+    spent = 0.0
+    for _ in range(ROUNDS):
+        burst = []
+        for _ in range(burst_size):
+            heartbeat += 1
+            burst.append(gossip(members, heartbeat))
+        start = time.perf_counter()
+        take_in(engine, burst)
+        spent += time.perf_counter() - start
+    return spent / ROUNDS
+
+
+def node_table(members: int, heartbeat: int) -> bytes:
+    return encode_node_table({
+        f"node{i}": {
+            "heartbeat_counter": heartbeat,
+            "local_clock": 0,
+            "timestamp": 0,
+            "version_id": 0,
+            "status": "online",
+            "incarnation": 0,
+        }
+        for i in range(2, members + 1)
+    })
+
+
+def load_server(members: int) -> None:
+    server.NODES = {
+        f"node{i}": ("127.0.0.1", 8010 + i) for i in range(1, members + 1)
+    }
+    server.node_name = "node1"
+    server.status = "online"
+    server.suspicion = True
+    server.metrics = EngineMetrics()
+    server.lock = server.metrics.lock()
+    server.event_log = NullLog()
+    server.membership_list = {"node1": {
+        "heartbeat_counter": 0, "local_clock": 0, "timestamp": 0,
+        "version_id": 0, "status": "online", "incarnation": 0,
+    }}
+    server.failed_nodes = DeadlineQueue()
+    server.suspected_nodes = DeadlineQueue()
+    server.readytoremove_nodes = DeadlineQueue()
+    server.pending_joins = set()
+    server.peers = PeerSelector()
+    # the first table adds every node, printing that it joined
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    server.merge_received(decode_node_table(node_table(members, 1)))
+    sys.stdout = stdout
+    server.publish_snapshot()
+
+
+def server_per_datagram(burst: list[bytes]) -> None:
+    for data in burst:
+        received_list = decode_node_table(data)
+        server.lock.acquire()
+        server.merge_received(received_list)
+        server.publish_snapshot()
+        server.lock.release()
+
+
+def server_coalesced(burst: list[bytes]) -> None:
+    received_lists = [decode_node_table(data) for data in burst]
+    server.lock.acquire()
+    for received_list in received_lists:
+        server.merge_received(received_list)
+    server.publish_snapshot()
+    server.lock.release()
+
+
+def measure_server(members: int, burst_size: int, take_in) -> float:
+    load_server(members)
+    heartbeat = 1
+    spent = 0.0
+    for _ in range(ROUNDS):
+        burst = []
+        for _ in range(burst_size):
+            heartbeat += 1
+            burst.append(node_table(members, heartbeat))
+        start = time.perf_counter()
+        take_in(burst)
+        spent += time.perf_counter() - start
+    return spent / ROUNDS
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    print(f"{members} members per datagram, time per burst")
+    print(f"{'':>10} {'burst':>6} {'per datagram':>14} {'coalesced':>12} "
+          f"{'ratio':>7}")
+    for name, measure, per_datagram, coalesced in (
+        ("engine", measure_engine, engine_per_datagram, engine_coalesced),
+        ("server.py", measure_server, server_per_datagram, server_coalesced),
+    ):
+        for burst_size in BURSTS:
+            before = measure(members, burst_size, per_datagram)
+            after = measure(members, burst_size, coalesced)
+            print(f"{name:>10} {burst_size:>6} {before * 1e3:>11.2f} ms "
+                  f"{after * 1e3:>9.2f} ms {before / after:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
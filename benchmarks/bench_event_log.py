@@ -0,0 +1,60 @@
+"""
+Time spent logging one membership event by the thread that holds the lock:
+opening, appending to and closing the log file per event (what server.py
+did) against queueing it on an EventLog.
+
+Usage: python benchmarks/bench_event_log.py [events]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eventlog import EventLog  # noqa: E402
+
+
+def append_per_event(filename: str, events: int) -> float:
+    start = time.perf_counter()
+    for index in range(events):
+        with open(filename, "a") as f:
+            f.write(f"node{index} has failed!\n")
+    return time.perf_counter() - start
+
+
+def queue_per_event(filename: str, events: int, structured: bool) -> float:
+    event_log = EventLog(filename, structured=structured)
+    start = time.perf_counter()
+    for index in range(events):
+        event_log.log(f"node{index} has failed!", member=f"node{index}")
+    elapsed = time.perf_counter() - start
+    event_log.close()
+    with open(filename) as f:
+        assert sum(1 for _ in f) == events
+    return elapsed
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [
+            ("open/append/close", append_per_event(
+                os.path.join(directory, "append.txt"), events
+            )),
+            ("EventLog", queue_per_event(
+                os.path.join(directory, "plain.txt"), events, False
+            )),
+            ("EventLog (JSON)", queue_per_event(
+                os.path.join(directory, "json.txt"), events, True
+            )),
+        ]
+
+    for name, elapsed in results:
+        print(f"{name:>18}: {elapsed / events * 1e6:7.2f} us/event "
+              "in the caller")
+
+
+if __name__ == "__main__":
+    main()
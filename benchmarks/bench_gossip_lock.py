@@ -0,0 +1,124 @@
+"""
+Lock hold time per gossip round: encoding under the lock for every target
+(the previous handle_sending_gossip) against MembershipEngine.gossip_round,
+which copies a snapshot under the lock and encodes once after releasing it.
+
+Both variants send the full member list every round (the engine's MTU
+budget is lifted) so the comparison is about where the work happens, not
+how much is sent.
+
+Usage: python benchmarks/bench_gossip_lock.py [rounds]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from delta import DeltaTracker  # noqa: E402
+from engine import MembershipEngine  # noqa: E402
+from protocol import (  # noqa: E402
+    Command, GossipMessage, Member, Status, encode_message
+)
+
+SIZES = [10, 100, 1000, 10000]
+FANOUT = 4
+
+
+class TimedLock(object):
+    """A lock that records how long it was held each time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acquired_at = 0.0
+        self.holds: list[float] = []
+
+    def acquire(self):
+        self.lock.acquire()
+        self.acquired_at = time.perf_counter()
+
+    def release(self):
+        self.holds.append(time.perf_counter() - self.acquired_at)
+        self.lock.release()
+
+
+class NullSocket(object):
+    """Stands in for the UDP socket so only our own work is measured."""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def sendto(self, data, address):
+        self.bytes_sent += len(data)
+
+
+def populate(size: int) -> tuple[MembershipEngine, dict[str, Member]]:
+    """ An engine and the same member list as the old dict of Members """
+    engine = MembershipEngine(
+        "member-0",
+        ("fa23-cs425-7601.cs.illinois.edu", 8000),
+        ("fa23-cs425-7601.cs.illinois.edu", 8000),
+        full_sync_interval=1,
+        mtu=sys.maxsize
+    )
+    for i in range(1, size):
+        engine.member_list.add(
+            f"member-{i}", "fa23-cs425-7601.cs.illinois.edu", 8000 + i % 1000,
+            i, time.time(), i, Status.ALIVE
+        )
+        engine.touch(f"member-{i}")
+    engine.publish()    # gossip_round picks its targets from the snapshot
+    return engine, {
+        member_id: member.to_member()
+        for member_id, member in engine.member_list.items()
+    }
+
+
+def legacy_round(
+    member_list: dict[str, Member],
+    lock: TimedLock,
+    sock: NullSocket
+) -> None:
+    lock.acquire()
+    targets = list(member_list.values())[1:FANOUT + 1]
+    for member in targets:
+        sock.sendto(encode_message(GossipMessage(
+            command=Command.GOSSIP,
+            data=member_list
+        )), member["address"])
+    lock.release()
+
+
+def measure(size: int, rounds: int) -> tuple[float, float]:
+    engine, member_list = populate(size)
+    sock = NullSocket()
+
+    legacy_lock = TimedLock()
+    for _ in range(rounds):
+        legacy_round(member_list, legacy_lock, sock)
+
+    snapshot_lock = TimedLock()
+    engine.lock = snapshot_lock  # type: ignore
+    for _ in range(rounds):
+        engine.gossip_round(sock)
+
+    return (
+        sum(legacy_lock.holds) / len(legacy_lock.holds),
+        sum(snapshot_lock.holds) / len(snapshot_lock.holds),
+    )
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    print(f"{'members':>8} {'encode under lock':>18} "
+          f"{'snapshot only':>14} {'ratio':>6}")
+    for size in SIZES:
+        legacy, snapshot = measure(size, rounds)
+        print(f"{size:>8} {legacy * 1e3:>15.3f} ms {snapshot * 1e3:>11.3f} ms "
+              f"{legacy / snapshot:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Cost of keeping a consistent-hash ring current when one member flaps
+(fails, then comes back): rebuilding the ring from every live member
+against HashRing's incremental remove and add, and the cost of a lookup.
+
+Usage: python benchmarks/bench_hashring.py [vnodes]
+"""
+import bisect
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hashring import HashRing, key_hash  # noqa: E402
+
+SIZES = [100, 1000, 10000]
+FLAPS = 20
+REBUILDS = 3    # rebuilding a large ring takes seconds
+LOOKUPS = 100000
+
+
+def rebuild(members: list[str], vnodes: int) -> list[tuple[int, str]]:
+    return sorted(
+        (key_hash(f"{member_id}#{i}"), member_id)
+        for member_id in members for i in range(vnodes)
+    )
+
+
+def main():
+    vnodes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+
+    for size in SIZES:
+        members = [f"member-{i}" for i in range(size)]
+        ring = HashRing(vnodes)
+        for member_id in members:
+            ring.add(member_id)
+
+        flapping = members[:FLAPS]
+        start = time.perf_counter()
+        for member_id in flapping[:REBUILDS]:
+            rest = [other for other in members if other != member_id]
+            rebuild(rest, vnodes)
+            rebuild(members, vnodes)
+        rebuilt = (time.perf_counter() - start) / REBUILDS
+
+        start = time.perf_counter()
+        for member_id in flapping:
+            ring.remove(member_id)
+            ring.add(member_id)
+        incremental = (time.perf_counter() - start) / FLAPS
+
+        keys = [f"key-{i}" for i in range(LOOKUPS)]
+        start = time.perf_counter()
+        for key in keys:
+            ring.lookup(key)
+        lookup = (time.perf_counter() - start) / LOOKUPS
+
+        # a bare bisect over the rebuilt ring, for reference
+        table = rebuild(members, vnodes)
+        points = [token for token, _ in table]
+        start = time.perf_counter()
+        for key in keys:
+            table[bisect.bisect_left(points, key_hash(key)) % len(table)]
+        bare = (time.perf_counter() - start) / LOOKUPS
+
+        print(f"{size} members x {vnodes} vnodes")
+        print(f"  flap, rebuild:     {rebuilt * 1000:9.2f} ms")
+        print(f"  flap, incremental: {incremental * 1000:9.2f} ms "
+              f"({rebuilt / incremental:.0f}x)")
+        print(f"  lookup:            {lookup * 1e6:9.2f} us "
+              f"(bare bisect {bare * 1e6:.2f} us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Ingestion throughput with and without SO_REUSEPORT receiver workers.
+
+Sender processes, each on its own socket so the kernel spreads them over
+the workers, blast gossip datagrams at a node on localhost.  We count the
+datagrams decoded per second, by the node's receive thread alone (0
+workers) or by the workers plus the node's own share, and how many member
+entries the engine process still has to merge per datagram after
+pre-merging.  Gains need free cores: the senders take some too.
+
+Usage: python benchmarks/bench_ingest.py [members] [seconds] [workers...]
+"""
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest  # noqa: E402
+import server_new  # noqa: E402
+from engine import MembershipEngine  # noqa: E402
+from protocol import (  # noqa: E402
+    Command, GossipMessage, Member, Status, encode_message
+)
+from util import Logger  # noqa: E402
+
+SENDERS = 4
+
+
+def make_datagram(sender: int, members: int, heartbeat: int) -> bytes:
+    return encode_message(GossipMessage(
+        command=Command.GOSSIP,
+        data={
+            f"member-{i}": Member(
+                id=f"member-{i}",
+                address=("127.0.0.1", 9000 + i),
+                heartbeat=heartbeat,
+                time=0.0,
+                status=(0, Status.ALIVE),
+                failed_time=0.0
+            )
+            for i in range(members)
+        },
+        sender=f"sender-{sender}",
+        version=heartbeat,
+        ack=0
+    ))
+
+
+def blast(address, sender: int, members: int, stop) -> None:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagrams = [make_datagram(sender, members, hb) for hb in range(1, 65)]
+    while not stop.is_set():
+        for datagram in datagrams:
+            sock.sendto(datagram, address)
+        time.sleep(0.001)
+    sock.close()
+
+
+def count_decoded(decoded) -> None:
+    """ Count every datagram pre-merged, in this process and forked ones """
+    add = ingest.PreMerger.add
+
+    def counting_add(self, data, source):
+        add(self, data, source)
+        with decoded.get_lock():
+            decoded.value += 1
+
+    ingest.PreMerger.add = counting_add  # type: ignore
+
+
+def measure(workers: int, members: int, seconds: float):
+    address = ("127.0.0.1", 0)
+    node_socket = ingest.reuse_port_socket(address)
+    node_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    address = node_socket.getsockname()
+    engine = MembershipEngine("receiver", address, address)
+
+    decoded = multiprocessing.Value("q", 0)
+    add = ingest.PreMerger.add
+    count_decoded(decoded)
+    merged = [0]
+    handle = engine.handle_gossip_message
+    merge = engine.merge_to_member_list
+
+    def counting_handle(message):
+        handle(message)
+        with decoded.get_lock():
+            decoded.value += 1
+
+    def counting_merge(members):
+        merge(members)
+        merged[0] += len(members)
+
+    engine.handle_gossip_message = counting_handle  # type: ignore
+    engine.merge_to_member_list = counting_merge  # type: ignore
+
+    connections = ingest.start_workers(engine, workers, verbosity=0)
+    workers_started = multiprocessing.active_children()
+
+    threading.Thread(
+        target=server_new.handle_receiving_message,
+        args=(engine, node_socket, workers > 0),
+        daemon=True
+    ).start()
+    threading.Thread(
+        target=server_new.handle_worker_batches,
+        args=(engine, node_socket, connections),
+        daemon=True
+    ).start()
+
+    stop = multiprocessing.Event()
+    senders = [
+        multiprocessing.Process(
+            target=blast, args=(address, sender, members, stop), daemon=True
+        )
+        for sender in range(SENDERS)
+    ]
+    for sender in senders:
+        sender.start()
+
+    time.sleep(0.5)
+    start_decoded, start_merged = decoded.value, merged[0]
+    start = time.perf_counter()
+    time.sleep(seconds)
+    elapsed = time.perf_counter() - start
+    count = decoded.value - start_decoded
+    rate = count / elapsed
+    per_datagram = (merged[0] - start_merged) / max(count, 1)
+
+    stop.set()
+    for process in workers_started:
+        process.terminate()
+    ingest.PreMerger.add = add  # type: ignore
+    return rate, per_datagram
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    counts = [int(arg) for arg in sys.argv[3:]] or [0, 1, 2, 4]
+
+    server_new.T_UPDATE = 3600.0
+    server_new.LOGGER = Logger(0)
+    multiprocessing.set_start_method("fork")  # workers inherit the counting
+
+    print(f"{os.cpu_count()} cpus, {SENDERS} senders, "
+          f"{members} members per datagram")
+    for workers in counts:
+        rate, per_datagram = measure(workers, members, seconds)
+        print(f"{workers:>2} workers: {rate:10.0f} datagrams/s, "
+              f"{per_datagram:5.1f} entries merged by the engine each")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Cost of answering a burst of joins, as when a fleet restarts at once: the
+previous reply to every joiner (copy the member list under the lock, then
+encode it) against queueing the joiners and answering them all with one
+copy and encoding in MembershipEngine.flush_joins.
+
+Usage: python benchmarks/bench_join.py [members] [joiners]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import MembershipEngine  # noqa: E402
+from protocol import (  # noqa: E402
+    GossipEncoder, JoinMessageData, Member, Status, paginate_records
+)
+
+
+class NullSender(object):
+    def __init__(self):
+        self.datagrams = 0
+
+    def sendto(self, data: bytes, address) -> int:
+        self.datagrams += 1
+        return len(data)
+
+
+def populate(size: int) -> MembershipEngine:
+    engine = MembershipEngine(
+        "member-0", ("localhost", 8000), ("localhost", 8000)
+    )
+    engine.merge_to_member_list({
+        f"member-{i}": Member(
+            id=f"member-{i}",
+            address=("localhost", 8000 + i % 1000),
+            heartbeat=1,
+            time=0.0,
+            status=(0, Status.ALIVE),
+            failed_time=0.0
+        )
+        for i in range(1, size)
+    })
+    return engine
+
+
+def joins(count: int) -> list[JoinMessageData]:
+    return [
+        JoinMessageData(id=f"joiner-{i}", host="localhost", port=9000 + i)
+        for i in range(count)
+    ]
+
+
+def legacy_join(
+    engine: MembershipEngine,
+    sender: NullSender,
+    join_data: JoinMessageData
+) -> None:
+    engine.lock.acquire()
+    records = [
+        member.gossip_record() for member in engine.member_list.values()
+    ]
+    engine.lock.release()
+
+    encoder = GossipEncoder(engine.wire_format, capacity=engine.mtu)
+    for page in paginate_records(None, records, engine.mtu):
+        encoder.encode(None, 0, page)
+        sender.sendto(
+            bytes(encoder.payload(0)), (join_data["host"], join_data["port"])
+        )
+
+
+def measure(size: int, count: int) -> tuple[float, float]:
+    engine = populate(size)
+    sender = NullSender()
+    start = time.perf_counter()
+    for join_data in joins(count):
+        legacy_join(engine, sender, join_data)
+    legacy = time.perf_counter() - start
+
+    engine = populate(size)
+    sender = NullSender()
+    start = time.perf_counter()
+    for join_data in joins(count):
+        engine.handle_join_message(sender, join_data)
+    engine.flush_joins(sender)
+    coalesced = time.perf_counter() - start
+    return legacy, coalesced
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    legacy, coalesced = measure(size, count)
+    print(f"{count} joiners, {size} members")
+    print(f"  reply per joiner: {legacy * 1000:8.1f} ms")
+    print(f"  coalesced:        {coalesced * 1000:8.1f} ms "
+          f"({legacy / coalesced:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Memory held per member by the member list: the previous dict of Member
+TypedDicts (with address and status tuples) against MemberTable's slotted
+records.  Ids are UUIDs as in server_new.py and every member has its own
+IP address, the worst case for an observer that holds a whole cluster view.
+
+Usage: python benchmarks/bench_member_memory.py [members]
+"""
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from member_table import MemberTable  # noqa: E402
+from protocol import Member, Status  # noqa: E402
+
+PORT = 8000
+
+
+def host_of(index: int) -> str:
+    return f"10.{index // 65536}.{index // 256 % 256}.{index % 256}"
+
+
+def build_dicts(ids: list[str]) -> dict[str, Member]:
+    members: dict[str, Member] = {}
+    for index, member_id in enumerate(ids):
+        members[member_id] = Member(
+            id=member_id,
+            address=(host_of(index), PORT),
+            heartbeat=index + 1000,
+            time=time.time(),
+            status=(index + 1000, Status.ALIVE),
+            failed_time=0.0
+        )
+    return members
+
+
+def build_table(ids: list[str]) -> MemberTable:
+    table = MemberTable()
+    for index, member_id in enumerate(ids):
+        table.add(
+            member_id, host_of(index), PORT, index + 1000, time.time(),
+            index + 1000, Status.ALIVE
+        )
+    return table
+
+
+def measure(build, size: int) -> float:
+    """ Bytes allocated per member, ids included """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    ids = [str(uuid.uuid4()) for _ in range(size)]
+    members = build(ids)
+    del ids
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(members) == size
+    return (after - before) / size
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    dicts = measure(build_dicts, size)
+    table = measure(build_table, size)
+    print(f"{'members':>8} {'dict of Member':>15} {'MemberTable':>12} "
+          f"{'saved':>6}")
+    print(f"{size:>8} {dicts:>9.0f} B/mbr {table:>6.0f} B/mbr "
+          f"{1 - table / dicts:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Gossip target selection: the previous random.sample over a copy of every
+member (self and failed members included, then filtered out) against
+PeerSelector's shuffled round-robin order.
+
+For each we report the time per round, the average number of peers
+actually contacted per round and the longest any alive peer went without
+being contacted.
+
+Usage: python benchmarks/bench_peer_selection.py [rounds]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peers import PeerSelector  # noqa: E402
+
+SIZES = [10, 100, 1000, 10000]
+FANOUT = 4
+FAILED_SHARE = 0.1
+
+
+def members(size: int) -> dict[str, bool]:
+    """ member id -> failed, member-0 is us """
+    rng = random.Random(size)
+    return {
+        f"member-{i}": i > 0 and rng.random() < FAILED_SHARE
+        for i in range(size)
+    }
+
+
+def legacy_round(table: dict[str, bool], rng: random.Random) -> list[str]:
+    candidates = list(table.items())
+    selected = rng.sample(candidates, min(FANOUT, len(candidates)))
+    return [
+        member_id for member_id, failed in selected
+        if member_id != "member-0" and not failed
+    ]
+
+
+def measure(select, rounds: int, alive: int) -> tuple[float, float, int]:
+    last: dict[str, int] = {}
+    worst = 0
+    contacted = 0
+    start = time.perf_counter()
+    for round_number in range(rounds):
+        targets = select()
+        contacted += len(targets)
+        for member_id in targets:
+            worst = max(worst, round_number - last.get(member_id, -1))
+            last[member_id] = round_number
+    elapsed = time.perf_counter() - start
+    # peers never contacted count as waiting the whole run
+    if len(last) < alive:
+        worst = rounds
+    return elapsed / rounds, contacted / rounds, worst
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    for size in SIZES:
+        table = members(size)
+        alive = [
+            member_id for member_id, failed in table.items()
+            if member_id != "member-0" and not failed
+        ]
+
+        rng = random.Random(0)
+        legacy = measure(lambda: legacy_round(table, rng), rounds, len(alive))
+
+        selector = PeerSelector(random.Random(0))
+        for member_id in alive:
+            selector.add(member_id)
+        shuffled = measure(lambda: selector.take(FANOUT), rounds, len(alive))
+
+        print(f"{size} members, {len(alive)} alive peers, {rounds} rounds")
+        for name, (per_round, fanout, worst) in (
+            ("random.sample", legacy), ("round-robin", shuffled)
+        ):
+            print(f"  {name:>13}: {per_round * 1e6:8.1f} us/round, "
+                  f"{fanout:.2f} peers/round, longest gap {worst} rounds")
+
+
+if __name__ == "__main__":
+    main()
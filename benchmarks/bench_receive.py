@@ -0,0 +1,123 @@
+"""
+Receive throughput of the two server_new.py runtimes.
+
+A sender thread blasts gossip datagrams at a node bound on localhost and we
+count how many are decoded and merged per second by the threaded receive
+loop and by the asyncio runtime.
+
+Usage: python benchmarks/bench_receive.py [members] [seconds]
+"""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server_new  # noqa: E402
+from engine import MembershipEngine  # noqa: E402
+from protocol import (  # noqa: E402
+    Command, GossipMessage, Member, Status, encode_message
+)
+
+
+def make_datagram(members: int) -> bytes:
+    return encode_message(GossipMessage(
+        command=Command.GOSSIP,
+        data={
+            f"member-{i}": Member(
+                id=f"member-{i}",
+                address=("127.0.0.1", 9000 + i),
+                heartbeat=1,
+                time=0.0,
+                status=(0, Status.ALIVE),
+                failed_time=0.0
+            )
+            for i in range(members)
+        }
+    ))
+
+
+def bind() -> socket.socket:
+    node_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    node_socket.bind(("127.0.0.1", 0))
+    node_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    node_socket.settimeout(1.0)
+    return node_socket
+
+
+def blast(address, datagram: bytes, stop: threading.Event) -> None:
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    while not stop.is_set():
+        for _ in range(64):
+            sender.sendto(datagram, address)
+        time.sleep(0.001)
+    sender.close()
+
+
+def measure(runtime: str, members: int, seconds: float) -> float:
+    node_socket = bind()
+    engine = MembershipEngine(
+        "receiver", node_socket.getsockname(), node_socket.getsockname()
+    )
+    processed = [0]
+    merge = engine.handle_gossip_message
+
+    def counting_merge(message):
+        merge(message)
+        processed[0] += 1
+
+    engine.handle_gossip_message = counting_merge  # type: ignore
+
+    stop = threading.Event()
+
+    if runtime == "threaded":
+        threading.Thread(
+            target=server_new.handle_receiving_message,
+            args=(engine, node_socket),
+            daemon=True
+        ).start()
+    else:
+        async def serve():
+            task = asyncio.ensure_future(
+                server_new.serve_asyncio(engine, node_socket)
+            )
+            while not stop.is_set():
+                await asyncio.sleep(0.05)
+            task.cancel()
+
+        threading.Thread(
+            target=asyncio.run, args=(serve(),), daemon=True
+        ).start()
+
+    threading.Thread(
+        target=blast,
+        args=(node_socket.getsockname(), make_datagram(members), stop),
+        daemon=True
+    ).start()
+
+    time.sleep(0.2)
+    start_count, start = processed[0], time.perf_counter()
+    time.sleep(seconds)
+    rate = (processed[0] - start_count) / (time.perf_counter() - start)
+
+    stop.set()
+    return rate
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+    server_new.T_GOSSIP = server_new.T_UPDATE = 3600.0
+
+    for runtime in ("threaded", "asyncio"):
+        rate = measure(runtime, members, seconds)
+        print(f"{runtime:>9}: {rate:10.0f} messages/s "
+              f"({members} members each)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Cost of one member list update tick: the previous full scan of every member
+against MembershipEngine.update_member_list, which only touches members
+whose suspect/fail/cleanup deadline has passed.
+
+Members keep heartbeating (a merge every tick), so most ticks have nothing
+due and a few members time out along the way.
+
+Usage: python benchmarks/bench_sweep.py [ticks]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import MembershipEngine  # noqa: E402
+from protocol import Member, Status  # noqa: E402
+
+SIZES = [100, 1000, 10000, 100000]
+T_UPDATE = 0.1
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def populate(size: int, clock: Clock) -> MembershipEngine:
+    engine = MembershipEngine(
+        "member-0", ("localhost", 8000), ("localhost", 8000),
+        enable_suspicion=True, clock=clock
+    )
+    engine.merge_to_member_list({
+        f"member-{i}": Member(
+            id=f"member-{i}",
+            address=("localhost", 8000 + i % 1000),
+            heartbeat=1,
+            time=0.0,
+            status=(0, Status.ALIVE),
+            failed_time=0.0
+        )
+        for i in range(1, size)
+    })
+    return engine
+
+
+def legacy_update(engine: MembershipEngine) -> None:
+    now = engine.clock()
+    engine.lock.acquire()
+    for member_id, member in list(engine.member_list.items()):
+        if member_id == engine.id:
+            member.heartbeat += 1
+            member.time = now
+            continue
+        if (
+            member.status == Status.ALIVE and
+            now - member.time > engine.t_suspect
+        ):
+            member.status = Status.SUSPECTED
+        elif (
+            member.status == Status.SUSPECTED and
+            now - member.time > engine.t_fail
+        ):
+            member.status = Status.FAILED
+            member.failed_time = now
+        elif (
+            member.status == Status.FAILED and
+            now - member.failed_time > engine.t_cleanup
+        ):
+            engine.member_list.remove(member_id)
+    engine.lock.release()
+
+
+def heartbeat(engine: MembershipEngine, tick: int) -> None:
+    # every member but one in a hundred keeps heartbeating
+    for member_id, member in engine.member_list.items():
+        if hash(member_id) % 100:
+            member.heartbeat = tick
+            member.time = engine.clock()
+
+
+def measure(size: int, ticks: int, update) -> float:
+    clock = Clock()
+    engine = populate(size, clock)
+    spent = 0.0
+    for tick in range(ticks):
+        clock.now += T_UPDATE
+        heartbeat(engine, tick)
+        start = time.perf_counter()
+        update(engine)
+        spent += time.perf_counter() - start
+    return spent / ticks
+
+
+def main():
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    print(f"{'members':>8} {'full scan':>12} {'deadlines':>12} {'ratio':>7}")
+    for size in SIZES:
+        legacy = measure(size, ticks, legacy_update)
+        deadline = measure(
+            size, ticks, MembershipEngine.update_member_list
+        )
+        print(f"{size:>8} {legacy * 1e3:>9.3f} ms {deadline * 1e3:>9.3f} ms "
+              f"{legacy / deadline:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
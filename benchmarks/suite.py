@@ -0,0 +1,383 @@
+"""
+Microbenchmarks of the hot paths at 10 to 100k members, as JSON.
+
+Every case runs against a synthetic member list of N members that all
+keep heartbeating, so it measures the steady state a member spends most
+of its time in:
+
+* merge: MembershipEngine.merge_to_member_list of a table of all N
+  members, each with a newer heartbeat
+* gossip_round: one MembershipEngine.gossip_round after such a merge, the
+  encoding and sending done by handle_sending_gossip
+* sweep: one MembershipEngine.update_member_list after such a merge, the
+  tick of handle_updating_member_list
+* peer_take: the next fanout gossip targets from a PeerSelector
+* server_receive: what server.py's receiver() does with one datagram of
+  all N nodes: decode it, merge_received and publish the snapshot
+* server_sweep: one pass of server.py's failure_detector()
+
+Each case is repeated until it has run for --budget seconds (and at least
+MIN_RUNS times); the median and minimum time of one run are reported.
+Results go to stdout, or to --output, as JSON.  With --compare the
+results are checked against a stored baseline: a case whose median got
+slower by more than --threshold (and by more than NOISE_FLOOR seconds) is
+flagged as a regression, and the exit status is 1.
+
+Usage:
+    python benchmarks/suite.py -o baseline.json
+    python benchmarks/suite.py --compare baseline.json
+    python benchmarks/suite.py -s 10 1000 -c merge sweep --budget 0.2
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+from typing import Any, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+from engine import MembershipEngine  # noqa: E402
+from metrics import EngineMetrics  # noqa: E402
+from peers import PeerSelector  # noqa: E402
+from protocol import (  # noqa: E402
+    Member, Status, decode_node_table, encode_node_table
+)
+from util import Logger  # noqa: E402
+
+SIZES = [10, 100, 1000, 10000, 100000]
+FANOUT = 4
+T_UPDATE = 0.1
+MIN_RUNS = 5
+DEFAULT_BUDGET = 0.5        # timed seconds per case and size
+DEFAULT_THRESHOLD = 0.25    # slowdown flagged as a regression
+NOISE_FLOOR = 2e-6          # slowdowns below this many seconds are noise
+
+# a case prepares a member list of the given size and returns the setup
+# to run before every timed run, outside the timing, and the run itself
+Case = Callable[[int], tuple[Callable[[], None], Callable[[], None]]]
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class NullSender(object):
+    def sendto(self, data: bytes, address) -> int:
+        return len(data)
+
+
+class NullLog(object):
+    def log(self, message: str, **fields) -> None:
+        pass
+
+
+# ENGINE
+
+
+def member_table(size: int, heartbeat: int) -> dict[str, Member]:
+    return {
+        f"member-{i}": Member(
+            id=f"member-{i}",
+            address=(f"10.0.{i // 256 % 256}.{i % 256}", 8000),
+            heartbeat=heartbeat,
+            time=0.0,
+            status=(0, Status.ALIVE),
+            failed_time=0.0
+        )
+        for i in range(1, size)
+    }
+
+
+class EngineFixture(object):
+    """ An engine of size members and a table that heartbeats all of them """
+
+    def __init__(self, size: int):
+        self.clock = Clock()
+        self.engine = MembershipEngine(
+            "member-0", ("10.0.0.0", 8000), ("10.0.0.0", 8000),
+            enable_suspicion=True, fanout=FANOUT, clock=self.clock,
+            rng=random.Random(0), logger=Logger(0)
+        )
+        self.heartbeat = 1
+        self.table = member_table(size, self.heartbeat)
+        self.engine.merge_to_member_list(self.table)
+
+    def advance(self) -> None:
+        """ Move time on by one tick and give every member a heartbeat """
+        self.clock.now += T_UPDATE
+        self.heartbeat += 1
+        for member in self.table.values():
+            member["heartbeat"] = self.heartbeat
+
+    def merge(self) -> None:
+        self.advance()
+        self.engine.merge_to_member_list(self.table)
+
+
+def merge_case(size: int) -> tuple[Callable[[], None], Callable[[], None]]:
+    fixture = EngineFixture(size)
+    return fixture.advance, lambda: fixture.engine.merge_to_member_list(
+        fixture.table
+    )
+
+
+def gossip_round_case(
+    size: int
+) -> tuple[Callable[[], None], Callable[[], None]]:
+    fixture = EngineFixture(size)
+    sender = NullSender()
+    return fixture.merge, lambda: fixture.engine.gossip_round(sender)
+
+
+def sweep_case(size: int) -> tuple[Callable[[], None], Callable[[], None]]:
+    fixture = EngineFixture(size)
+    return fixture.merge, fixture.engine.update_member_list
+
+
+def peer_take_case(
+    size: int
+) -> tuple[Callable[[], None], Callable[[], None]]:
+    selector = PeerSelector(random.Random(0))
+    for i in range(1, size):
+        selector.add(f"member-{i}")
+    return lambda: None, lambda: selector.take(FANOUT)
+
+
+# SERVER.PY
+
+
+def node_table(
+    size: int,
+    heartbeat: int,
+    local_clock: int,
+    first: int = 1
+) -> dict:
+    """ node first to node size, all online """
+    return {
+        f"node{i}": {
+            "heartbeat_counter": heartbeat,
+            "local_clock": local_clock,
+            "timestamp": 0,
+            "version_id": 0,
+            "status": "online",
+            "incarnation": 0,
+        }
+        for i in range(first, size + 1)
+    }
+
+
+def load_server(size: int) -> None:
+    """
+    Set up server.py's module state as its main block does, as node1 of
+    a cluster of size nodes that all know each other
+    """
+    server.NODES = {
+        f"node{i}": ("127.0.0.1", 8010 + i) for i in range(1, size + 1)
+    }
+    server.node_name = "node1"
+    server.status = "online"
+    server.suspicion = True
+    server.metrics = EngineMetrics()
+    server.lock = server.metrics.lock()
+    server.event_log = NullLog()
+    server.recorder = None
+    server.membership_list = node_table(size, 1, 0)
+    server.membership_snapshot = {}
+    server.failed_nodes = server.DeadlineQueue()
+    server.suspected_nodes = server.DeadlineQueue()
+    server.readytoremove_nodes = server.DeadlineQueue()
+    server.pending_joins = set()
+    server.peers = PeerSelector(random.Random(0))
+    for node in server.NODES:
+        server.track_peer(node)
+    server.publish_snapshot()
+
+
+def server_receive_case(
+    size: int
+) -> tuple[Callable[[], None], Callable[[], None]]:
+    load_server(size)
+    datagram = [b""]
+    heartbeat = [1]
+
+    def setup() -> None:
+        # every node but us, as gossiped by a peer
+        heartbeat[0] += 1
+        datagram[0] = encode_node_table(
+            node_table(size, heartbeat[0], 0, first=2)
+        )
+
+    def run() -> None:
+        # the body of receiver() after recvfrom
+        received_list = decode_node_table(datagram[0])
+        server.lock.acquire()
+        server.merge_received(received_list)
+        server.publish_snapshot()
+        server.lock.release()
+
+    return setup, run
+
+
+def server_sweep_case(
+    size: int
+) -> tuple[Callable[[], None], Callable[[], None]]:
+    load_server(size)
+
+    def setup() -> None:
+        # a gossip round: every node heard from since the last pass
+        local_clock = server.membership_list["node1"]["local_clock"] + 1
+        for node_data in server.membership_list.values():
+            node_data["local_clock"] = local_clock
+
+    return setup, lambda: server.detect_failures("node1")
+
+
+CASES: dict[str, Case] = {
+    "merge": merge_case,
+    "gossip_round": gossip_round_case,
+    "sweep": sweep_case,
+    "peer_take": peer_take_case,
+    "server_receive": server_receive_case,
+    "server_sweep": server_sweep_case,
+}
+
+
+# RUNNING AND COMPARING
+
+
+def measure(case: Case, size: int, budget: float) -> dict[str, Any]:
+    """
+    Time one case at one size
+
+    Args:
+        case (Case): the case
+        size (int): members in the member list
+        budget (float): timed seconds to spend, at least MIN_RUNS runs
+
+    Returns:
+        dict[str, Any]: the median and minimum seconds of a run, and the
+            number of runs
+    """
+    setup, run = case(size)
+    timings: list[float] = []
+    deadline = time.perf_counter() + 10 * budget   # setups count here
+    gc.collect()
+    while len(timings) < MIN_RUNS or (
+        sum(timings) < budget and time.perf_counter() < deadline
+    ):
+        setup()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return {
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "runs": len(timings),
+    }
+
+
+def compare(
+    results: dict[str, dict[str, dict[str, Any]]],
+    baseline: dict[str, dict[str, dict[str, Any]]],
+    threshold: float
+) -> list[dict[str, Any]]:
+    """
+    The cases whose median got slower than in the baseline
+
+    Args:
+        results: case -> size -> measurement, see measure
+        baseline: the same, from a previous run
+        threshold (float): the relative slowdown tolerated
+
+    Returns:
+        list[dict[str, Any]]: the regressions, cases or sizes missing from
+            the baseline are not compared
+    """
+    regressions = []
+    for name, sizes in results.items():
+        for size, measurement in sizes.items():
+            before = baseline.get(name, {}).get(size)
+            if before is None:
+                continue
+            old, new = before["median"], measurement["median"]
+            if new > old * (1 + threshold) and new - old > NOISE_FLOOR:
+                regressions.append({
+                    "case": name,
+                    "members": int(size),
+                    "baseline": old,
+                    "median": new,
+                    "change": new / old - 1,
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks of the membership hot paths"
+    )
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=SIZES,
+                        help="Member list sizes")
+    parser.add_argument("-c", "--cases", type=str, nargs="+",
+                        choices=list(CASES), default=list(CASES))
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="Timed seconds per case and size")
+    parser.add_argument("-o", "--output", type=str,
+                        help="Write the results to this file")
+    parser.add_argument("--compare", type=str,
+                        help="Flag regressions against this baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+
+    results: dict[str, dict[str, dict[str, Any]]] = {}
+    for name in args.cases:
+        results[name] = {}
+        for size in args.sizes:
+            measurement = measure(CASES[name], size, args.budget)
+            # JSON object keys are strings, keep them so in memory too
+            results[name][str(size)] = measurement
+            print(f"{name:>15} {size:>7}: {measurement['median'] * 1e6:12.1f}"
+                  f" us median, {measurement['runs']} runs", file=sys.stderr)
+
+    report: dict[str, Any] = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if baseline is not None:
+        report["regressions"] = compare(results, baseline, args.threshold)
+        for regression in report["regressions"]:
+            print(f"REGRESSION {regression['case']} "
+                  f"{regression['members']}: "
+                  f"{regression['baseline'] * 1e6:.1f} us -> "
+                  f"{regression['median'] * 1e6:.1f} us "
+                  f"(+{regression['change']:.0%})", file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
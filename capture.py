@@ -0,0 +1,143 @@
+"""
+Capture of inbound datagrams, for replaying real traffic offline.
+
+A member started with a trace file appends every datagram it receives,
+with the time it arrived and where it came from, before handling it.
+replay.py feeds such a trace back through a fresh engine, so changes to
+the merge path can be measured (and checked for regressions) against
+the load a production member actually saw.
+
+A trace is a header naming what was recorded, followed by one record per
+datagram:
+
+    magic:6s  version:u8  kind:u8  id_length:u16  id       header
+    time:f64  host:4s  port:u16  length:u32  datagram      record
+
+kind tells engine messages (server_new.py) from server.py node tables,
+id is the recording member, so a replay can take its place, and host is
+the packed IPv4 source address.  Records are buffered and flushed every
+FLUSH_INTERVAL seconds; a member killed mid-write leaves a truncated last
+record, which read_trace ignores.
+"""
+import socket
+import struct
+import threading
+import time
+
+from enum import Enum
+from typing import BinaryIO, Iterator
+
+MAGIC = b"GTRACE"
+FORMAT_VERSION = 1
+FLUSH_INTERVAL = 1.0    # seconds of records a killed member may lose
+BUFFER_SIZE = 1 << 16
+
+_HEADER = struct.Struct("!6sBBH")
+_RECORD = struct.Struct("!d4sHI")
+
+Address = tuple[str, int]
+
+
+class TraceKind(Enum):
+    ENGINE = 0      # engine messages, see protocol.decode_message
+    NODE_TABLE = 1  # server.py node tables, see protocol.decode_node_table
+
+
+class TraceError(Exception):
+    """ The file is not a trace this version can read """
+
+
+def pack_host(host: str) -> bytes:
+    try:
+        return socket.inet_aton(host)
+    except OSError:
+        return bytes(4)     # not an IPv4 address, recorded as 0.0.0.0
+
+
+class TraceRecorder(object):
+    def __init__(self, path: str, kind: TraceKind, member_id: str):
+        """
+        Args:
+            path (str): the trace file, truncated if it exists
+            kind (TraceKind): what the recorded datagrams are
+            member_id (str): the recording member
+        """
+        name = member_id.encode()
+        self.file: BinaryIO = open(path, "wb", buffering=BUFFER_SIZE)
+        self.file.write(_HEADER.pack(
+            MAGIC, FORMAT_VERSION, kind.value, len(name)
+        ))
+        self.file.write(name)
+        self.file.flush()
+        self.flushed = time.monotonic()
+        self.records = 0
+        self.lock = threading.Lock()
+
+    def record(self, data: bytes | memoryview, address: Address) -> None:
+        """
+        Append one received datagram
+
+        Args:
+            data (bytes | memoryview): the datagram, copied into the buffer
+            address (Address): where it came from
+        """
+        host, port = address[0], address[1]
+        self.lock.acquire()
+        if not self.file.closed:
+            self.file.write(_RECORD.pack(
+                time.time(), pack_host(host), port, len(data)
+            ))
+            self.file.write(data)
+            self.records += 1
+            now = time.monotonic()
+            if now - self.flushed >= FLUSH_INTERVAL:
+                self.file.flush()
+                self.flushed = now
+        self.lock.release()
+
+    def close(self) -> None:
+        self.lock.acquire()
+        self.file.close()
+        self.lock.release()
+
+
+class TraceReader(object):
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): the trace file
+
+        Raises:
+            TraceError: if it is not a trace
+        """
+        self.file: BinaryIO = open(path, "rb")
+        header = self.file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            self.file.close()
+            raise TraceError("truncated header")
+        magic, version, kind, length = _HEADER.unpack(header)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.file.close()
+            raise TraceError(f"not a version {FORMAT_VERSION} trace")
+        try:
+            self.kind = TraceKind(kind)
+        except ValueError:
+            self.file.close()
+            raise TraceError(f"unknown trace kind {kind}")
+        self.member_id = self.file.read(length).decode()
+
+    def __iter__(self) -> Iterator[tuple[float, bytes, Address]]:
+        """ (arrival time, datagram, source address) of every record """
+        read = self.file.read
+        while True:
+            header = read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            arrived, host, port, length = _RECORD.unpack(header)
+            data = read(length)
+            if len(data) < length:
+                return
+            yield arrived, data, (socket.inet_ntoa(host), port)
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,76 @@
+"""
+A min-heap of per-key deadlines.
+
+Each key has at most one live deadline.  Rescheduling or cancelling a key
+does not search the heap: the key's generation is bumped and the stale heap
+entry is skipped when it surfaces, so every operation is O(log n) and a
+sweep only touches keys whose deadlines have passed.
+"""
+import heapq
+import itertools
+
+from typing import Hashable, Iterator
+
+# rebuild the heap when stale entries outnumber live ones by this factor
+COMPACT_FACTOR = 4
+
+
+class DeadlineQueue(object):
+    def __init__(self):
+        self.heap: list[tuple[float, int, Hashable]] = []
+        self.generations: dict[Hashable, int] = {}
+        self.counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.generations)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.generations
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        """
+        Set (or move) the deadline of key
+
+        Args:
+            key (Hashable): the key, e.g. a member id
+            deadline (float): when the key expires
+        """
+        generation = next(self.counter)
+        self.generations[key] = generation
+        heapq.heappush(self.heap, (deadline, generation, key))
+
+        if len(self.heap) > COMPACT_FACTOR * (len(self.generations) + 16):
+            self.compact()
+
+    def cancel(self, key: Hashable) -> None:
+        self.generations.pop(key, None)
+
+    def next_deadline(self) -> float | None:
+        """ The earliest live deadline, or None if nothing is scheduled """
+        heap = self.heap
+        while heap and self.generations.get(heap[0][2]) != heap[0][1]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_expired(self, now: float) -> Iterator[Hashable]:
+        """
+        Remove and yield every key whose deadline is before now.  Keys can
+        be rescheduled while iterating.
+
+        Args:
+            now (float): the current time
+        """
+        heap = self.heap
+        generations = self.generations
+        while heap and heap[0][0] < now:
+            _, generation, key = heapq.heappop(heap)
+            if generations.get(key) == generation:
+                del generations[key]
+                yield key
+
+    def compact(self) -> None:
+        self.heap = [
+            entry for entry in self.heap
+            if self.generations.get(entry[2]) == entry[1]
+        ]
+        heapq.heapify(self.heap)
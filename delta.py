@@ -0,0 +1,130 @@
+"""
+Per-peer delta tracking for gossip.
+
+Every local change to a member (new entry, heartbeat or status update)
+stamps that member with the next value of a local version counter.  Each
+gossip message carries the sender's current version and an acknowledgement
+of the highest version it has merged from the receiver, so a sender only
+has to ship entries that changed after the receiver's last acknowledgement.
+
+Because every delta is computed from the acknowledged version rather than
+from what was last sent, losing a datagram never loses an update: the next
+delta to the same peer carries it again.  A full list is still sent to a
+peer every ``full_sync_interval`` rounds (and whenever nothing has been
+acknowledged yet) to repair anything that slipped through, e.g. a peer that
+restarted or removed an entry during cleanup, or the entries of a lost
+datagram of a round whose other datagrams arrived: they all advertise the
+same version.
+"""
+from collections.abc import Mapping
+from typing import TypeVar
+
+from util import if_then_else
+
+T = TypeVar("T")
+
+DEFAULT_FULL_SYNC_INTERVAL = 10
+
+
+class DeltaTracker(object):
+    def __init__(self, full_sync_interval: int = DEFAULT_FULL_SYNC_INTERVAL):
+        self.full_sync_interval = full_sync_interval
+        self.version = 0
+        # member id -> local version of its last change
+        self.versions: dict[str, int] = {}
+        # peer id -> highest local version the peer has acknowledged
+        self.acked: dict[str, int] = {}
+        # peer id -> highest version of the peer's we have merged
+        self.received: dict[str, int] = {}
+        # peer id -> rounds since we last sent the peer a full list
+        self.rounds_since_full: dict[str, int] = {}
+
+    def touch(self, member_id: str) -> None:
+        """
+        Record that a member changed locally
+
+        Args:
+            member_id (str): the member that changed
+        """
+        self.version += 1
+        self.versions[member_id] = self.version
+
+    def forget(self, member_id: str) -> None:
+        """
+        Drop all tracking for a member removed from the member list
+
+        Args:
+            member_id (str): the removed member
+        """
+        self.versions.pop(member_id, None)
+        self.acked.pop(member_id, None)
+        self.received.pop(member_id, None)
+        self.rounds_since_full.pop(member_id, None)
+
+    def on_receive(self, peer_id: str, peer_version: int, ack: int) -> None:
+        """
+        Update peer state from the header of a received gossip message
+
+        Args:
+            peer_id (str): the sender
+            peer_version (int): the sender's version when it sent
+            ack (int): the highest of our versions the sender has merged
+        """
+        self.received[peer_id] = max(
+            self.received.get(peer_id, 0),
+            peer_version
+        )
+        # plain assignment so that a restarted peer (ack 0) gets a full list
+        self.acked[peer_id] = ack
+
+    def ack_for(self, peer_id: str) -> int:
+        return self.received.get(peer_id, 0)
+
+    def select(
+        self,
+        peer_ids: list[str],
+        members: Mapping[str, T]
+    ) -> tuple[Mapping[str, T], int]:
+        """
+        Choose the entries to send this round.  All targets of a round get
+        the same entries, so the round can be encoded once: the delta is
+        taken from the lowest acknowledgement among them, and everyone gets
+        the full list if any target is due for one.
+
+        The base is returned so that a sender that cannot fit every entry
+        in one datagram can advertise the version up to which it sent them
+        instead (see MembershipEngine.pack_records): the targets then
+        acknowledge only that far and the rest stays in later deltas.
+
+        Args:
+            peer_ids (list[str]): the gossip targets
+            members (Mapping): the full member list
+
+        Returns:
+            tuple[Mapping, int]: the entries to send and the acknowledged
+                version they were taken from
+        """
+        interval = self.full_sync_interval
+        base = min(
+            (self.acked.get(peer_id, 0) for peer_id in peer_ids),
+            default=0
+        )
+        full = base == 0 or any(
+            self.rounds_since_full.get(peer_id, interval) >= interval
+            for peer_id in peer_ids
+        )
+
+        for peer_id in peer_ids:
+            self.rounds_since_full[peer_id] = if_then_else(
+                full, 1, self.rounds_since_full.get(peer_id, 0) + 1
+            )
+
+        if full:
+            return members, base
+
+        versions = self.versions
+        return {
+            member_id: member
+            for member_id, member in members.items()
+            if versions.get(member_id, 0) > base
+        }, base
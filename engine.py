@@ -0,0 +1,1000 @@
+"""
+The gossip membership engine.
+
+MembershipEngine holds everything one member of the cluster knows: its own
+identity, the member list and the per-peer delta state.  It does no I/O of
+its own; a runtime feeds it received datagrams, calls gossip_round and
+update_member_list on a timer, and hands it something with a sendto method
+(a UDP socket, an asyncio transport or a simulated network) to send with.
+Time comes from an injectable clock so that many engines can share one
+process and a virtual clock (see simulator.py).
+"""
+import heapq
+import random
+import socket
+import threading
+import time
+
+from collections.abc import Mapping
+from enum import Enum
+from typing import Any, Callable, Protocol, cast
+
+from deadlines import DeadlineQueue
+from delta import DeltaTracker, DEFAULT_FULL_SYNC_INTERVAL
+from member_table import (
+    MemberRecord, MemberTable, MemberView, MembershipSnapshot
+)
+from metrics import EngineMetrics, MetricsRegistry
+from peers import PeerSelector
+from phi import PhiAccrualDetector, DEFAULT_PHI_THRESHOLD
+from protocol import (
+    Command, Status, Member, JoinMessageData, LeaveMessageData,
+    LeaveMessage, JoinMessage, GossipMessage, Message, WireFormat,
+    PingMessage, PingMessageData, PingReqMessage, PingReqMessageData,
+    AckMessage, AckMessageData,
+    DecodeError, GossipBudget, GossipEncoder, GossipRecord, DEFAULT_MTU,
+    encode_message, decode_message, paginate_records
+)
+from swim import (
+    Detector, ProbeScheduler, DEFAULT_T_PROBE, DEFAULT_T_ACK,
+    DEFAULT_INDIRECT_PROBES
+)
+from util import Logger, if_then_else
+
+# DEFAULTS
+
+DEFAULT_T_GOSSIP = 0.5
+DEFAULT_T_SUSPECT = 1.0   # After 2 * T_GOSSIP, suspect
+DEFAULT_T_FAIL = 2.0      # After 4 * T_GOSSIP, fail
+DEFAULT_T_CLEANUP = 2.0   # When failed, cleanup after 2.0 seconds
+DEFAULT_T_UPDATE = 0.1
+DEFAULT_FANOUT = 4
+DEFAULT_T_PUBLISH = 0.5   # republish the membership snapshot this often
+
+# datagrams of at most mtu bytes a gossip round may send to each target
+DEFAULT_MAX_PAGES = 16
+
+# share of a full round given to the most recently changed entries
+RECENT_SHARE = 0.5
+
+
+class DatagramSender(Protocol):
+    """ A UDP socket, an asyncio datagram transport or a simulated link """
+
+    def sendto(self, data: Any, address: Any, /) -> Any: ...
+
+
+class MemberEvent(Enum):
+    JOINED = 0
+    SUSPECTED = 1
+    ALIVE = 2       # a suspected member was heard from again
+    FAILED = 3
+    REMOVED = 4
+
+
+# (event, member id); listeners are called with the engine lock held
+MemberListener = Callable[[MemberEvent, str], None]
+
+
+class MembershipEngine(object):
+    def __init__(
+        self,
+        member_id: str,
+        address: tuple[str, int],
+        introducer: tuple[str, int],
+        t_suspect: float = DEFAULT_T_SUSPECT,
+        t_fail: float = DEFAULT_T_FAIL,
+        t_cleanup: float = DEFAULT_T_CLEANUP,
+        fanout: int = DEFAULT_FANOUT,
+        t_publish: float = DEFAULT_T_PUBLISH,
+        enable_suspicion: bool = False,
+        detector: Detector = Detector.HEARTBEAT,
+        t_probe: float = DEFAULT_T_PROBE,
+        t_ack: float = DEFAULT_T_ACK,
+        indirect_probes: int = DEFAULT_INDIRECT_PROBES,
+        phi_threshold: float = DEFAULT_PHI_THRESHOLD,
+        full_sync_interval: int = DEFAULT_FULL_SYNC_INTERVAL,
+        wire_format: WireFormat = WireFormat.BINARY,
+        mtu: int = DEFAULT_MTU,
+        max_pages: int = DEFAULT_MAX_PAGES,
+        message_drop_rate: float = 0.0,
+        clock: Callable[[], float] = time.time,
+        rng: random.Random | None = None,
+        logger: Logger | None = None,
+        metrics: MetricsRegistry | None = None,
+        seeds: list[tuple[str, int]] | None = None,
+    ):
+        self.id = member_id
+        self.address = address
+        self.introducer = introducer
+        # where to join through: the introducer first, then other seeds
+        self.seeds = [introducer] + [
+            seed for seed in (seeds or []) if seed != introducer
+        ]
+        self.is_online = True
+
+        self.t_suspect = t_suspect
+        self.t_fail = t_fail
+        self.t_cleanup = t_cleanup
+        self.fanout = fanout
+        self.t_publish = t_publish
+        self.enable_suspicion = enable_suspicion
+        self.detector = detector
+        self.wire_format = wire_format
+        self.mtu = mtu
+        self.max_pages = max(1, max_pages)
+        self.message_drop_rate = message_drop_rate
+
+        self.clock = clock
+        self.rng = rng if rng is not None else random.Random()
+        self.logger = logger if logger is not None else Logger(1)
+
+        self.metrics = EngineMetrics(metrics)
+        self.metrics.count_members(lambda: [
+            member.status for member in self.snapshot.members.values()
+        ])
+
+        self.member_list = MemberTable()
+        self.lock = self.metrics.lock()
+        self.deltas = DeltaTracker(full_sync_interval)
+        self.deadlines = DeadlineQueue()
+        self.encoder = GossipEncoder(wire_format)
+        # where the next round resumes covering entries that did not fit
+        self.rotation = 0
+        # answers probes in every mode, only probes in Detector.SWIM
+        self.probes = ProbeScheduler(
+            t_probe, t_ack, indirect_probes, self.rng
+        )
+        # heartbeat arrival history, only kept in Detector.PHI
+        self.phi = PhiAccrualDetector(phi_threshold, first_interval=t_suspect)
+        # shuffled round-robin order of gossip targets
+        self.peers = PeerSelector(self.rng)
+        self.listeners: list[MemberListener] = [self.track_peer]
+        # joiner id -> address, answered together by flush_joins
+        self.pending_joins: dict[str, tuple[str, int]] = {}
+
+        # members changed since the last published snapshot
+        self.dirty: set[str] = set()
+        self.publish_lock = threading.Lock()
+        self.snapshot = MembershipSnapshot(0, {}, self.clock())
+
+        # remember to put yourself in the member list
+        self.member_list.add(
+            self.id, self.address[0], self.address[1], 0, self.clock(),
+            0, Status.ALIVE
+        )
+        self.dirty.add(self.id)
+        self.publish()
+
+    @property
+    def is_introducer(self) -> bool:
+        return self.address == self.introducer
+
+    def join_seeds(self) -> list[tuple[str, int]]:
+        """ The seeds to try joining through, in order """
+        return [seed for seed in self.seeds if seed != self.address]
+
+    def add_listener(self, listener: MemberListener) -> None:
+        self.listeners.append(listener)
+
+    def emit(self, event: MemberEvent, member_id: str) -> None:
+        for listener in self.listeners:
+            listener(event, member_id)
+
+    def track_peer(self, event: MemberEvent, member_id: str) -> None:
+        """
+        Keep the gossip and probe target orders to the members that are
+        neither us nor failed, a listener called with lock acquired
+        """
+        if member_id == self.id:
+            return
+        if event in (MemberEvent.FAILED, MemberEvent.REMOVED):
+            self.peers.remove(member_id)
+            self.probes.peers.remove(member_id)
+        else:
+            self.peers.add(member_id)
+            self.probes.peers.add(member_id)
+
+    def touch(self, member_id: str) -> None:
+        """
+        Record a change to a member for delta gossip and the next
+        snapshot, must be called with lock acquired
+        """
+        self.deltas.touch(member_id)
+        self.dirty.add(member_id)
+
+    def publish(self) -> MembershipSnapshot:
+        """
+        Publish a snapshot with every change made since the last one.
+
+        The lock is held only to copy the changed members; the new snapshot
+        is built from the previous one outside it and then swapped in with
+        a single assignment, which readers of self.snapshot never block on.
+
+        Returns:
+            MembershipSnapshot: the current snapshot
+        """
+        self.publish_lock.acquire()
+
+        self.lock.acquire()
+        changes: dict[str, MemberView | None] = {}
+        for member_id in self.dirty:
+            member = self.member_list.get(member_id)
+            changes[member_id] = None if member is None else member.view()
+        self.dirty = set()
+        now = self.clock()
+        self.lock.release()
+
+        if changes:
+            self.snapshot = self.snapshot.apply(changes, now)
+
+        self.publish_lock.release()
+        return self.snapshot
+
+    def de_suspect(self, status: Status) -> Status:
+        return if_then_else(
+            status == Status.SUSPECTED and self.enable_suspicion,
+            Status.ALIVE,
+            status
+        )
+
+    def mark_as_suspected(self, member: MemberRecord) -> None:
+        """
+        Mark a member as suspected, must be called with lock acquired
+
+        Args:
+            member (MemberRecord): the member to be marked as suspected
+        """
+        self.metrics.transition(member.status, Status.SUSPECTED)
+        member.status = Status.SUSPECTED
+        self.touch(member.id)
+        self.schedule_deadline(member)
+        self.emit(MemberEvent.SUSPECTED, member.id)
+
+    def mark_as_failed(self, member: MemberRecord) -> None:
+        """
+        Mark a member as failed, must be called with lock acquired
+
+        Args:
+            member (MemberRecord): the member to be marked as failed
+        """
+        self.metrics.transition(member.status, Status.FAILED)
+        member.status = Status.FAILED
+        member.failed_time = self.clock()
+        self.touch(member.id)
+        self.schedule_deadline(member)
+        self.emit(MemberEvent.FAILED, member.id)
+
+    def merge_to_member_list(
+        self,
+        gossip_member_list: dict[str, Member]
+    ) -> None:
+        """
+        Merge a (possibly partial) gossiped member list into the local one.
+        Members missing from the gossip are left untouched, and known
+        members are updated in place.
+
+        Args:
+            gossip_member_list (dict[str, Member]): the gossiped entries
+        """
+        member_list = self.member_list
+        now = self.clock()
+
+        self.lock.acquire()
+        start = time.perf_counter()
+
+        for member_id, new_member in gossip_member_list.items():
+            new_incarnation, new_status = new_member["status"]
+            new_status = self.de_suspect(new_status)
+            old_member = member_list.get(member_id)
+
+            if old_member is None:
+                # new member
+
+                if new_status == Status.FAILED:
+                    # a delta may still carry a member we already cleaned up
+                    continue
+
+                host, port = new_member["address"]
+                old_member = member_list.add(
+                    member_id, host, port, new_member["heartbeat"], now,
+                    new_incarnation, new_status
+                )
+                if self.detector == Detector.PHI:
+                    self.phi.heartbeat(member_id, now)
+                self.touch(member_id)
+                self.schedule_deadline(old_member)
+                self.emit(MemberEvent.JOINED, member_id)
+                continue
+
+            changed = False
+            old_status = old_member.status
+
+            # heartbeat rule
+            if new_member["heartbeat"] > old_member.heartbeat:
+                old_member.heartbeat = new_member["heartbeat"]
+                old_member.time = now
+                changed = True
+                if self.detector == Detector.PHI:
+                    self.phi.heartbeat(member_id, now)
+
+            # incarnation rule
+            if (
+                new_status == Status.FAILED or
+                new_incarnation > old_member.incarnation or (
+                    new_incarnation == old_member.incarnation and
+                    new_status == Status.SUSPECTED
+                )
+            ):
+                changed = changed or (
+                    new_incarnation != old_member.incarnation or
+                    new_status != old_status
+                )
+                old_member.incarnation = new_incarnation
+                old_member.status = new_status
+
+            if changed:
+                self.touch(member_id)
+
+            if old_member.status != old_status:
+                self.schedule_deadline(old_member)
+                self.emit_status(member_id, old_member.status)
+
+        self.metrics.merge_seconds.observe(time.perf_counter() - start)
+        self.lock.release()
+
+    def emit_status(self, member_id: str, status: Status) -> None:
+        self.emit({
+            Status.ALIVE: MemberEvent.ALIVE,
+            Status.SUSPECTED: MemberEvent.SUSPECTED,
+            Status.FAILED: MemberEvent.FAILED,
+        }[status], member_id)
+
+    def schedule_deadline(self, member: MemberRecord) -> None:
+        """
+        Arm the next suspect, fail or cleanup deadline of a member, must be
+        called with lock acquired
+
+        Args:
+            member (MemberRecord): the member whose status or times changed
+        """
+        member_id = member.id
+        status = member.status
+
+        if member_id == self.id:
+            self.deadlines.cancel(member_id)
+        elif status == Status.ALIVE:
+            timeout = self.suspect_timeout(member_id)
+            if timeout is not None:
+                self.deadlines.schedule(member_id, member.time + timeout)
+            else:
+                self.deadlines.cancel(member_id)
+        elif status == Status.SUSPECTED:
+            self.deadlines.schedule(member_id, member.time + self.t_fail)
+        else:
+            self.deadlines.schedule(
+                member_id, member.failed_time + self.t_cleanup
+            )
+
+    def suspect_timeout(self, member_id: str) -> float | None:
+        """
+        How long after its last heartbeat an alive member is given up on,
+        must be called with lock acquired
+
+        Args:
+            member_id (str): the member
+
+        Returns:
+            float | None: the timeout, None if heartbeats never time out
+                (under SWIM only a failed probe suspects an alive member)
+        """
+        if self.detector == Detector.PHI:
+            return self.phi.timeout(member_id)
+        if self.detector == Detector.HEARTBEAT and self.enable_suspicion:
+            return self.t_suspect
+        return None
+
+    def update_member_list(self) -> None:
+        """
+        Bump our own heartbeat and advance suspect/fail/cleanup timers.
+
+        Only members whose deadline has passed are looked at.  Heartbeats
+        merged since a deadline was armed simply move it forward here.
+        Changes are published in a new snapshot every t_publish.
+        """
+        now = self.clock()
+
+        self.lock.acquire()
+        start = time.perf_counter()
+
+        member = self.member_list[self.id]
+        member.heartbeat += 1
+        member.time = now
+        member.incarnation += 1
+        member.status = Status.ALIVE
+        self.touch(self.id)
+
+        for member_id in list(self.deadlines.pop_expired(now)):
+            member = self.member_list.get(member_id)
+            if member is None:
+                continue
+
+            timeout = self.suspect_timeout(member_id)
+            if (
+                member.status == Status.ALIVE and
+                timeout is not None and
+                now - member.time >= timeout
+            ):
+                # phi without the suspicion strategy fails members outright
+                if self.enable_suspicion:
+                    self.mark_as_suspected(member)
+                else:
+                    self.mark_as_failed(member)
+            elif (
+                member.status == Status.SUSPECTED and
+                now - member.time > self.t_fail
+            ):
+                self.mark_as_failed(member)
+            elif (
+                member.status == Status.FAILED and
+                now - member.failed_time > self.t_cleanup
+            ):
+                self.member_list.remove(member_id)
+                self.deltas.forget(member_id)
+                self.phi.forget(member_id)
+                self.dirty.add(member_id)
+                self.emit(MemberEvent.REMOVED, member_id)
+                continue
+
+            self.schedule_deadline(member)
+
+        self.metrics.sweep_seconds.observe(time.perf_counter() - start)
+        self.lock.release()
+
+        if now - self.snapshot.time >= self.t_publish:
+            self.publish()
+
+    def join_message(self) -> bytes:
+        """ The datagram to send to the introducer to join """
+        return encode_message(JoinMessage(
+            command=Command.JOIN,
+            data=JoinMessageData(
+                id=self.id,
+                host=self.address[0],
+                port=self.address[1],
+            )
+        ), self.wire_format)
+
+    def leave_message(self) -> bytes:
+        """ The datagram telling members we are leaving """
+        return encode_message(LeaveMessage(
+            command=Command.LEAVE,
+            data=LeaveMessageData(id=self.id)
+        ), self.wire_format)
+
+    def admit(self, join_data: JoinMessageData) -> None:
+        """ Add a joiner to the member list unless it is already known """
+        if join_data["id"] in self.member_list:
+            return
+        self.merge_to_member_list({
+            join_data["id"]: Member(
+                id=join_data["id"],
+                address=(join_data["host"], join_data["port"]),
+                heartbeat=0,
+                time=self.clock(),
+                status=(0, Status.ALIVE),
+                failed_time=0.0
+            )
+        })
+
+    def handle_join_message(
+        self,
+        sender: DatagramSender,
+        join_data: JoinMessageData
+    ) -> None:
+        """
+        Add a joiner and queue it for the next flush_joins.  Any member
+        answers joins, so every alive member can serve as a seed, and a
+        joiner that retries (or joined through another seed) is answered
+        again instead of being left waiting.
+
+        Args:
+            sender (DatagramSender): unused, replies go out in flush_joins
+            join_data (JoinMessageData): the joiner
+        """
+        self.admit(join_data)
+
+        self.lock.acquire()
+        self.pending_joins[join_data["id"]] = (
+            join_data["host"], join_data["port"]
+        )
+        self.lock.release()
+
+    def member_records(self) -> list[GossipRecord]:
+        """ A copy of every entry, taken under the lock """
+        self.lock.acquire()
+        records = [
+            member.gossip_record()
+            for member in self.member_list.values()
+        ]
+        self.lock.release()
+        return records
+
+    def encode_pages(
+        self,
+        records: list[GossipRecord],
+        limit: int
+    ) -> list[bytes]:
+        """
+        Encode records as gossip messages of at most limit bytes each
+
+        Args:
+            records (list[GossipRecord]): the entries to encode
+            limit (int): the size budget of one message
+
+        Returns:
+            list[bytes]: the encoded messages, in order
+        """
+        encoder = GossipEncoder(self.wire_format, capacity=limit)
+        pages = []
+        for page in paginate_records(None, records, limit):
+            encoder.encode(None, 0, page)
+            pages.append(bytes(encoder.payload(0)))
+        return pages
+
+    def flush_joins(self, sender: DatagramSender) -> None:
+        """
+        Send the member list to everyone who asked to join since the last
+        call.  The list is copied and encoded once however many joiners
+        are waiting, so a mass restart costs one encoding per call instead
+        of one per joiner.
+
+        Args:
+            sender (DatagramSender): the socket or transport to send from
+        """
+        if not self.pending_joins:
+            return
+
+        self.lock.acquire()
+        joiners = self.pending_joins
+        self.pending_joins = {}
+        self.lock.release()
+
+        # one datagram per page
+        pages = self.encode_pages(self.member_records(), self.mtu)
+
+        for joiner_id, address in joiners.items():
+            for payload in pages:
+                try:
+                    sender.sendto(payload, address)
+                    self.metrics.sent(Command.GOSSIP, len(payload))
+                except socket.error:
+                    self.logger.log(
+                        f"Failed to send message to joiner {joiner_id}"
+                    )
+                    break
+
+    def random_peer(self) -> tuple[str, tuple[str, int]] | None:
+        """ A random member other than self that is not failed, if any """
+        peers = [
+            member
+            for member in self.snapshot.members.values()
+            if member.id != self.id and member.status != Status.FAILED
+        ]
+        if not peers:
+            return None
+        member = self.rng.choice(peers)
+        return (member.id, member.address)
+
+    def handle_leave_message(self, leave_data: LeaveMessageData) -> None:
+        # look the member up under the lock, cleanup may remove it meanwhile
+        self.lock.acquire()
+        member = self.member_list.get(leave_data["id"])
+        if member is not None:
+            # mark that member as failed
+            self.mark_as_failed(member)
+        self.lock.release()
+
+        if member is None:
+            # not in the member list (should not happen)
+            self.logger.log(
+                f"Member {leave_data['id']} not in the member list",
+                verbosity=2
+            )
+
+    def handle_gossip_message(self, message: GossipMessage) -> None:
+        self.merge_to_member_list(message["data"])
+
+        if "sender" in message:
+            # acknowledge only after the entries are merged
+            self.acknowledge(
+                message["sender"],
+                message["version"],
+                message["ack"]
+            )
+
+    def acknowledge(self, peer_id: str, version: int, ack: int) -> None:
+        """ Record a merged gossip header, see DeltaTracker.on_receive """
+        self.lock.acquire()
+        self.deltas.on_receive(peer_id, version, ack)
+        self.lock.release()
+
+    def send_datagrams(
+        self,
+        sender: DatagramSender,
+        command: Command,
+        datagrams: list[tuple[bytes, tuple[str, int]]]
+    ) -> None:
+        for data, address in datagrams:
+            try:
+                sender.sendto(data, address)
+                self.metrics.sent(command, len(data))
+            except socket.error:
+                self.logger.log(
+                    f"Failed to send message to {address}",
+                    verbosity=2
+                )
+
+    def ping(self, seq: int) -> bytes:
+        return encode_message(PingMessage(
+            command=Command.PING,
+            data=PingMessageData(id=self.id, seq=seq)
+        ), self.wire_format)
+
+    def ack(self, member_id: str, seq: int) -> bytes:
+        return encode_message(AckMessage(
+            command=Command.ACK,
+            data=AckMessageData(id=member_id, seq=seq)
+        ), self.wire_format)
+
+    def handle_ping_message(
+        self,
+        sender: DatagramSender,
+        ping_data: PingMessageData,
+        address: tuple[str, int]
+    ) -> None:
+        self.send_datagrams(
+            sender,
+            Command.ACK,
+            [(self.ack(self.id, ping_data["seq"]), address)]
+        )
+
+    def handle_ping_req_message(
+        self,
+        sender: DatagramSender,
+        request_data: PingReqMessageData,
+        address: tuple[str, int]
+    ) -> None:
+        self.lock.acquire()
+        seq = self.probes.relay(request_data["seq"], address, self.clock())
+        self.lock.release()
+
+        self.send_datagrams(sender, Command.PING, [(
+            self.ping(seq),
+            (request_data["host"], request_data["port"])
+        )])
+
+    def handle_ack_message(
+        self,
+        sender: DatagramSender,
+        ack_data: AckMessageData
+    ) -> None:
+        self.lock.acquire()
+        relay = None
+        if not self.probes.on_ack(ack_data["seq"]):
+            relay = self.probes.take_relay(ack_data["seq"])
+        self.lock.release()
+
+        if relay is not None:
+            # we probed on someone's behalf, pass the ack back
+            seq, address = relay
+            self.send_datagrams(
+                sender,
+                Command.ACK,
+                [(self.ack(ack_data["id"], seq), address)]
+            )
+
+    def probe_tick(self, sender: DatagramSender) -> None:
+        """
+        Advance SWIM probing (see swim.py), to be called every few tenths
+        of a protocol period.
+
+        Once a period starts the target is pinged; if it has not acked
+        after t_ack, indirect_probes random members are asked to ping it;
+        if it has acked neither way when the period ends it is suspected,
+        or failed without the suspicion strategy, and the next period
+        starts.
+
+        Args:
+            sender (DatagramSender): the socket or transport to send from
+        """
+        now = self.clock()
+        probes = self.probes
+        datagrams: list[tuple[bytes, tuple[str, int]]] = []
+        command = Command.PING
+
+        self.lock.acquire()
+
+        probes.expire_relays(now)
+
+        target = None
+        if probes.target is not None:
+            target = self.member_list.get(probes.target)
+
+        if probes.period_over(now):
+            if (
+                target is not None and
+                not probes.acked and
+                target.status == Status.ALIVE
+            ):
+                self.logger.log(
+                    f"{target.id} did not answer probes",
+                    verbosity=2
+                )
+                if self.enable_suspicion:
+                    self.mark_as_suspected(target)
+                else:
+                    self.mark_as_failed(target)
+            probes.finish()
+
+            target_id = probes.next_target()
+            if target_id is not None:
+                seq = probes.start(target_id, now)
+                datagrams.append((
+                    self.ping(seq),
+                    self.member_list[target_id].address
+                ))
+        elif probes.ack_overdue(now):
+            probes.requested = True
+            command = Command.PING_REQ
+            helpers = [
+                member for member_id, member in self.member_list.items()
+                if member_id != self.id and
+                member_id != probes.target and
+                member.status == Status.ALIVE
+            ]
+            if target is not None:
+                host, port = target.host, target.port
+                request = encode_message(PingReqMessage(
+                    command=Command.PING_REQ,
+                    data=PingReqMessageData(
+                        id=self.id,
+                        seq=probes.seq,
+                        target=target.id,
+                        host=host,
+                        port=port
+                    )
+                ), self.wire_format)
+                datagrams.extend(
+                    (request, helper.address)
+                    for helper in self.rng.sample(
+                        helpers,
+                        min(probes.indirect_probes, len(helpers))
+                    )
+                )
+
+        self.lock.release()
+
+        self.send_datagrams(sender, command, datagrams)
+
+    def handle_datagram(
+        self,
+        sender: DatagramSender,
+        data: bytes | memoryview,
+        address: tuple[str, int]
+    ) -> None:
+        """
+        Decode and dispatch one received datagram
+
+        Args:
+            sender (DatagramSender): where replies (join responses) are sent
+            data (bytes): the datagram
+            address (tuple[str, int]): where it came from
+        """
+        if self.rng.random() < self.message_drop_rate:
+            self.logger.log(f"Simulated Data Drop From {address}", verbosity=3)
+            self.metrics.simulated_drops.inc()
+            return
+
+        try:
+            message: Message = decode_message(data)
+        except DecodeError as e:
+            self.logger.log(f"Malformed message dropped: {e}", verbosity=2)
+            self.metrics.decode_failures.inc()
+            return
+
+        self.metrics.received(message["command"], len(data))
+        self.handle_message(sender, message, address)
+
+    def handle_message(
+        self,
+        sender: DatagramSender,
+        message: Message,
+        address: tuple[str, int]
+    ) -> None:
+        """
+        Dispatch one decoded message
+
+        Args:
+            sender (DatagramSender): where replies are sent
+            message (Message): the message
+            address (tuple[str, int]): where it came from
+        """
+        match message["command"]:
+            case Command.JOIN:
+                self.handle_join_message(
+                    sender,
+                    cast(JoinMessage, message)["data"]
+                )
+            case Command.LEAVE:
+                self.handle_leave_message(
+                    cast(LeaveMessage, message)["data"]
+                )
+            case Command.GOSSIP:
+                self.handle_gossip_message(cast(GossipMessage, message))
+            case Command.PING:
+                self.handle_ping_message(
+                    sender,
+                    cast(PingMessage, message)["data"],
+                    address
+                )
+            case Command.PING_REQ:
+                self.handle_ping_req_message(
+                    sender,
+                    cast(PingReqMessage, message)["data"],
+                    address
+                )
+            case Command.ACK:
+                self.handle_ack_message(
+                    sender,
+                    cast(AckMessage, message)["data"]
+                )
+
+    def pack_records(
+        self,
+        entries: Mapping[str, MemberRecord],
+        base: int
+    ) -> tuple[list[list[GossipRecord]], int]:
+        """
+        Fit the entries of a round into at most max_pages datagrams of at
+        most mtu bytes each, must be called with lock acquired.
+
+        If they do not all fit, our own entry goes first, then the most
+        recently changed entries until half of the budget is used, then the
+        entries changed since base oldest change first, and any room left
+        goes to the remaining entries in rotating order so that a full list
+        is covered over successive rounds.
+
+        The version to advertise is the highest one up to which every entry
+        changed since base was sent.  Targets acknowledge it, so the next
+        delta starts where this one stopped and a list too large for one
+        round is paged through round by round.
+
+        Args:
+            entries (Mapping[str, MemberRecord]): the entries selected for
+                the round
+            base (int): the version the entries were selected from, see
+                DeltaTracker.select
+
+        Returns:
+            tuple[list[list[GossipRecord]], int]: the records to send, one
+                list per datagram, and the version to advertise with them
+        """
+        pages: list[list[GossipRecord]] = [[]]
+        included: set[str] = set()
+        budget = GossipBudget(self.id, self.mtu)
+        capacity = budget.capacity() * self.max_pages
+
+        def take(member_id: str) -> bool:
+            nonlocal budget
+            record = entries[member_id].gossip_record()
+            if not budget.add(record):
+                if len(pages) == self.max_pages:
+                    return False
+                # as paginate_records: an oversized record gets its own page
+                pages.append([])
+                budget = GossipBudget(self.id, self.mtu)
+                budget.add(record)
+            pages[-1].append(record)
+            included.add(member_id)
+            return True
+
+        if len(entries) <= capacity:
+            if all(take(member_id) for member_id in entries):
+                return pages, self.deltas.version
+            pages = [[]]
+            included = set()
+            budget = GossipBudget(self.id, self.mtu)
+
+        if self.id in entries:
+            take(self.id)
+
+        versions = self.deltas.versions
+        recent = heapq.nlargest(
+            capacity,
+            entries,
+            key=lambda member_id: versions.get(member_id, 0)
+        )
+        recent_limit = self.max_pages * self.mtu * RECENT_SHARE
+        for member_id in recent:
+            if (len(pages) - 1) * self.mtu + budget.size >= recent_limit:
+                break
+            if member_id not in included and not take(member_id):
+                break
+
+        # the unacknowledged entries in version order: every version is
+        # stamped on one member, so the ones sent form a prefix
+        changed = [
+            member_id for member_id in entries
+            if versions.get(member_id, 0) > base
+        ]
+        oldest = heapq.nsmallest(
+            capacity,
+            changed,
+            key=lambda member_id: versions[member_id]
+        )
+        for member_id in oldest:
+            if member_id not in included and not take(member_id):
+                return pages, versions[member_id] - 1
+        if len(oldest) < len(changed):
+            return pages, versions[oldest[-1]]
+
+        keys = list(entries)
+        start = self.rotation % len(keys)
+        walked = 0
+        for member_id in keys[start:] + keys[:start]:
+            if member_id not in included and not take(member_id):
+                break
+            walked += 1
+        self.rotation = start + walked
+
+        return pages, self.deltas.version
+
+    def gossip_round(self, sender: DatagramSender) -> None:
+        """
+        Gossip once to the next fanout members in shuffled round-robin
+        order (see peers.py).
+
+        The lock is held only to take the targets and copy the entries
+        into immutable records; each datagram of the round is encoded once
+        for all targets and the sends happen after the lock is released.
+        When the entries do not fit in the round every datagram advertises
+        the version up to which the round covered them (see pack_records),
+        so targets acknowledge what was sent and nothing that was left out.
+
+        Args:
+            sender (DatagramSender): the socket or transport to send from
+        """
+        self.lock.acquire()
+
+        targets = [
+            (member_id, self.member_list[member_id].address)
+            for member_id in self.peers.take(self.fanout)
+        ]
+
+        if not targets:
+            self.lock.release()
+            return
+
+        entries, base = self.deltas.select(
+            [member_id for member_id, _ in targets],
+            self.member_list
+        )
+        pages, version = self.pack_records(entries, base)
+        acks = [self.deltas.ack_for(member_id) for member_id, _ in targets]
+
+        self.lock.release()
+
+        for records in pages:
+            self.encoder.encode(self.id, version, records)
+
+            for (member_id, address), ack in zip(targets, acks):
+                payload = self.encoder.payload(ack)
+                try:
+                    sender.sendto(payload, address)
+                    self.metrics.sent(Command.GOSSIP, len(payload))
+                except socket.error:
+                    self.logger.log(
+                        f"Failed to send gossip to {member_id}",
+                        verbosity=2
+                    )
@@ -0,0 +1,182 @@
+"""
+Asynchronous, batched event log.
+
+Membership events are logged from inside the member list lock (the merge
+and failure detection loops of server.py, engine listeners in
+server_new.py), so writing them there makes every lock holder wait on the
+disk.  EventLog.log only stamps the event and puts it on an in-memory
+queue; a background writer thread takes everything queued, formats it and
+writes it with one write() per batch, flushing at most every
+flush_interval.  During mass failures or joins hundreds of events cost a
+few writes instead of an open/append/close each.
+
+The file is rotated when it would grow past max_bytes or when it is older
+than max_age: name.log becomes name.log.1, name.log.1 becomes name.log.2
+and so on, keeping backups old files.
+
+Lines are the bare message by default, as server.py always wrote them, or
+JSON objects with a timestamp and any extra fields when structured.
+"""
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+from typing import Any, Callable
+
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_MAX_BYTES = 16 << 20
+DEFAULT_BACKUPS = 3
+MAX_BATCH = 4096    # events per write, bounds the memory of one batch
+
+# (time, message, extra fields)
+Event = tuple[float, str, dict[str, Any]]
+
+_CLOSE = None   # queued by close() to stop the writer
+
+
+class EventLog(object):
+    def __init__(
+        self,
+        filename: str,
+        structured: bool = False,
+        append: bool = True,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: float | None = None,
+        backups: int = DEFAULT_BACKUPS,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        Open the log and start its writer thread
+
+        Args:
+            filename (str): the log file
+            structured (bool): write JSON lines instead of bare messages
+            append (bool): keep what the file holds, otherwise truncate it
+            max_bytes (int): rotate before the file grows past this
+            max_age (float | None): rotate files older than this (seconds)
+            backups (int): rotated files to keep
+            flush_interval (float): the longest an event waits in memory
+            clock (Callable[[], float]): timestamps events
+        """
+        self.filename = filename
+        self.structured = structured
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.clock = clock
+
+        self.queue: queue.SimpleQueue[Event | None] = queue.SimpleQueue()
+        self.file = open(filename, "a" if append else "w", encoding="utf-8")
+        self.size = self.file.tell()
+        self.opened = time.monotonic()
+        self.closed = False
+
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def log(self, message: str, **fields: Any) -> None:
+        """
+        Queue an event; never blocks and never touches the file
+
+        Args:
+            message (str): the event
+            **fields (Any): extra JSON fields, only written when structured
+        """
+        self.queue.put((self.clock(), message, fields))
+
+    def close(self) -> None:
+        """ Write out everything queued so far and stop the writer """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_CLOSE)
+        self.writer.join()
+        self.file.close()
+
+    def format(self, event: Event) -> str:
+        timestamp, message, fields = event
+        if not self.structured:
+            return message + "\n"
+        record = {"time": timestamp, "event": message, **fields}
+        return json.dumps(record) + "\n"
+
+    def write_loop(self) -> None:
+        while True:
+            event = self.queue.get()
+            batch = []
+            while event is not _CLOSE:
+                batch.append(self.format(event))
+                if len(batch) >= MAX_BATCH:
+                    break
+                try:
+                    event = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    self.write("".join(batch))
+                except OSError as e:
+                    # a full disk or a file rotated away must not stop the
+                    # writer: this batch is lost, the next reopens the file
+                    print(
+                        f"Event log {self.filename}: {len(batch)} events "
+                        f"lost: {e}", file=sys.stderr
+                    )
+                    self.abandon()
+            if event is _CLOSE:
+                return
+
+            # let the next events pile up instead of flushing each one
+            time.sleep(self.flush_interval)
+
+    def write(self, data: str) -> None:
+        if self.file.closed:
+            self.reopen()
+        size = len(data.encode())
+        if self.should_rotate(size):
+            self.rotate()
+        self.file.write(data)
+        self.file.flush()
+        self.size += size
+
+    def abandon(self) -> None:
+        """ Close the file after a failed write, the next write reopens it """
+        try:
+            self.file.close()
+        except OSError:
+            pass
+
+    def reopen(self) -> None:
+        self.file = open(self.filename, "a", encoding="utf-8")
+        self.size = self.file.tell()
+        self.opened = time.monotonic()
+
+    def should_rotate(self, incoming: int) -> bool:
+        if self.size == 0:
+            return False
+        if self.size + incoming > self.max_bytes:
+            return True
+        return (
+            self.max_age is not None and
+            time.monotonic() - self.opened >= self.max_age
+        )
+
+    def rotate(self) -> None:
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.filename}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.filename}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.filename, f"{self.filename}.1")
+        self.file = open(self.filename, "w", encoding="utf-8")
+        self.size = 0
+        self.opened = time.monotonic()
@@ -0,0 +1,212 @@
+"""
+A consistent-hash ring over the live members, updated incrementally.
+
+Services that shard keys over the cluster need a ring of the members that
+are not failed.  Rebuilding one from the whole member list on every change
+costs O(N * vnodes) hashing and sorting each time a member fails or comes
+back.  HashRing is instead kept up to date by an engine listener: a member
+that joins (or comes back) adds its vnodes tokens, one that fails or is
+removed takes them out, and suspicion flaps do not touch it at all.
+
+Tokens live in a sorted sequence split into buckets of at most 2 * LOAD
+tokens (each an array of unsigned 64-bit hashes, with a parallel list of
+owners), indexed by the largest token of each bucket.  Finding the owner
+of a key is a bisect over the bucket maxima and one within a bucket, and
+adding or removing a token moves at most one bucket's worth of entries,
+so neither depends on the ring size beyond the O(log N) bisects.
+
+lookup(key) is the first token clockwise from the key's hash;
+preference_list(key, n) continues clockwise until n distinct members are
+found, the usual replica placement.
+"""
+import bisect
+import hashlib
+import threading
+
+from array import array
+
+from engine import MemberEvent, MembershipEngine
+from protocol import Status
+
+DEFAULT_VNODES = 64
+LOAD = 512      # a bucket is split in two when it grows past 2 * LOAD
+
+
+def key_hash(key: str | bytes) -> int:
+    """ A key's position on the ring, 64 bits of blake2b """
+    if isinstance(key, str):
+        key = key.encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+
+class HashRing(object):
+    def __init__(self, vnodes: int = DEFAULT_VNODES):
+        """
+        Args:
+            vnodes (int): tokens per member, more spread keys more evenly
+        """
+        if vnodes < 1:
+            raise ValueError("a ring needs at least one token per member")
+
+        self.vnodes = vnodes
+        self.members: set[str] = set()
+        self.maxes: list[int] = []          # the last token of each bucket
+        self.tokens: list[array] = []       # sorted buckets of tokens
+        self.owners: list[list[str]] = []   # the member of every token
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __contains__(self, member_id: object) -> bool:
+        return member_id in self.members
+
+    def member_tokens(self, member_id: str) -> list[int]:
+        return [key_hash(f"{member_id}#{i}") for i in range(self.vnodes)]
+
+    def add(self, member_id: str) -> None:
+        """ Put a member on the ring, a no-op if it is on it already """
+        if member_id in self.members:
+            return
+        tokens = self.member_tokens(member_id)
+        self.lock.acquire()
+        self.members.add(member_id)
+        for token in tokens:
+            self.insert(token, member_id)
+        self.lock.release()
+
+    def remove(self, member_id: str) -> None:
+        """ Take a member off the ring, a no-op if it is not on it """
+        if member_id not in self.members:
+            return
+        tokens = self.member_tokens(member_id)
+        self.lock.acquire()
+        self.members.discard(member_id)
+        for token in tokens:
+            self.delete(token, member_id)
+        self.lock.release()
+
+    def insert(self, token: int, owner: str) -> None:
+        self.size += 1
+        if not self.maxes:
+            self.maxes.append(token)
+            self.tokens.append(array("Q", [token]))
+            self.owners.append([owner])
+            return
+
+        i = bisect.bisect_left(self.maxes, token)
+        if i == len(self.maxes):
+            # past every token, append to the last bucket
+            i -= 1
+            self.tokens[i].append(token)
+            self.owners[i].append(owner)
+            self.maxes[i] = token
+        else:
+            j = bisect.bisect_left(self.tokens[i], token)
+            self.tokens[i].insert(j, token)
+            self.owners[i].insert(j, owner)
+
+        tokens = self.tokens[i]
+        if len(tokens) > 2 * LOAD:
+            owners = self.owners[i]
+            self.tokens[i:i + 1] = [tokens[:LOAD], tokens[LOAD:]]
+            self.owners[i:i + 1] = [owners[:LOAD], owners[LOAD:]]
+            self.maxes[i:i + 1] = [tokens[LOAD - 1], tokens[-1]]
+
+    def delete(self, token: int, owner: str) -> None:
+        i = bisect.bisect_left(self.maxes, token)
+        while i < len(self.maxes):
+            tokens, owners = self.tokens[i], self.owners[i]
+            j = bisect.bisect_left(tokens, token)
+            # tokens of different members may collide, find this owner's
+            while j < len(tokens) and tokens[j] == token:
+                if owners[j] == owner:
+                    del tokens[j]
+                    del owners[j]
+                    self.size -= 1
+                    if tokens:
+                        self.maxes[i] = tokens[-1]
+                    else:
+                        del self.maxes[i], self.tokens[i], self.owners[i]
+                    return
+                j += 1
+            if j < len(tokens):
+                return
+            i += 1
+
+    def walk(self, key: str | bytes, count: int) -> list[str]:
+        """ Owners of up to count distinct members clockwise from key """
+        found: list[str] = []
+        seen: set[str] = set()
+        self.lock.acquire()
+        count = min(count, len(self.members))
+        if count > 0:
+            point = key_hash(key)
+            i = bisect.bisect_left(self.maxes, point)
+            if i == len(self.maxes):
+                i, j = 0, 0    # wrap around
+            else:
+                j = bisect.bisect_left(self.tokens[i], point)
+
+            for _ in range(self.size):
+                owner = self.owners[i][j]
+                if owner not in seen:
+                    seen.add(owner)
+                    found.append(owner)
+                    if len(found) == count:
+                        break
+                j += 1
+                if j == len(self.owners[i]):
+                    i, j = (i + 1) % len(self.owners), 0
+        self.lock.release()
+        return found
+
+    def lookup(self, key: str | bytes) -> str | None:
+        """
+        The member that owns a key
+
+        Args:
+            key (str | bytes): the key
+
+        Returns:
+            str | None: the owner, None when the ring is empty
+        """
+        owners = self.walk(key, 1)
+        return owners[0] if owners else None
+
+    def preference_list(self, key: str | bytes, n: int) -> list[str]:
+        """
+        The members responsible for a key, in order
+
+        Args:
+            key (str | bytes): the key
+            n (int): how many members, e.g. the replication factor
+
+        Returns:
+            list[str]: min(n, members on the ring) distinct members, the
+                owner first
+        """
+        return self.walk(key, n)
+
+
+def attach(
+    engine: MembershipEngine,
+    vnodes: int = DEFAULT_VNODES
+) -> HashRing:
+    """ A ring of the engine's members that are not failed, kept current """
+    ring = HashRing(vnodes)
+
+    def listener(event: MemberEvent, member_id: str) -> None:
+        if event in (MemberEvent.FAILED, MemberEvent.REMOVED):
+            ring.remove(member_id)
+        else:
+            ring.add(member_id)
+
+    engine.lock.acquire()
+    for member in engine.member_list.values():
+        if member.status != Status.FAILED:
+            ring.add(member.id)
+    engine.add_listener(listener)
+    engine.lock.release()
+    return ring
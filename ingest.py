@@ -0,0 +1,421 @@
+"""
+Multi-core ingestion with SO_REUSEPORT receiver workers.
+
+A node that hears from far more peers than it gossips to (an aggregator or
+an observer) spends most of its time decoding gossip, and one receive
+thread caps that at one core.  In worker mode the engine's socket and N
+worker processes are all bound to the node's port with SO_REUSEPORT, so the
+kernel spreads incoming datagrams over them (by source address, so each
+peer's datagrams stay in order on one socket).
+
+Every worker drains its socket (see receive.py), decodes the gossip and
+pre-merges it: of all the entries for a member in one arena of datagrams
+only the highest heartbeat and the strongest status survive, with the same
+rules MembershipEngine.merge_to_member_list applies.  The batch then goes
+to the engine process over a pipe as one IngestBatch: the pre-merged
+entries, the delta tracking header of every sender, and any other
+messages (joins, leaves, probes), which are passed through decoded because
+only the engine can answer them.  Nothing is decoded twice.  Under
+load a batch covers hundreds of datagrams, so the engine merges each
+member once per batch instead of once per datagram.
+
+Workers never touch engine state, so they cannot reply or vouch for the
+engine's liveness: a PING is acked by the engine process, never by a
+worker.
+
+The engine's own socket is drained the same way with or without workers
+(drain_premerged): a node gossiped to by fanout peers per interval hears
+about every member several times over, and folding those entries before
+taking the engine lock turns one merge per datagram into one per burst.
+"""
+import multiprocessing
+import random
+import socket
+
+from multiprocessing.connection import Connection
+from typing import NamedTuple, cast
+
+from capture import TraceRecorder
+from engine import DatagramSender, MembershipEngine
+from protocol import (
+    Command, DecodeError, GossipMessage, Member, Message, Status,
+    decode_gossip_records, decode_message
+)
+from receive import DatagramReader
+from util import Logger
+
+DEFAULT_WORKERS = 0
+
+# status codes are the enum values, as on the wire
+_STATUSES = tuple(Status)
+_SUSPECTED = Status.SUSPECTED.value
+_FAILED = Status.FAILED.value
+
+
+class IngestStats(NamedTuple):
+    """ Counts behind one batch, for the engine's metrics """
+    received: int = 0       # gossip datagrams pre-merged
+    size: int = 0           # their bytes
+    dropped: int = 0        # by the simulated drop rate
+    malformed: int = 0
+
+
+class Passthrough(NamedTuple):
+    """ A decoded message only the engine can handle """
+    message: Message
+    size: int                   # bytes of its datagram
+    address: tuple[str, int]    # where it came from
+
+
+class IngestBatch(NamedTuple):
+    """ What one worker received in one drained batch """
+    members: dict[str, Member]  # the pre-merged entries
+    # sender -> (highest version, latest ack) of its gossip headers
+    headers: dict[str, tuple[int, int]]
+    passthrough: list[Passthrough]
+    stats: IngestStats
+
+
+def reuse_port_socket(address: tuple[str, int]) -> socket.socket:
+    """ A UDP socket bound to address that shares it with the workers """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    return sock
+
+
+def supports_reuse_port() -> bool:
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+class PreMerger(object):
+    """
+    Reduces the gossip of many datagrams to one entry per member, with the
+    rules of MembershipEngine.merge_to_member_list: the highest heartbeat,
+    and the status the incarnation rule picks (FAILED always wins, then a
+    higher incarnation, then SUSPECTED over ALIVE at the same one).  The
+    incarnation rule depends on the order entries arrive in only when a
+    FAILED entry of an older incarnation comes between newer ones; apart
+    from that, merging the survivor once ends where merging every datagram
+    in turn would.
+
+    Binary gossip is folded straight from its records (see
+    protocol.decode_gossip_records) into a row per member, and a Member is
+    only built for the entry that survives, in take.
+    """
+
+    def __init__(
+        self,
+        message_drop_rate: float = 0.0,
+        rng: random.Random | None = None,
+        logger: Logger | None = None
+    ):
+        self.message_drop_rate = message_drop_rate
+        self.rng = rng if rng is not None else random.Random()
+        self.logger = logger if logger is not None else Logger(0)
+
+        # member id -> [host, port, heartbeat, incarnation, status code]
+        self.members: dict[str, list] = {}
+        self.headers: dict[str, tuple[int, int]] = {}
+        self.passthrough: list[Passthrough] = []
+        # counted in plain ints, the hot path should not build tuples
+        self.received = 0
+        self.size = 0
+        self.dropped = 0
+        self.malformed = 0
+
+    def add(self, data: memoryview, address: tuple[str, int]) -> None:
+        """
+        Decode one datagram and fold it into the current batch
+
+        Args:
+            data (memoryview): the datagram, only valid during the call
+            address (tuple[str, int]): where it came from
+        """
+        if self.rng.random() < self.message_drop_rate:
+            self.logger.log(f"Simulated Data Drop From {address}", verbosity=3)
+            self.dropped += 1
+            return
+
+        try:
+            records = decode_gossip_records(data)
+            if records is None:
+                message: Message = decode_message(data)
+        except DecodeError as e:
+            self.logger.log(f"Malformed message dropped: {e}", verbosity=2)
+            self.malformed += 1
+            return
+
+        if records is not None:
+            strings, sender, version, ack, entries = records
+            self.fold(strings, entries)
+        elif message["command"] == Command.GOSSIP:
+            gossip = cast(GossipMessage, message)
+            self.merge(gossip["data"])
+            sender = gossip.get("sender")
+            version, ack = gossip.get("version", 0), gossip.get("ack", 0)
+        else:
+            self.passthrough.append(Passthrough(message, len(data), address))
+            return
+
+        self.received += 1
+        self.size += len(data)
+
+        if sender is not None:
+            # as DeltaTracker.on_receive: the highest version, the last ack
+            last_version, _ = self.headers.get(sender, (0, 0))
+            self.headers[sender] = (max(last_version, version), ack)
+
+    def fold(self, strings: list[str], records: list[tuple]) -> None:
+        """
+        Fold the records of one binary gossip message into the batch
+
+        Args:
+            strings (list[str]): the message's string table
+            records (list[tuple]): its records, see decode_gossip_records
+        """
+        members = self.members
+
+        for id_index, host_index, port, heartbeat, incarnation, status in (
+            records
+        ):
+            member_id = strings[id_index]
+            row = members.get(member_id)
+            if row is None:
+                members[member_id] = [
+                    strings[host_index], port, heartbeat, incarnation, status
+                ]
+                continue
+
+            # heartbeat rule
+            if heartbeat > row[2]:
+                row[2] = heartbeat
+
+            # incarnation rule
+            if (
+                status == _FAILED or
+                incarnation > row[3] or
+                (incarnation == row[3] and status == _SUSPECTED)
+            ):
+                row[3] = incarnation
+                row[4] = status
+
+    def merge(self, gossip_member_list: dict[str, Member]) -> None:
+        """ Fold decoded gossip into the batch, as fold does records """
+        members = self.members
+
+        for member_id, member in gossip_member_list.items():
+            heartbeat = member["heartbeat"]
+            incarnation, state = member["status"]
+            status = state.value
+            row = members.get(member_id)
+            if row is None:
+                host, port = member["address"]
+                members[member_id] = [
+                    host, port, heartbeat, incarnation, status
+                ]
+                continue
+
+            if heartbeat > row[2]:
+                row[2] = heartbeat
+            if (
+                status == _FAILED or
+                incarnation > row[3] or
+                (incarnation == row[3] and status == _SUSPECTED)
+            ):
+                row[3] = incarnation
+                row[4] = status
+
+    def take(self) -> tuple[
+        dict[str, Member],
+        dict[str, tuple[int, int]],
+        list[Passthrough],
+        IngestStats
+    ]:
+        """ Take the pre-merged entries, other messages and counts """
+        statuses = _STATUSES
+        members = {
+            member_id: Member(
+                id=member_id,
+                address=(host, port),
+                heartbeat=heartbeat,
+                time=0.0,
+                status=(incarnation, statuses[status]),
+                failed_time=0.0
+            )
+            for member_id, (host, port, heartbeat, incarnation, status) in (
+                self.members.items()
+            )
+        }
+        taken = (
+            members, self.headers, self.passthrough, IngestStats(
+                self.received, self.size, self.dropped, self.malformed
+            )
+        )
+        self.members = {}
+        self.headers = {}
+        self.passthrough = []
+        self.received = self.size = self.dropped = self.malformed = 0
+        return taken
+
+    def flush(self) -> IngestBatch | None:
+        """ Take the current batch, None if nothing was received """
+        batch = IngestBatch(*self.take())
+        if not (
+            batch.members or batch.headers or batch.passthrough or
+            any(batch.stats)
+        ):
+            return None
+        return batch
+
+
+def run_worker(
+    address: tuple[str, int],
+    connection: Connection,
+    message_drop_rate: float,
+    verbosity: int
+) -> None:
+    """
+    Receive, decode and pre-merge until the engine process goes away
+
+    Args:
+        address (tuple[str, int]): the node's address, shared by port reuse
+        connection (Connection): where batches are sent
+        message_drop_rate (float): simulated drop rate, as in the engine
+        verbosity (int): log verbosity
+    """
+    sock = reuse_port_socket(address)
+    reader = DatagramReader(sock)
+    merger = PreMerger(message_drop_rate, logger=Logger(verbosity))
+
+    try:
+        while True:
+            if not reader.wait(1.0):
+                continue
+
+            # one batch per arena, so a flood cannot hold batches back
+            drained = False
+            while not drained:
+                drained = reader.read_batch(merger.add)
+                batch = merger.flush()
+                if batch is not None:
+                    connection.send(batch)
+    except (BrokenPipeError, EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        reader.close()
+        sock.close()
+
+
+def start_workers(
+    engine: MembershipEngine,
+    count: int,
+    verbosity: int = 1
+) -> list[Connection]:
+    """
+    Start count receiver worker processes on the engine's address. The
+    engine's own socket must have been bound with reuse_port_socket.
+
+    Args:
+        engine (MembershipEngine): the engine the workers feed
+        count (int): the number of worker processes
+        verbosity (int): log verbosity of the workers
+
+    Returns:
+        list[Connection]: the receiving end of every worker's pipe
+    """
+    connections = []
+    for _ in range(count):
+        receiving, sending = multiprocessing.Pipe(duplex=False)
+        multiprocessing.Process(
+            target=run_worker,
+            args=(
+                engine.address, sending, engine.message_drop_rate, verbosity
+            ),
+            daemon=True
+        ).start()
+        sending.close()     # the worker holds the only sending end now
+        connections.append(receiving)
+    return connections
+
+
+def apply_merged(
+    engine: MembershipEngine,
+    sender: DatagramSender,
+    members: dict[str, Member],
+    headers: dict[str, tuple[int, int]],
+    passthrough: list[Passthrough],
+    stats: IngestStats
+) -> None:
+    """
+    Apply pre-merged gossip and passed through messages to the engine
+
+    Args:
+        engine (MembershipEngine): the engine that owns the member list
+        sender (DatagramSender): where replies to messages are sent
+        members (dict[str, Member]): the pre-merged entries
+        headers (dict[str, tuple[int, int]]): sender -> (version, ack)
+        passthrough (list[Passthrough]): other messages, already decoded
+        stats (IngestStats): what the pre-merge saw, for metrics
+    """
+    metrics = engine.metrics
+    metrics.received(Command.GOSSIP, stats.size, stats.received)
+    metrics.simulated_drops.inc(stats.dropped)
+    metrics.decode_failures.inc(stats.malformed)
+
+    if members:
+        engine.merge_to_member_list(members)
+
+    # acknowledge only after the entries are merged
+    for member_id, (version, ack) in headers.items():
+        engine.acknowledge(member_id, version, ack)
+
+    for message, size, address in passthrough:
+        metrics.received(message["command"], size)
+        engine.handle_message(sender, message, address)
+
+
+def handle_batch(
+    engine: MembershipEngine,
+    sender: DatagramSender,
+    batch: IngestBatch
+) -> None:
+    """ Apply one batch received from a worker, see apply_merged """
+    apply_merged(engine, sender, *batch)
+
+
+def drain_premerged(
+    engine: MembershipEngine,
+    sender: DatagramSender,
+    reader: DatagramReader,
+    merger: PreMerger,
+    recorder: TraceRecorder | None = None
+) -> None:
+    """
+    Drain the engine's own socket, one application per arena of
+    datagrams: the gossip of the arena is pre-merged and then applied to
+    the member list with one merge.  In worker mode the socket is one more
+    member of the port reuse group and gets its share of the datagrams.
+
+    Args:
+        engine (MembershipEngine): the engine that owns the member list
+        sender (DatagramSender): where replies to datagrams are sent
+        reader (DatagramReader): the reader of the engine's socket
+        merger (PreMerger): pre-merges between applications
+        recorder (TraceRecorder | None): records every datagram received
+    """
+    add = merger.add
+    if recorder is not None:
+        def add(data: memoryview, address: tuple[str, int]) -> None:
+            recorder.record(data, address)
+            merger.add(data, address)
+
+    drained = False
+    while not drained:
+        drained = reader.read_batch(add)
+        apply_merged(engine, sender, *merger.take())
+
+
+def engine_merger(engine: MembershipEngine) -> PreMerger:
+    """ A PreMerger dropping and logging like the engine does """
+    return PreMerger(engine.message_drop_rate, engine.rng, engine.logger)
@@ -0,0 +1,275 @@
+"""
+Local membership API for services running next to a member.
+
+Instead of polling the member list and diffing it, a co-located service
+connects to a Unix socket and sends requests as JSON lines:
+
+    {"op": "get", "id": "member-7"}     one member, or null
+    {"op": "snapshot"}                  every member
+    {"op": "watch", "since": 1234}      stream member events
+    {"op": "lookup", "key": "user:42"}  the member that owns a key
+    {"op": "preference_list", "key": "user:42", "n": 3}
+                                        the members responsible for it
+
+Every reply is one JSON line with a "type" and the view "version" it
+reflects.  The view version counts member events (joined, suspected,
+alive, failed, removed; a member that leaves shows up as failed), so it
+only grows while the member runs.  A watch first catches up from since:
+with the events after it while they are still in the journal's history,
+otherwise with a full snapshot; it then pushes each event as it happens.
+A client that remembers the last version it saw resumes with since
+without fetching the whole list again.  Try it interactively with
+
+    socat - UNIX-CONNECT:/tmp/node.api
+
+Events are journaled by an engine listener, so they are numbered in the
+order the engine applied them, and snapshots are copied under the engine
+lock together with the version they are consistent with.  Keys are
+placed on a consistent-hash ring of the members that are not failed (see
+hashring.py), kept current by another listener.
+"""
+import json
+import os
+import select
+import socket
+import socketserver
+import threading
+
+from collections import deque
+from typing import Any
+
+from engine import MemberEvent, MembershipEngine
+from hashring import HashRing
+from member_table import MemberRecord
+
+DEFAULT_HISTORY = 4096      # events kept for watches to resume from
+WATCH_POLL = 1.0            # seconds between checks for a closed client
+
+
+def member_json(member: MemberRecord) -> dict[str, Any]:
+    return {
+        "id": member.id,
+        "host": member.host,
+        "port": member.port,
+        "heartbeat": member.heartbeat,
+        "incarnation": member.incarnation,
+        "status": member.status.name.lower(),
+    }
+
+
+class ViewJournal(object):
+    """ Member events numbered by view version, the latest history kept """
+
+    def __init__(self, history: int = DEFAULT_HISTORY):
+        self.version = 0
+        self.events: deque[dict[str, Any]] = deque(maxlen=history)
+        self.changed = threading.Condition()
+
+    def append(self, event: dict[str, Any]) -> None:
+        self.changed.acquire()
+        self.version += 1
+        event["version"] = self.version
+        self.events.append(event)
+        self.changed.notify_all()
+        self.changed.release()
+
+    def since(self, version: int) -> list[dict[str, Any]] | None:
+        """
+        The events after version
+
+        Args:
+            version (int): the last version the client saw
+
+        Returns:
+            list[dict[str, Any]] | None: the events, None if some of them
+                are no longer kept (or version is not one of ours)
+        """
+        self.changed.acquire()
+        try:
+            if version > self.version:
+                return None
+            missing = self.version - version
+            if missing > len(self.events):
+                return None
+            return list(self.events)[len(self.events) - missing:]
+        finally:
+            self.changed.release()
+
+    def wait(
+        self,
+        version: int,
+        timeout: float
+    ) -> list[dict[str, Any]] | None:
+        """ Wait up to timeout for events after version, see since """
+        self.changed.acquire()
+        if self.version == version:
+            self.changed.wait(timeout)
+        self.changed.release()
+        return self.since(version)
+
+
+def attach(
+    engine: MembershipEngine,
+    history: int = DEFAULT_HISTORY
+) -> ViewJournal:
+    """ Journal every member event of the engine from now on """
+    journal = ViewJournal(history)
+
+    def listener(event: MemberEvent, member_id: str) -> None:
+        member = engine.member_list.get(member_id)
+        journal.append({
+            "type": "event",
+            "event": event.name.lower(),
+            "id": member_id,
+            "member": None if member is None else member_json(member),
+        })
+
+    engine.add_listener(listener)
+    return journal
+
+
+def snapshot(
+    engine: MembershipEngine,
+    journal: ViewJournal
+) -> dict[str, Any]:
+    """ Every member and the view version they are consistent with """
+    engine.lock.acquire()
+    members = [member_json(member) for member in engine.member_list.values()]
+    version = journal.version   # events are journaled under the lock
+    engine.lock.release()
+    return {"type": "snapshot", "version": version, "members": members}
+
+
+def get(
+    engine: MembershipEngine,
+    journal: ViewJournal,
+    member_id: str
+) -> dict[str, Any]:
+    engine.lock.acquire()
+    member = engine.member_list.get(member_id)
+    reply = {
+        "type": "member",
+        "version": journal.version,
+        "member": None if member is None else member_json(member),
+    }
+    engine.lock.release()
+    return reply
+
+
+def place(
+    ring: HashRing | None,
+    journal: ViewJournal,
+    key: Any,
+    n: int
+) -> dict[str, Any]:
+    """ The preference list of a key, or an error without a ring """
+    if ring is None:
+        return {"type": "error", "error": "no hash ring"}
+    if not isinstance(key, str) or not isinstance(n, int):
+        return {"type": "error", "error": "malformed request"}
+    return {
+        "type": "placement",
+        "version": journal.version,
+        "key": key,
+        "members": ring.preference_list(key, n),
+    }
+
+
+class _APIHandler(socketserver.StreamRequestHandler):
+    engine: MembershipEngine
+    journal: ViewJournal
+    ring: HashRing | None
+
+    def send(self, reply: dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+    def handle(self) -> None:
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    op = request["op"]
+                except (ValueError, TypeError, KeyError):
+                    self.send({"type": "error", "error": "malformed request"})
+                    continue
+
+                if op == "get":
+                    member_id = request.get("id")
+                    self.send(get(self.engine, self.journal, member_id))
+                elif op == "snapshot":
+                    self.send(snapshot(self.engine, self.journal))
+                elif op == "lookup":
+                    self.send(place(
+                        self.ring, self.journal, request.get("key"), 1
+                    ))
+                elif op == "preference_list":
+                    self.send(place(
+                        self.ring, self.journal, request.get("key"),
+                        request.get("n", 1)
+                    ))
+                elif op == "watch":
+                    self.watch(request.get("since"))
+                    return
+                else:
+                    self.send({"type": "error", "error": f"unknown op {op}"})
+        except (BrokenPipeError, ConnectionResetError):
+            pass    # the client went away
+
+    def watch(self, since: int | None) -> None:
+        events = None
+        if isinstance(since, int):
+            events = self.journal.since(since)
+            version = since
+
+        while True:
+            if events is None:
+                # too far behind to catch up event by event
+                reply = snapshot(self.engine, self.journal)
+                self.send(reply)
+                version = reply["version"]
+            else:
+                for event in events:
+                    self.send(event)
+                    version = event["version"]
+
+            events = self.journal.wait(version, WATCH_POLL)
+            if events == [] and self.closed():
+                return
+
+    def closed(self) -> bool:
+        """ Whether the client hung up, without consuming its input """
+        sock: socket.socket = self.connection
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+
+
+def serve_local_api(
+    engine: MembershipEngine,
+    path: str,
+    history: int = DEFAULT_HISTORY,
+    ring: HashRing | None = None
+) -> socketserver.BaseServer:
+    """
+    Serve the local API on a Unix socket on a daemon thread
+
+    Args:
+        engine (MembershipEngine): the engine whose membership is served
+        path (str): the socket path
+        history (int): events kept for watches to resume from
+        ring (HashRing | None): answers lookups, see hashring.attach
+
+    Returns:
+        socketserver.BaseServer: the server started
+    """
+    journal = attach(engine, history)
+    if os.path.exists(path):
+        os.unlink(path)     # left behind by a previous run
+    handler = type("Handler", (_APIHandler,), {
+        "engine": engine, "journal": journal, "ring": ring
+    })
+    server = socketserver.ThreadingUnixStreamServer(path, handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
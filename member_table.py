@@ -0,0 +1,234 @@
+"""
+Compact storage for the member list.
+
+Every member is one MemberRecord, an object with __slots__ instead of a
+Member dict holding address and status tuples, and every field is updated
+in place so the merge path allocates nothing for members it already knows
+beyond the new counter values.  Each member also gets a small integer handle,
+reused after removal, for callers that want to keep compact references
+(e.g. in arrays) instead of id strings.
+
+MemberTable is a Mapping from id to record, so it can stand in
+wherever the member list used to be a dict.
+
+Records are mutable and only safe to touch with the engine lock held.
+Readers that must not wait for the lock use a MembershipSnapshot instead:
+an immutable, versioned copy of the table that the engine republishes after
+a batch of changes (RCU style).  Publishing copies the previous snapshot's
+dict and replaces only the members changed since, so readers never see a
+half applied batch and a snapshot they hold never changes under them.
+"""
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Iterator, KeysView, NamedTuple
+
+from protocol import GossipRecord, Member, Status
+
+
+class MemberRecord(object):
+    __slots__ = (
+        "handle", "id", "host", "port", "heartbeat", "time",
+        "incarnation", "status", "failed_time"
+    )
+
+    def __init__(
+        self,
+        handle: int,
+        member_id: str,
+        host: str,
+        port: int,
+        heartbeat: int,
+        time: float,
+        incarnation: int,
+        status: Status
+    ):
+        self.handle = handle
+        self.id = member_id
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.time = time
+        self.incarnation = incarnation
+        self.status = status
+        self.failed_time = 0.0
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return (self.host, self.port)
+
+    def gossip_record(self) -> GossipRecord:
+        return (
+            self.id, self.host, self.port, self.heartbeat,
+            self.incarnation, self.status
+        )
+
+    def to_member(self) -> Member:
+        return Member(
+            id=self.id,
+            address=(self.host, self.port),
+            heartbeat=self.heartbeat,
+            time=self.time,
+            status=(self.incarnation, self.status),
+            failed_time=self.failed_time
+        )
+
+    def view(self) -> "MemberView":
+        return MemberView(
+            self.id, self.host, self.port, self.heartbeat,
+            self.incarnation, self.status, self.time
+        )
+
+    def __repr__(self) -> str:
+        return repr(self.to_member())
+
+
+class MemberView(NamedTuple):
+    """ An immutable copy of a member, as published in snapshots """
+    id: str
+    host: str
+    port: int
+    heartbeat: int
+    incarnation: int
+    status: Status
+    time: float     # local time the heartbeat was heard
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return (self.host, self.port)
+
+
+class MembershipSnapshot(object):
+    __slots__ = ("version", "time", "_members")
+
+    def __init__(
+        self,
+        version: int,
+        members: dict[str, MemberView],
+        time: float
+    ):
+        self.version = version
+        self.time = time
+        self._members = members     # never mutated once published
+
+    @property
+    def members(self) -> Mapping[str, MemberView]:
+        return MappingProxyType(self._members)
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def apply(
+        self,
+        changes: dict[str, MemberView | None],
+        time: float
+    ) -> "MembershipSnapshot":
+        """
+        The next snapshot, with changes applied
+
+        Args:
+            changes (dict[str, MemberView | None]): the new view of every
+                member changed since this snapshot, None if removed
+            time (float): when the changes were collected
+
+        Returns:
+            MembershipSnapshot: the next version; this one is unchanged
+        """
+        members = self._members.copy()
+        for member_id, view in changes.items():
+            if view is None:
+                members.pop(member_id, None)
+            else:
+                members[member_id] = view
+        return MembershipSnapshot(self.version + 1, members, time)
+
+
+class MemberTable(Mapping[str, MemberRecord]):
+    def __init__(self):
+        self.handles: dict[str, int] = {}
+        self.records: list[MemberRecord | None] = []
+        self.free: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    def __contains__(self, member_id: object) -> bool:
+        return member_id in self.handles
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.handles)
+
+    def __getitem__(self, member_id: str) -> MemberRecord:
+        return self.records[self.handles[member_id]]  # type: ignore
+
+    def get(  # type: ignore[override]
+        self,
+        member_id: str,
+        default: MemberRecord | None = None
+    ) -> MemberRecord | None:
+        handle = self.handles.get(member_id)
+        if handle is None:
+            return default
+        return self.records[handle]
+
+    def keys(self) -> KeysView[str]:
+        return self.handles.keys()
+
+    def values(self) -> Iterator[MemberRecord]:  # type: ignore[override]
+        records = self.records
+        for handle in self.handles.values():
+            yield records[handle]  # type: ignore
+
+    def items(  # type: ignore[override]
+        self
+    ) -> Iterator[tuple[str, MemberRecord]]:
+        records = self.records
+        for member_id, handle in self.handles.items():
+            yield member_id, records[handle]  # type: ignore
+
+    def record(self, handle: int) -> MemberRecord | None:
+        """ The record behind a handle, None once it was removed """
+        return self.records[handle]
+
+    def add(
+        self,
+        member_id: str,
+        host: str,
+        port: int,
+        heartbeat: int,
+        time: float,
+        incarnation: int,
+        status: Status
+    ) -> MemberRecord:
+        """
+        Add a member that is not in the table yet
+
+        Args:
+            member_id (str): the member's id
+            host (str): the member's host
+            port (int): the member's port
+            heartbeat (int): the last heartbeat heard
+            time (float): local time the heartbeat was heard
+            incarnation (int): the member's incarnation
+            status (Status): the member's status
+
+        Returns:
+            MemberRecord: the new record
+        """
+        if self.free:
+            handle = self.free.pop()
+        else:
+            handle = len(self.records)
+            self.records.append(None)
+
+        record = MemberRecord(
+            handle, member_id, host, port, heartbeat, time,
+            incarnation, status
+        )
+        self.records[handle] = record
+        self.handles[member_id] = handle
+        return record
+
+    def remove(self, member_id: str) -> None:
+        handle = self.handles.pop(member_id)
+        self.records[handle] = None
+        self.free.append(handle)
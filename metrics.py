@@ -0,0 +1,360 @@
+"""
+Counters, latency histograms and a text endpoint to scrape them from.
+
+Metrics are plain objects updated in place: Counter.inc is one attribute
+add and Histogram.observe one bisect over a dozen bucket bounds, so they
+are cheap enough to stay on in production.  Updates are not locked;
+most happen under the engine lock anyway, and a rare lost increment
+from racing threads is an acceptable price for a metric.  Gauges are
+read through a callback only when scraped.
+
+MetricsRegistry.render produces the Prometheus text format, served over
+HTTP (GET any path) or over a Unix socket (connect and read) by
+serve_metrics, e.g.
+
+    curl localhost:9100/metrics
+    socat - UNIX-CONNECT:/tmp/node.metrics
+
+InstrumentedLock wraps a lock to time how long acquirers wait for it and
+how long it is held.  EngineMetrics is the set MembershipEngine keeps.
+"""
+import bisect
+import http.server
+import os
+import socketserver
+import threading
+import time
+
+from typing import Callable, Union
+
+from protocol import Command, Status
+
+# seconds, x4 apart: from a microsecond to a second
+DEFAULT_BUCKETS = (
+    1e-6, 4e-6, 1.6e-5, 6.4e-5, 2.56e-4, 1.024e-3, 4.096e-3, 1.6384e-2,
+    6.5536e-2, 0.262144, 1.048576
+)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Counter(object):
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Histogram(object):
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Gauge(object):
+    __slots__ = ("read",)
+
+    def __init__(self, read: Callable[[], float]):
+        self.read = read
+
+
+Metric = Union[Counter, Histogram, Gauge]
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        # name -> (type, help, labels -> metric)
+        self.families: dict[str, tuple[str, str, dict[Labels, Metric]]] = {}
+
+    def register(
+        self,
+        name: str,
+        kind: str,
+        help: str,
+        labels: dict[str, str],
+        metric: Metric
+    ) -> Metric:
+        _, _, metrics = self.families.setdefault(name, (kind, help, {}))
+        metrics[tuple(sorted(labels.items()))] = metric
+        return metric
+
+    def counter(self, name: str, help: str, **labels: str) -> Counter:
+        return self.register(  # type: ignore[return-value]
+            name, "counter", help, labels, Counter()
+        )
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        **labels: str
+    ) -> Histogram:
+        return self.register(  # type: ignore[return-value]
+            name, "histogram", help, labels, Histogram(buckets)
+        )
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], float],
+        **labels: str
+    ) -> Gauge:
+        return self.register(  # type: ignore[return-value]
+            name, "gauge", help, labels, Gauge(read)
+        )
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format
+
+        Returns:
+            str: the metrics, one sample per line
+        """
+        lines = []
+        for name, (kind, help, metrics) in self.families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics.items():
+                if isinstance(metric, Counter):
+                    lines.append(f"{name}{_labels(labels)} {metric.value}")
+                elif isinstance(metric, Gauge):
+                    lines.append(f"{name}{_labels(labels)} {metric.read()}")
+                else:
+                    lines.extend(_histogram_lines(name, labels, metric))
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _histogram_lines(
+    name: str,
+    labels: Labels,
+    histogram: Histogram
+) -> list[str]:
+    lines = []
+    cumulative = 0
+    bounds = [repr(bound) for bound in histogram.bounds] + ["+Inf"]
+    for bound, count in zip(bounds, histogram.counts):
+        cumulative += count
+        lines.append(
+            f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}"
+        )
+    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+    return lines
+
+
+class InstrumentedLock(object):
+    """ A lock that times waiting for it and holding it """
+
+    def __init__(self, wait: Histogram, hold: Histogram):
+        self.lock = threading.Lock()
+        self.wait = wait
+        self.hold = hold
+        self.acquired = 0.0     # only written by the holder
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self.lock.acquire(False):
+            # uncontended, the common case: no wait to time
+            wait = self.wait
+            wait.counts[0] += 1
+            wait.count += 1
+            self.acquired = time.perf_counter()
+            return True
+
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            self.acquired = time.perf_counter()
+            self.wait.observe(self.acquired - start)
+        return acquired
+
+    def release(self) -> None:
+        self.hold.observe(time.perf_counter() - self.acquired)
+        self.lock.release()
+
+    def locked(self) -> bool:
+        return self.lock.locked()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class EngineMetrics(object):
+    def __init__(self, registry: MetricsRegistry | None = None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        registry = self.registry
+
+        self.messages_sent = {
+            command: registry.counter(
+                "gossip_messages_sent_total", "Datagrams sent",
+                command=command.name.lower()
+            )
+            for command in Command
+        }
+        self.bytes_sent = registry.counter(
+            "gossip_bytes_sent_total", "Bytes sent"
+        )
+        self.messages_received = {
+            command: registry.counter(
+                "gossip_messages_received_total", "Datagrams received",
+                command=command.name.lower()
+            )
+            for command in Command
+        }
+        self.bytes_received = registry.counter(
+            "gossip_bytes_received_total", "Bytes received"
+        )
+        self.decode_failures = registry.counter(
+            "gossip_decode_failures_total", "Malformed datagrams dropped"
+        )
+        self.simulated_drops = registry.counter(
+            "gossip_simulated_drops_total",
+            "Datagrams dropped by the simulated drop rate"
+        )
+        self.merge_seconds = registry.histogram(
+            "gossip_merge_seconds", "Time to merge one gossip message"
+        )
+        self.sweep_seconds = registry.histogram(
+            "gossip_sweep_seconds",
+            "Time to bump the heartbeat and sweep expired deadlines"
+        )
+        self.lock_wait_seconds = registry.histogram(
+            "gossip_lock_wait_seconds", "Time waited for the member list lock"
+        )
+        self.lock_hold_seconds = registry.histogram(
+            "gossip_lock_hold_seconds", "Time the member list lock was held"
+        )
+        self.state_transfers = {
+            role: registry.counter(
+                "gossip_state_transfers_total",
+                "Member lists exchanged over TCP", role=role
+            )
+            for role in ("served", "fetched")
+        }
+        self.state_transfer_failures = registry.counter(
+            "gossip_state_transfer_failures_total",
+            "State transfers that failed or were refused"
+        )
+        self.transitions = {
+            (old, new): registry.counter(
+                "gossip_status_transitions_total",
+                "Status changes decided by this member's failure detector",
+                old=old.name.lower(), new=new.name.lower()
+            )
+            for old, new in (
+                (Status.ALIVE, Status.SUSPECTED),
+                (Status.ALIVE, Status.FAILED),
+                (Status.SUSPECTED, Status.FAILED),
+            )
+        }
+
+    def sent(self, command: Command, size: int) -> None:
+        self.messages_sent[command].inc()
+        self.bytes_sent.inc(size)
+
+    def received(self, command: Command, size: int, count: int = 1) -> None:
+        self.messages_received[command].inc(count)
+        self.bytes_received.inc(size)
+
+    def transition(self, old: Status, new: Status) -> None:
+        counter = self.transitions.get((old, new))
+        if counter is not None:
+            counter.inc()
+
+    def lock(self) -> InstrumentedLock:
+        """ A lock timed into lock_wait_seconds and lock_hold_seconds """
+        return InstrumentedLock(self.lock_wait_seconds, self.lock_hold_seconds)
+
+    def count_members(self, members: Callable[[], list[Status]]) -> None:
+        """
+        Export members by status, counted when scraped
+
+        Args:
+            members (Callable[[], list[Status]]): the status of every
+                member, read without locks
+        """
+        for status in Status:
+            self.registry.gauge(
+                "gossip_members", "Members by status",
+                lambda status=status: members().count(status),
+                status=status.name.lower()
+            )
+
+
+class _HTTPHandler(http.server.BaseHTTPRequestHandler):
+    registry: MetricsRegistry
+
+    def do_GET(self) -> None:
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass    # scrapes are not worth a line each
+
+
+class _UnixHandler(socketserver.StreamRequestHandler):
+    registry: MetricsRegistry
+
+    def handle(self) -> None:
+        self.wfile.write(self.registry.render().encode())
+
+
+def serve_metrics(
+    registry: MetricsRegistry,
+    port: int | None = None,
+    path: str | None = None,
+    host: str = "127.0.0.1"
+) -> list[socketserver.BaseServer]:
+    """
+    Serve the registry on a daemon thread per endpoint
+
+    Args:
+        registry (MetricsRegistry): the metrics to serve
+        port (int | None): serve over HTTP on host:port
+        path (str | None): serve over a Unix socket at path
+        host (str): the HTTP interface, local only by default
+
+    Returns:
+        list[socketserver.BaseServer]: the servers started
+    """
+    servers: list[socketserver.BaseServer] = []
+
+    if port is not None:
+        handler = type("Handler", (_HTTPHandler,), {"registry": registry})
+        servers.append(http.server.ThreadingHTTPServer((host, port), handler))
+
+    if path is not None:
+        if os.path.exists(path):
+            os.unlink(path)     # left behind by a previous run
+        handler = type("Handler", (_UnixHandler,), {"registry": registry})
+        servers.append(socketserver.ThreadingUnixStreamServer(path, handler))
+
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers
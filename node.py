@@ -0,0 +1,414 @@
+"""
+Embeddable members, any number of them per process.
+
+server_new.py runs one member per process: its settings are module
+globals and its loops are threads that sleep.  A GossipNode instead owns
+everything one member needs, its engine, socket, timers and their
+settings, and runs on an asyncio event loop.  start() binds the socket and
+starts joining without blocking the loop, stop() leaves the cluster and
+releases the socket, so any number of nodes can share one loop: a node
+costs its member list and a socket rather than a process and three
+threads.
+
+Nodes of one loop share its receive arena (see receive.py), and blocking
+work (state transfers over TCP, saving the state file) runs on the loop's
+default executor, a thread pool shared by all of them.  Each node's first
+gossip and update ticks are spread over one period so that nodes started
+together do not all wake up at once.
+
+For programs that are not asyncio themselves NodeLoop runs a loop on a
+daemon thread, and nodes are added and removed from any thread:
+
+    nodes = NodeLoop()
+    for port in range(9001, 9101):
+        nodes.add(GossipNode(MembershipEngine(
+            f"member-{port}", ("127.0.0.1", port), ("127.0.0.1", 9001)
+        )))
+    ...
+    nodes.close()
+"""
+import asyncio
+import socket
+import socketserver
+import threading
+import weakref
+
+from multiprocessing.connection import Connection
+from typing import Any, Coroutine
+
+from capture import TraceRecorder
+from engine import MembershipEngine, DEFAULT_T_GOSSIP, DEFAULT_T_UPDATE
+from ingest import drain_premerged, engine_merger, handle_batch
+from protocol import Command, DecodeError
+from receive import DEFAULT_ARENA_SIZE, DatagramReader
+from statefile import DEFAULT_T_SAVE, WARM_START_PEERS, save_engine_state
+from swim import Detector
+from transfer import DEFAULT_T_RESYNC, exchange_state, serve_state_transfer
+
+DEFAULT_T_JOIN = 1.0    # seconds before a join is retried with another seed
+
+Address = tuple[str, int]
+
+# one receive arena per event loop, see receive.py
+_arenas: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, bytearray
+] = weakref.WeakKeyDictionary()
+
+
+def shared_arena(loop: asyncio.AbstractEventLoop) -> bytearray:
+    arena = _arenas.get(loop)
+    if arena is None:
+        arena = _arenas[loop] = bytearray(DEFAULT_ARENA_SIZE)
+    return arena
+
+
+class GossipNode(object):
+    def __init__(
+        self,
+        engine: MembershipEngine,
+        t_gossip: float = DEFAULT_T_GOSSIP,
+        t_update: float = DEFAULT_T_UPDATE,
+        t_join: float = DEFAULT_T_JOIN,
+        t_resync: float = DEFAULT_T_RESYNC,
+        t_save: float = DEFAULT_T_SAVE,
+        state_file: str | None = None,
+        known_peers: list[tuple[str, Address]] | None = None,
+        transfer: bool = False,
+        sock: socket.socket | None = None,
+        connections: list[Connection] | None = None,
+        recorder: TraceRecorder | None = None
+    ):
+        """
+        Args:
+            engine (MembershipEngine): the member's engine, with its id,
+                address, seeds and failure detection settings
+            t_gossip (float): seconds between gossip rounds
+            t_update (float): seconds between member list updates (and
+                probes under Detector.SWIM)
+            t_join (float): seconds before a join is tried again
+            t_resync (float): seconds between member list exchanges over
+                TCP with a random member, 0 for none
+            t_save (float): seconds between saves of the state file
+            state_file (str | None): where to save the member list
+            known_peers (list[tuple[str, Address]] | None): members to join
+                through before the seeds, see statefile.py
+            transfer (bool): serve state transfers on the node's address
+                (TCP) and join through them, falling back to UDP
+            sock (socket.socket | None): a socket bound to the engine's
+                address through which the node has joined already, used
+                instead of binding one and left open by stop()
+            connections (list[Connection] | None): pipes of receiver
+                workers sharing the socket (see ingest.py)
+            recorder (TraceRecorder | None): records every datagram
+                received (see capture.py)
+        """
+        self.engine = engine
+        self.t_gossip = t_gossip
+        self.t_update = t_update
+        self.t_join = t_join
+        self.t_resync = t_resync
+        self.t_save = t_save
+        self.state_file = state_file
+        self.known_peers = known_peers if known_peers is not None else []
+        self.transfer = transfer
+        self.socket = sock
+        self.owns_socket = sock is None
+        self.joined = sock is not None
+        self.connections = connections if connections is not None else []
+        self.recorder = recorder
+        self.merger = engine_merger(engine)
+
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.reader: DatagramReader | None = None
+        self.timers: dict[str, asyncio.TimerHandle] = {}
+        self.tasks: list[asyncio.Task] = []
+        self.transfer_server: socketserver.BaseServer | None = None
+
+    @property
+    def id(self) -> str:
+        return self.engine.id
+
+    @property
+    def address(self) -> Address:
+        return self.engine.address
+
+    @property
+    def running(self) -> bool:
+        return self.loop is not None
+
+    async def start(self) -> None:
+        """
+        Bind the socket and start receiving, gossiping and joining on the
+        running event loop
+
+        Raises:
+            OSError: if the address (or its TCP port with transfer) cannot
+                be bound
+        """
+        if self.running:
+            return
+        loop = asyncio.get_running_loop()
+        engine = self.engine
+
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                self.socket.bind(engine.address)
+            except OSError:
+                self.socket.close()
+                self.socket = None
+                raise
+        if self.transfer:
+            try:
+                self.transfer_server = serve_state_transfer(engine)
+            except OSError:
+                if self.owns_socket:
+                    self.socket.close()
+                    self.socket = None
+                raise
+
+        self.loop = loop
+        self.reader = DatagramReader(self.socket, arena=shared_arena(loop))
+        engine.is_online = True
+        self.joined = self.joined or engine.is_introducer
+
+        loop.add_reader(self.socket, self.receive)
+        for connection in self.connections:
+            loop.add_reader(
+                connection.fileno(), self.receive_batch, connection
+            )
+
+        # spread the first ticks of nodes started together
+        self.schedule("gossip", engine.rng.uniform(0, self.t_gossip),
+                      self.gossip_tick)
+        self.schedule("update", engine.rng.uniform(0, self.t_update),
+                      self.update_tick)
+        if not self.joined:
+            self.tasks.append(loop.create_task(self.join()))
+        if self.t_resync > 0:
+            self.tasks.append(loop.create_task(self.resync_loop()))
+        if self.state_file is not None:
+            self.tasks.append(loop.create_task(self.save_loop()))
+
+    async def stop(self, leave: bool = True) -> None:
+        """
+        Stop the node's timers and receiving, and release its socket
+
+        Args:
+            leave (bool): tell the next fanout gossip targets we are
+                leaving, so the cluster fails us without waiting for the
+                failure detector
+        """
+        loop = self.loop
+        if loop is None:
+            return
+        engine = self.engine
+
+        if leave and self.joined:
+            engine.lock.acquire()
+            targets = [
+                engine.member_list[member_id].address
+                for member_id in engine.peers.take(engine.fanout)
+            ]
+            engine.lock.release()
+            data = engine.leave_message()
+            for target in targets:
+                try:
+                    self.socket.sendto(data, target)
+                except OSError as e:
+                    engine.logger.log(
+                        f"Failed to send leave to {target}: {e}", verbosity=2
+                    )
+        engine.is_online = False
+
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+
+        loop.remove_reader(self.socket)
+        for connection in self.connections:
+            loop.remove_reader(connection.fileno())
+        self.reader.close()
+        if self.owns_socket:
+            self.socket.close()
+            self.socket = None
+            self.joined = False
+        if self.transfer_server is not None:
+            # shutdown() waits for serve_forever on another thread
+            await loop.run_in_executor(None, self.transfer_server.shutdown)
+            self.transfer_server.server_close()
+            self.transfer_server = None
+        self.loop = None
+
+    # TIMERS
+
+    def schedule(self, name: str, delay: float, callback) -> None:
+        self.timers[name] = self.loop.call_later(delay, callback)
+
+    def gossip_tick(self) -> None:
+        if self.engine.is_online:
+            self.engine.gossip_round(self.socket)
+        self.schedule("gossip", self.t_gossip, self.gossip_tick)
+
+    def update_tick(self) -> None:
+        engine = self.engine
+        if engine.is_online:
+            engine.update_member_list()
+            engine.flush_joins(self.socket)
+            if engine.detector == Detector.SWIM:
+                engine.probe_tick(self.socket)
+        self.schedule("update", self.t_update, self.update_tick)
+
+    async def join(self) -> None:
+        """
+        Join through the known peers, then the seeds in turn, until one
+        answers: over TCP with transfer, otherwise (or if that fails)
+        with a join datagram, answered with gossip at the seed's next
+        update tick.  A warm started member list already holds the known
+        peers, so only gossip arriving after a join counts as an answer.
+        """
+        engine = self.engine
+        targets = [
+            address for _, address in self.known_peers[:WARM_START_PEERS]
+        ] + engine.join_seeds()
+        if not targets:
+            self.joined = True
+            return
+
+        gossip_received = engine.metrics.messages_received[Command.GOSSIP]
+        attempt = 0
+        while True:
+            if attempt and attempt % len(targets) == 0:
+                engine.logger.log("No seed is responding, retrying")
+            target = targets[attempt % len(targets)]
+            attempt += 1
+
+            if self.transfer:
+                try:
+                    entries = await self.loop.run_in_executor(
+                        None, exchange_state, engine, target
+                    )
+                    engine.logger.log(
+                        f"Joined through {target}, {entries} members",
+                        verbosity=2
+                    )
+                    break
+                except (OSError, DecodeError) as e:
+                    engine.logger.log(
+                        f"State transfer from {target} failed ({e}), "
+                        "joining over UDP", verbosity=2
+                    )
+
+            heard = gossip_received.value
+            try:
+                self.socket.sendto(engine.join_message(), target)
+            except OSError as e:
+                engine.logger.log(f"Failed to send join to {target}: {e}")
+            await asyncio.sleep(self.t_join)
+            if gossip_received.value > heard:
+                engine.logger.log(f"Joined through {target}", verbosity=2)
+                break
+        self.joined = True
+
+    async def resync_loop(self) -> None:
+        engine = self.engine
+        while True:
+            await asyncio.sleep(self.t_resync)
+            peer = engine.random_peer() if engine.is_online else None
+            if peer is None:
+                continue
+            member_id, address = peer
+            try:
+                # blocking TCP, kept off the event loop
+                await self.loop.run_in_executor(
+                    None, exchange_state, engine, address
+                )
+            except (OSError, DecodeError) as e:
+                engine.logger.log(
+                    f"Resync with {member_id} failed: {e}", verbosity=2
+                )
+
+    async def save_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.t_save)
+            if not self.engine.is_online:
+                continue
+            try:
+                # fsync blocks, kept off the event loop
+                await self.loop.run_in_executor(
+                    None, save_engine_state, self.engine, self.state_file
+                )
+            except OSError as e:
+                self.engine.logger.log(f"Failed to save the state file: {e}")
+
+    # RECEIVING
+
+    def receive(self) -> None:
+        if not self.engine.is_online:
+            return
+        drain_premerged(
+            self.engine, self.socket, self.reader, self.merger, self.recorder
+        )
+
+    def receive_batch(self, connection: Connection) -> None:
+        try:
+            batch = connection.recv()
+        except EOFError:
+            self.engine.logger.log("Receiver worker exited")
+            self.loop.remove_reader(connection.fileno())
+            self.connections.remove(connection)
+            return
+        handle_batch(self.engine, self.socket, batch)
+
+
+class NodeLoop(object):
+    """ An event loop on a daemon thread, running any number of nodes """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.nodes: list[GossipNode] = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True
+        )
+        self.thread.start()
+
+    def call(self, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        """ Run a coroutine on the loop and wait for its result """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def add(self, node: GossipNode) -> GossipNode:
+        """
+        Start a node on the loop
+
+        Raises:
+            OSError: if the node's address cannot be bound
+        """
+        self.call(node.start())
+        self.lock.acquire()
+        self.nodes.append(node)
+        self.lock.release()
+        return node
+
+    def remove(self, node: GossipNode, leave: bool = True) -> None:
+        """ Stop a node, see GossipNode.stop """
+        self.lock.acquire()
+        if node in self.nodes:
+            self.nodes.remove(node)
+        self.lock.release()
+        self.call(node.stop(leave))
+
+    def close(self, leave: bool = True) -> None:
+        """ Stop every node and the loop """
+        self.lock.acquire()
+        nodes, self.nodes = self.nodes, []
+        self.lock.release()
+        for node in nodes:
+            self.call(node.stop(leave))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
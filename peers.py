@@ -0,0 +1,100 @@
+"""
+Gossip and probe target selection in shuffled round-robin order.
+
+Sampling fanout random members every round costs a copy of the member
+list per round, wastes picks on ourselves and on failed members (so fewer
+than fanout peers may be contacted), and leaves the time until a given
+peer is next contacted unbounded.  PeerSelector keeps the eligible peers
+in an array with an index, so adding or removing one is a swap with the
+last element, and hands them out from a cursor that walks the array:
+
+    peers    [ taken this pass | not yet taken ]
+                                ^ position
+
+When the cursor reaches the end the array is reshuffled and the next pass
+begins.  A peer added mid-pass swaps into a random not yet taken slot, and
+a removed peer's slot is refilled without moving anyone across the cursor,
+so every peer is taken exactly once per pass: with n peers and fanout k a
+peer is contacted at least once every 2 * ceil(n / k) rounds.
+"""
+import random
+
+
+class PeerSelector(object):
+    def __init__(self, rng: random.Random | None = None):
+        self.rng = rng if rng is not None else random.Random()
+        self.peers: list[str] = []
+        self.index: dict[str, int] = {}    # peer -> its slot in peers
+        self.position = 0                  # peers before it were taken
+
+    def __len__(self) -> int:
+        return len(self.peers)
+
+    def __contains__(self, member_id: object) -> bool:
+        return member_id in self.index
+
+    def move(self, source: int, target: int) -> None:
+        """ Put the peer at source into slot target """
+        if source != target:
+            member_id = self.peers[source]
+            self.peers[target] = member_id
+            self.index[member_id] = target
+
+    def swap(self, i: int, j: int) -> None:
+        peers = self.peers
+        peers[i], peers[j] = peers[j], peers[i]
+        self.index[peers[i]] = i
+        self.index[peers[j]] = j
+
+    def add(self, member_id: str) -> None:
+        """ Make a peer eligible, at a random place in the rest of the pass """
+        if member_id in self.index:
+            return
+        last = len(self.peers)
+        self.peers.append(member_id)
+        self.index[member_id] = last
+        self.swap(last, self.rng.randint(self.position, last))
+
+    def remove(self, member_id: str) -> None:
+        """ Make a peer ineligible, a no-op if it is not eligible """
+        slot = self.index.pop(member_id, None)
+        if slot is None:
+            return
+        if slot < self.position:
+            # refill from the end of the taken part to keep it contiguous
+            self.position -= 1
+            self.move(self.position, slot)
+            slot = self.position
+        self.move(len(self.peers) - 1, slot)
+        self.peers.pop()
+
+    def reshuffle(self, taken: list[str]) -> None:
+        """ Start a new pass, with the peers taken this round last """
+        self.rng.shuffle(self.peers)
+        for slot, member_id in enumerate(self.peers):
+            self.index[member_id] = slot
+        self.position = 0
+
+        tail = len(self.peers)
+        for member_id in taken:
+            tail -= 1
+            self.swap(self.index[member_id], tail)
+
+    def take(self, count: int) -> list[str]:
+        """
+        Take the next peers in the order, each at most once
+
+        Args:
+            count (int): how many peers to take
+
+        Returns:
+            list[str]: min(count, eligible peers) distinct peers
+        """
+        count = min(count, len(self.peers))
+        taken: list[str] = []
+        while len(taken) < count:
+            if self.position == len(self.peers):
+                self.reshuffle(taken)
+            taken.append(self.peers[self.position])
+            self.position += 1
+        return taken
@@ -0,0 +1,152 @@
+"""
+Phi accrual failure detection.
+
+Instead of suspecting a member once a fixed t_suspect has passed since its
+heartbeat last went up, keep a window of the intervals between those
+arrivals and ask how unlikely it is that the next one is still to come:
+
+    phi = -log10(P(interval > time since the last arrival))
+
+with intervals taken to be normally distributed around the window's mean.
+phi 1 means a 10% chance of being wrong to suspect now, phi 8 one in 10^8.
+A member whose heartbeats arrive like clockwork is suspected soon after
+they stop; one whose heartbeats arrive irregularly (a loaded link, a
+member pausing under load, a large cluster where gossip takes a varying
+number of hops) gets a proportionally longer grace period instead of
+cycling through suspect and rejoin.
+
+phi only grows with time since the last arrival, so the point where it
+crosses the threshold is computed ahead (timeout) and armed as an ordinary
+deadline; nothing is polled.
+
+Each window starts from one prior interval (first_interval, t_suspect by
+default in the engine), so a new member is judged as the fixed timeout
+would until its own history takes over.
+"""
+import math
+
+from collections import deque
+from statistics import NormalDist
+
+DEFAULT_PHI_THRESHOLD = 8.0
+DEFAULT_WINDOW = 100            # intervals kept per member
+DEFAULT_MIN_STD = 0.1           # seconds, floor for very regular members
+DEFAULT_ACCEPTABLE_PAUSE = 0.0  # seconds added to every expected interval
+
+_STANDARD = NormalDist()
+
+
+class ArrivalWindow(object):
+    __slots__ = ("intervals", "total", "squares", "last")
+
+    def __init__(self, first_interval: float, size: int, now: float):
+        self.intervals: deque[float] = deque(maxlen=size)
+        self.total = 0.0
+        self.squares = 0.0
+        self.last = now
+        self.add(first_interval)
+
+    def add(self, interval: float) -> None:
+        if len(self.intervals) == self.intervals.maxlen:
+            oldest = self.intervals[0]
+            self.total -= oldest
+            self.squares -= oldest * oldest
+        self.intervals.append(interval)
+        self.total += interval
+        self.squares += interval * interval
+
+    def mean(self) -> float:
+        return self.total / len(self.intervals)
+
+    def std(self) -> float:
+        mean = self.mean()
+        variance = self.squares / len(self.intervals) - mean * mean
+        return math.sqrt(max(variance, 0.0))
+
+
+class PhiAccrualDetector(object):
+    def __init__(
+        self,
+        threshold: float = DEFAULT_PHI_THRESHOLD,
+        first_interval: float = 1.0,
+        window: int = DEFAULT_WINDOW,
+        min_std: float = DEFAULT_MIN_STD,
+        acceptable_pause: float = DEFAULT_ACCEPTABLE_PAUSE
+    ):
+        """
+        Args:
+            threshold (float): phi at which a member is suspected
+            first_interval (float): the prior every window starts from
+            window (int): intervals kept per member
+            min_std (float): floor of the interval standard deviation
+            acceptable_pause (float): added to the mean interval
+        """
+        if threshold <= 0:
+            raise ValueError("phi threshold must be positive")
+
+        self.threshold = threshold
+        self.first_interval = first_interval
+        self.window = window
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        # standard deviations past the mean where phi reaches threshold
+        self.deviations = -_STANDARD.inv_cdf(10 ** -threshold)
+
+        self.arrivals: dict[str, ArrivalWindow] = {}
+
+    def heartbeat(self, member_id: str, now: float) -> None:
+        """ Record that a member's heartbeat went up at now """
+        arrivals = self.arrivals.get(member_id)
+        if arrivals is None:
+            self.arrivals[member_id] = ArrivalWindow(
+                self.first_interval, self.window, now
+            )
+            return
+        arrivals.add(now - arrivals.last)
+        arrivals.last = now
+
+    def forget(self, member_id: str) -> None:
+        self.arrivals.pop(member_id, None)
+
+    def distribution(self, arrivals: ArrivalWindow) -> tuple[float, float]:
+        """ The mean and standard deviation intervals are judged by """
+        return (
+            arrivals.mean() + self.acceptable_pause,
+            max(arrivals.std(), self.min_std)
+        )
+
+    def phi(self, member_id: str, now: float) -> float:
+        """
+        The suspicion level of a member
+
+        Args:
+            member_id (str): the member
+            now (float): the current time
+
+        Returns:
+            float: phi, 0.0 for members never heard from
+        """
+        arrivals = self.arrivals.get(member_id)
+        if arrivals is None:
+            return 0.0
+        mean, std = self.distribution(arrivals)
+        later = _STANDARD.cdf((mean - (now - arrivals.last)) / std)
+        if later <= 0.0:
+            return math.inf
+        return -math.log10(later)
+
+    def timeout(self, member_id: str) -> float:
+        """
+        How long after its last heartbeat a member reaches the threshold
+
+        Args:
+            member_id (str): the member
+
+        Returns:
+            float: seconds after the last arrival
+        """
+        arrivals = self.arrivals.get(member_id)
+        if arrivals is None:
+            return self.first_interval
+        mean, std = self.distribution(arrivals)
+        return mean + std * self.deviations
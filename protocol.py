@@ -0,0 +1,969 @@
+"""
+Message types and wire codecs for the gossip membership protocol.
+
+Two encodings are supported:
+
+* ``WireFormat.BINARY`` (default): a versioned, length-prefixed binary
+  format.  Counters are fixed width, enums are single byte codes, and
+  strings (member ids and hosts) are interned once per message in a string
+  table that the member records refer to by index.
+* ``WireFormat.JSON``: a human readable fallback meant for debugging.
+
+``decode_message`` accepts either encoding, so nodes running different
+formats can still talk to each other.
+
+Binary layout (all integers are network byte order)::
+
+    header   magic:u8  version:u8  kind:u8  body_length:u32
+    string   length:u16  utf8 bytes
+    table    count:u32  string*
+
+    GOSSIP   table  sender:u32  version:u64  ack:u64
+             count:u32  (id:u32 host:u32 port:u16
+                         heartbeat:u64 incarnation:u64 status:u8)*
+    JOIN     string(id)  string(host)  port:u16
+    LEAVE    string(id)
+    PING     string(id)  seq:u64
+    PING_REQ string(id)  seq:u64  string(target)  string(host)  port:u16
+    ACK      string(id)  seq:u64
+
+Fields that only make sense locally (``time`` and ``failed_time``) are not
+transmitted and decode as ``0.0``.  The optional gossip ``sender``,
+``version`` and ``ack`` fields drive delta gossip (see delta.py); a sender
+index of ``NO_SENDER`` means they are absent.
+
+A member list does not have to fit in one datagram: GossipBudget tells a
+sender how many records fit in an MTU and paginate_records splits a list
+into datagram sized pages.  Receivers merge whatever entries a message
+carries, so every page stands on its own.
+"""
+import json
+import math
+import struct
+
+from enum import Enum
+from typing import TypedDict, Literal, NotRequired, cast
+
+# ENUMS AND TYPED DICTS
+
+
+class Command(Enum):
+    JOIN = 0
+    LEAVE = 1
+    GOSSIP = 2
+    PING = 3        # SWIM direct probe
+    PING_REQ = 4    # SWIM indirect probe request
+    ACK = 5         # answer to a (relayed) probe
+
+
+class Status(Enum):
+    ALIVE = 0
+    SUSPECTED = 1
+    FAILED = 2
+
+
+class Member(TypedDict):
+    id: str
+    address: tuple[str, int]
+    heartbeat: int
+    time: float
+    status: tuple[int, Status]  # (incarnation, status)
+    failed_time: float          # time when failed
+
+
+class JoinMessageData(TypedDict):
+    id: str
+    host: str
+    port: int
+
+
+class LeaveMessageData(TypedDict):
+    id: str
+
+
+class LeaveMessage(TypedDict):
+    command: Literal[Command.LEAVE]
+    data: LeaveMessageData
+
+
+class JoinMessage(TypedDict):
+    command: Literal[Command.JOIN]
+    data: JoinMessageData
+
+
+class GossipMessage(TypedDict):
+    command: Literal[Command.GOSSIP]
+    data: dict[str, Member]
+    sender: NotRequired[str]    # sender id, for delta tracking
+    version: NotRequired[int]   # sender's member list version
+    ack: NotRequired[int]       # receiver's version the sender has merged
+
+
+class PingMessageData(TypedDict):
+    id: str     # the prober
+    seq: int    # echoed back in the ack
+
+
+class PingReqMessageData(TypedDict):
+    id: str     # the member asking for the probe
+    seq: int    # the asker's probe, echoed back in the relayed ack
+    target: str
+    host: str
+    port: int
+
+
+class AckMessageData(TypedDict):
+    id: str     # the probed member
+    seq: int
+
+
+class PingMessage(TypedDict):
+    command: Literal[Command.PING]
+    data: PingMessageData
+
+
+class PingReqMessage(TypedDict):
+    command: Literal[Command.PING_REQ]
+    data: PingReqMessageData
+
+
+class AckMessage(TypedDict):
+    command: Literal[Command.ACK]
+    data: AckMessageData
+
+
+class Message(TypedDict):
+    command: Command
+    data: dict[str, Member] | JoinMessageData | LeaveMessageData
+
+
+# immutable copy of the gossiped fields of a Member:
+# (id, host, port, heartbeat, incarnation, status)
+GossipRecord = tuple[str, str, int, int, int, Status]
+
+
+def member_record(member: Member) -> GossipRecord:
+    host, port = member["address"]
+    incarnation, status = member["status"]
+    return (member["id"], host, port, member["heartbeat"], incarnation, status)
+
+
+class WireFormat(Enum):
+    BINARY = "binary"
+    JSON = "json"
+
+
+class DecodeError(ValueError):
+    """Raised when a datagram cannot be decoded."""
+
+
+# WIRE CONSTANTS
+
+WIRE_MAGIC = 0xC5
+WIRE_VERSION = 2
+
+# kind code used by server.py for its node table, kept clear of Command
+KIND_NODE_TABLE = 0x10
+
+NODE_STATUSES = ("online", "suspect", "failed", "joining")
+
+NO_SENDER = 0xFFFFFFFF
+
+# largest datagram a gossip round is cut down to: 1500 byte Ethernet frames
+# minus IP and UDP headers, with room to spare for tunnels
+DEFAULT_MTU = 1400
+
+# the largest datagram a receiver has to accept
+MAX_DATAGRAM_SIZE = 65535
+
+# status codes are the enum values, which count up from zero
+_STATUSES = tuple(Status)
+
+_HEADER = struct.Struct("!BBBI")
+_COUNT = struct.Struct("!I")
+_GOSSIP_HEADER = struct.Struct("!IQQ")
+_ACK = struct.Struct("!Q")
+_STRING_LENGTH = struct.Struct("!H")
+_PORT = struct.Struct("!H")
+_SEQ = struct.Struct("!Q")
+_MEMBER = struct.Struct("!IIHQQB")
+_NODE_ENTRY = struct.Struct("!IQQdQBQ")
+# the largest values the binary fields hold, which JSON must respect too
+_U16_MAX = 0xFFFF
+_U64_MAX = 0xFFFFFFFFFFFFFFFF
+# the fields of every JSON message body other than gossip, with their types
+_JSON_FIELDS: dict[Command, tuple[tuple[str, type], ...]] = {
+    Command.JOIN: (("id", str), ("host", str), ("port", int)),
+    Command.LEAVE: (("id", str),),
+    Command.PING: (("id", str), ("seq", int)),
+    Command.PING_REQ: (
+        ("id", str), ("seq", int), ("target", str), ("host", str),
+        ("port", int)
+    ),
+    Command.ACK: (("id", str), ("seq", int)),
+}
+# the counters of a node table entry that is not a join request
+_NODE_FIELDS = (
+    "heartbeat_counter", "local_clock", "version_id", "incarnation"
+)
+
+
+# BINARY HELPERS
+
+
+class _StringTable(object):
+    """Interns strings so that each one is written once per message."""
+
+    def __init__(self):
+        self.index: dict[str, int] = {}
+        self.strings: list[str] = []
+
+    def intern(self, value: str) -> int:
+        position = self.index.get(value)
+        if position is None:
+            position = len(self.strings)
+            self.index[value] = position
+            self.strings.append(value)
+        return position
+
+    def write(self, out: bytearray) -> None:
+        out += _COUNT.pack(len(self.strings))
+        for value in self.strings:
+            _write_string(out, value)
+
+
+def _write_string(out: bytearray, value: str) -> None:
+    encoded = value.encode()
+    out += _STRING_LENGTH.pack(len(encoded))
+    out += encoded
+
+
+def _read_string(view: memoryview, offset: int) -> tuple[str, int]:
+    (length,) = _STRING_LENGTH.unpack_from(view, offset)
+    offset += _STRING_LENGTH.size
+    end = offset + length
+    if end > len(view):
+        raise DecodeError("string runs past end of message")
+    return bytes(view[offset:end]).decode(), end
+
+
+def _read_table(view: memoryview, offset: int) -> tuple[list[str], int]:
+    (count,) = _COUNT.unpack_from(view, offset)
+    offset += _COUNT.size
+
+    # one copy up front; slicing bytes is much cheaper than slicing views
+    data = bytes(view)
+    unpack_length = _STRING_LENGTH.unpack_from
+    strings = []
+    for _ in range(count):
+        (length,) = unpack_length(data, offset)
+        offset += _STRING_LENGTH.size
+        strings.append(data[offset:offset + length].decode())
+        offset += length
+
+    if offset > len(data):
+        raise DecodeError("string table runs past end of message")
+    return strings, offset
+
+
+def _frame(kind: int, body: bytearray) -> bytes:
+    return _HEADER.pack(WIRE_MAGIC, WIRE_VERSION, kind, len(body)) + body
+
+
+def _unframe(data: bytes | bytearray | memoryview) -> tuple[int, memoryview]:
+    view = memoryview(data)
+    if len(view) < _HEADER.size:
+        raise DecodeError("message shorter than header")
+
+    magic, version, kind, length = _HEADER.unpack_from(view, 0)
+    if magic != WIRE_MAGIC:
+        raise DecodeError("bad magic byte")
+    if version != WIRE_VERSION:
+        raise DecodeError(f"unsupported wire version {version}")
+    if _HEADER.size + length > len(view):
+        raise DecodeError("message truncated")
+
+    return kind, view[_HEADER.size:_HEADER.size + length]
+
+
+def _encode_gossip(message: GossipMessage) -> bytes:
+    encoder = GossipEncoder(WireFormat.BINARY, capacity=0)
+    encoder.encode(
+        message.get("sender"),
+        message.get("version", 0),
+        [member_record(member) for member in message["data"].values()]
+    )
+    return bytes(encoder.payload(message.get("ack", 0)))
+
+
+def _decode_gossip(body: memoryview) -> GossipMessage:
+    strings, offset = _read_table(body, 0)
+    sender, version, ack = _GOSSIP_HEADER.unpack_from(body, offset)
+    offset += _GOSSIP_HEADER.size
+    (count,) = _COUNT.unpack_from(body, offset)
+    offset += _COUNT.size
+
+    if offset + count * _MEMBER.size > len(body):
+        raise DecodeError("member records truncated")
+
+    statuses = _STATUSES
+    members: dict[str, Member] = {}
+    for id_index, host_index, port, heartbeat, incarnation, status in (
+        _MEMBER.iter_unpack(body[offset:offset + count * _MEMBER.size])
+    ):
+        member_id = strings[id_index]
+        members[member_id] = Member(
+            id=member_id,
+            address=(strings[host_index], port),
+            heartbeat=heartbeat,
+            time=0.0,
+            status=(incarnation, statuses[status]),
+            failed_time=0.0
+        )
+
+    message = GossipMessage(command=Command.GOSSIP, data=members)
+    if sender != NO_SENDER:
+        message["sender"] = strings[sender]
+        message["version"] = version
+        message["ack"] = ack
+    return message
+
+
+def _encode_binary(message: Message) -> bytes:
+    match message["command"]:
+        case Command.GOSSIP:
+            return _encode_gossip(cast(GossipMessage, message))
+        case Command.JOIN:
+            join_data = cast(JoinMessage, message)["data"]
+            body = bytearray()
+            _write_string(body, join_data["id"])
+            _write_string(body, join_data["host"])
+            body += _PORT.pack(join_data["port"])
+            return _frame(Command.JOIN.value, body)
+        case Command.LEAVE:
+            body = bytearray()
+            _write_string(body, cast(LeaveMessage, message)["data"]["id"])
+            return _frame(Command.LEAVE.value, body)
+        case Command.PING | Command.ACK:
+            probe_data = cast(PingMessage | AckMessage, message)["data"]
+            body = bytearray()
+            _write_string(body, probe_data["id"])
+            body += _SEQ.pack(probe_data["seq"])
+            return _frame(message["command"].value, body)
+        case Command.PING_REQ:
+            request_data = cast(PingReqMessage, message)["data"]
+            body = bytearray()
+            _write_string(body, request_data["id"])
+            body += _SEQ.pack(request_data["seq"])
+            _write_string(body, request_data["target"])
+            _write_string(body, request_data["host"])
+            body += _PORT.pack(request_data["port"])
+            return _frame(Command.PING_REQ.value, body)
+
+    raise ValueError(f"unknown command {message['command']}")
+
+
+def _decode_binary(data: bytes | bytearray | memoryview) -> Message:
+    kind, body = _unframe(data)
+
+    try:
+        command = Command(kind)
+    except ValueError:
+        raise DecodeError(f"unknown message kind {kind}")
+
+    match command:
+        case Command.GOSSIP:
+            return _decode_gossip(body)
+        case Command.JOIN:
+            member_id, offset = _read_string(body, 0)
+            host, offset = _read_string(body, offset)
+            (port,) = _PORT.unpack_from(body, offset)
+            return JoinMessage(
+                command=Command.JOIN,
+                data=JoinMessageData(id=member_id, host=host, port=port)
+            )
+        case Command.LEAVE:
+            member_id, _ = _read_string(body, 0)
+            return LeaveMessage(
+                command=Command.LEAVE,
+                data=LeaveMessageData(id=member_id)
+            )
+        case Command.PING:
+            member_id, offset = _read_string(body, 0)
+            (seq,) = _SEQ.unpack_from(body, offset)
+            return PingMessage(
+                command=Command.PING,
+                data=PingMessageData(id=member_id, seq=seq)
+            )
+        case Command.ACK:
+            member_id, offset = _read_string(body, 0)
+            (seq,) = _SEQ.unpack_from(body, offset)
+            return AckMessage(
+                command=Command.ACK,
+                data=AckMessageData(id=member_id, seq=seq)
+            )
+        case Command.PING_REQ:
+            member_id, offset = _read_string(body, 0)
+            (seq,) = _SEQ.unpack_from(body, offset)
+            offset += _SEQ.size
+            target, offset = _read_string(body, offset)
+            host, offset = _read_string(body, offset)
+            (port,) = _PORT.unpack_from(body, offset)
+            return PingReqMessage(
+                command=Command.PING_REQ,
+                data=PingReqMessageData(
+                    id=member_id, seq=seq, target=target, host=host, port=port
+                )
+            )
+
+
+# JSON FALLBACK
+
+
+def _encode_json(message: Message) -> bytes:
+    if message["command"] != Command.GOSSIP:
+        return json.dumps({
+            "command": message["command"].name,
+            "data": message["data"],
+        }).encode()
+
+    gossip = cast(GossipMessage, message)
+    encoder = GossipEncoder(WireFormat.JSON, capacity=0)
+    encoder.encode(
+        gossip.get("sender"),
+        gossip.get("version", 0),
+        [member_record(member) for member in gossip["data"].values()]
+    )
+    return bytes(encoder.payload(gossip.get("ack", 0)))
+
+
+def _json_value(value: object, name: str, kind: type) -> object:
+    # JSON decodes anything; only let through what the binary format could
+    # have carried, so that handlers never see a missing or mistyped field
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise DecodeError(f"missing or mistyped field {name!r}")
+    if kind is int and not 0 <= value <= (
+        _U16_MAX if name == "port" else _U64_MAX
+    ):
+        raise DecodeError(f"field {name!r} out of range")
+    return value
+
+
+def _json_field(raw: dict, key: str, kind: type) -> object:
+    return _json_value(raw.get(key), key, kind)
+
+
+def _decode_json_member(member_id: str, raw: object) -> Member:
+    raw = cast(dict, _json_value(raw, "member", dict))
+    if raw.get("id") != member_id:
+        raise DecodeError(f"member entry {member_id!r} has another id")
+    address = cast(list, _json_field(raw, "address", list))
+    status = cast(list, _json_field(raw, "status", list))
+    if len(address) != 2 or len(status) != 2:
+        raise DecodeError("malformed member entry")
+    if not isinstance(status[1], str) or status[1] not in Status.__members__:
+        raise DecodeError(f"unknown status {status[1]!r}")
+
+    return Member(
+        id=member_id,
+        address=(
+            cast(str, _json_value(address[0], "host", str)),
+            cast(int, _json_value(address[1], "port", int))
+        ),
+        heartbeat=cast(int, _json_field(raw, "heartbeat", int)),
+        time=0.0,
+        status=(
+            cast(int, _json_value(status[0], "incarnation", int)),
+            Status[status[1]]
+        ),
+        failed_time=0.0
+    )
+
+
+def _decode_json(data: bytes | bytearray | memoryview) -> Message:
+    raw = cast(dict, _json_value(
+        json.loads(bytes(data).decode()), "message", dict
+    ))
+    name = _json_field(raw, "command", str)
+    if name not in Command.__members__:
+        raise DecodeError(f"unknown command {name!r}")
+    command = Command[cast(str, name)]
+    body = cast(dict, _json_field(raw, "data", dict))
+
+    if command != Command.GOSSIP:
+        return cast(Message, {
+            "command": command,
+            "data": {
+                key: _json_field(body, key, kind)
+                for key, kind in _JSON_FIELDS[command]
+            },
+        })
+
+    message = GossipMessage(
+        command=Command.GOSSIP,
+        data={
+            member_id: _decode_json_member(member_id, member)
+            for member_id, member in body.items()
+        }
+    )
+    if "sender" in raw:
+        message["sender"] = cast(str, _json_field(raw, "sender", str))
+        message["version"] = cast(int, _json_field(raw, "version", int))
+        message["ack"] = cast(int, _json_field(raw, "ack", int))
+    return message
+
+
+# PUBLIC API
+
+
+def encode_message(
+    message: Message,
+    wire_format: WireFormat = WireFormat.BINARY
+) -> bytes:
+    """
+    Encode a message for sending
+
+    Args:
+        message (Message): the message to encode
+        wire_format (WireFormat): binary (default) or JSON for debugging
+
+    Returns:
+        bytes: the encoded datagram
+    """
+    if wire_format == WireFormat.JSON:
+        return _encode_json(message)
+    return _encode_binary(message)
+
+
+def decode_message(data: bytes | bytearray | memoryview) -> Message:
+    """
+    Decode a datagram produced by encode_message, in either wire format
+
+    Args:
+        data (bytes): the received datagram
+
+    Raises:
+        DecodeError: if the datagram is malformed or truncated
+
+    Returns:
+        Message: the decoded message
+    """
+    if len(data) == 0:
+        raise DecodeError("empty message")
+
+    try:
+        if data[0] == WIRE_MAGIC:
+            return _decode_binary(data)
+        return _decode_json(data)
+    except DecodeError:
+        raise
+    except (struct.error, AttributeError, KeyError, IndexError, TypeError,
+            ValueError, UnicodeDecodeError) as e:
+        raise DecodeError(str(e)) from e
+
+
+def decode_gossip_records(
+    data: bytes | bytearray | memoryview
+) -> tuple[list[str], str | None, int, int, list[tuple]] | None:
+    """
+    Decode a binary gossip message without building a Member per record,
+    for receivers that reduce many messages to one entry per member (see
+    ingest.PreMerger) and so would throw most of them away
+
+    Args:
+        data (bytes): the received datagram
+
+    Raises:
+        DecodeError: if the datagram is malformed or truncated
+
+    Returns:
+        tuple | None: the string table, the sender (None if absent), the
+            version and the ack, and the records as tuples of (id index,
+            host index, port, heartbeat, incarnation, status code) with
+            every index and code checked; None if data is not binary
+            gossip, which decode_message handles
+    """
+    if len(data) == 0 or data[0] != WIRE_MAGIC:
+        return None
+
+    try:
+        kind, body = _unframe(data)
+        if kind != Command.GOSSIP.value:
+            return None
+
+        strings, offset = _read_table(body, 0)
+        sender, version, ack = _GOSSIP_HEADER.unpack_from(body, offset)
+        offset += _GOSSIP_HEADER.size
+        (count,) = _COUNT.unpack_from(body, offset)
+        offset += _COUNT.size
+
+        if offset + count * _MEMBER.size > len(body):
+            raise DecodeError("member records truncated")
+        records = list(
+            _MEMBER.iter_unpack(body[offset:offset + count * _MEMBER.size])
+        )
+    except DecodeError:
+        raise
+    except (struct.error, ValueError, UnicodeDecodeError) as e:
+        raise DecodeError(str(e)) from e
+
+    # checked a column at a time, so that folding records cannot fail
+    if records:
+        columns = list(zip(*records))
+        if max(columns[0]) >= len(strings) or max(columns[1]) >= len(strings):
+            raise DecodeError("string index out of range")
+        if max(columns[5]) >= len(_STATUSES):
+            raise DecodeError("unknown status code")
+    if sender == NO_SENDER:
+        return strings, None, version, ack, records
+    if sender >= len(strings):
+        raise DecodeError("string index out of range")
+    return strings, strings[sender], version, ack, records
+
+
+class GossipBudget(object):
+    """
+    Tracks the size of a binary gossip message as records are added, so
+    that a sender can stop before the datagram exceeds its MTU.
+
+    JSON messages are larger than this estimate; the budget is only exact
+    for WireFormat.BINARY.
+    """
+
+    def __init__(self, sender: str | None, limit: int = DEFAULT_MTU):
+        self.limit = limit
+        self.strings: set[str] = set()
+        self.size = (
+            _HEADER.size + _COUNT.size + _GOSSIP_HEADER.size + _COUNT.size
+        )
+        if sender is not None:
+            self.size += self._string_cost(sender)
+            self.strings.add(sender)
+
+    def _string_cost(self, value: str) -> int:
+        if value in self.strings:
+            return 0
+        return _STRING_LENGTH.size + len(value.encode())
+
+    def capacity(self) -> int:
+        """ An upper bound on the records that still fit """
+        return max(0, self.limit - self.size) // _MEMBER.size
+
+    def cost(self, record: GossipRecord) -> int:
+        """ The bytes that adding record would take """
+        member_id, host = record[0], record[1]
+        cost = _MEMBER.size + self._string_cost(member_id)
+        if host != member_id:
+            cost += self._string_cost(host)
+        return cost
+
+    def add(self, record: GossipRecord) -> bool:
+        """
+        Account for record if it still fits
+
+        Args:
+            record (GossipRecord): the record to add
+
+        Returns:
+            bool: whether it fit; nothing is accounted for if not
+        """
+        cost = self.cost(record)
+        if self.size + cost > self.limit:
+            return False
+        self.size += cost
+        self.strings.add(record[0])
+        self.strings.add(record[1])
+        return True
+
+
+def paginate_records(
+    sender: str | None,
+    records: list[GossipRecord],
+    limit: int = DEFAULT_MTU
+) -> list[list[GossipRecord]]:
+    """
+    Split records into pages that each encode within limit bytes.  A
+    record too large for an empty page still gets a page of its own.
+
+    Args:
+        sender (str | None): the sender id each page will carry
+        records (list[GossipRecord]): the records to send
+        limit (int): the datagram size budget
+
+    Returns:
+        list[list[GossipRecord]]: the pages, in order
+    """
+    pages: list[list[GossipRecord]] = []
+    page: list[GossipRecord] = []
+    budget = GossipBudget(sender, limit)
+    for record in records:
+        if not budget.add(record) and page:
+            pages.append(page)
+            page = []
+            budget = GossipBudget(sender, limit)
+            budget.add(record)
+        page.append(record)
+    if page or not pages:
+        pages.append(page)
+    return pages
+
+
+class GossipEncoder(object):
+    """
+    Encodes a gossip round once into a reusable buffer.
+
+    The same bytes go to every target of the round; only the ack field
+    differs per target and is patched in place by payload().
+    """
+
+    def __init__(
+        self,
+        wire_format: WireFormat = WireFormat.BINARY,
+        capacity: int = 4096
+    ):
+        self.wire_format = wire_format
+        self.buffer = bytearray(capacity)
+        self.length = 0
+        self.ack_offset = 0
+        self.sender: str | None = None
+        self.version = 0
+        self.records: list[GossipRecord] = []
+
+    def _reserve(self, size: int) -> None:
+        if size > len(self.buffer):
+            # a fresh buffer, so views handed out earlier stay valid
+            self.buffer = bytearray(max(size, 2 * len(self.buffer)))
+
+    def encode(
+        self,
+        sender: str | None,
+        version: int,
+        records: list[GossipRecord]
+    ) -> None:
+        """
+        Encode a round of gossip, replacing the previous one
+
+        Args:
+            sender (str | None): our id, None to omit delta fields
+            version (int): our member list version
+            records (list[GossipRecord]): snapshot of the entries to send
+        """
+        self.sender = sender
+        self.version = version
+        self.records = records
+
+        if self.wire_format == WireFormat.JSON:
+            return
+
+        table = _StringTable()
+        sender_index = NO_SENDER if sender is None else table.intern(sender)
+        for member_id, host, _, _, _, _ in records:
+            table.intern(member_id)
+            table.intern(host)
+        encoded = [value.encode() for value in table.strings]
+
+        table_size = _COUNT.size + sum(
+            _STRING_LENGTH.size + len(value) for value in encoded
+        )
+        body_size = (
+            table_size + _GOSSIP_HEADER.size + _COUNT.size +
+            len(records) * _MEMBER.size
+        )
+        self._reserve(_HEADER.size + body_size)
+
+        buffer = self.buffer
+        _HEADER.pack_into(
+            buffer, 0, WIRE_MAGIC, WIRE_VERSION, Command.GOSSIP.value,
+            body_size
+        )
+        offset = _HEADER.size
+
+        _COUNT.pack_into(buffer, offset, len(encoded))
+        offset += _COUNT.size
+        for value in encoded:
+            _STRING_LENGTH.pack_into(buffer, offset, len(value))
+            offset += _STRING_LENGTH.size
+            buffer[offset:offset + len(value)] = value
+            offset += len(value)
+
+        _GOSSIP_HEADER.pack_into(buffer, offset, sender_index, version, 0)
+        self.ack_offset = offset + _GOSSIP_HEADER.size - _ACK.size
+        offset += _GOSSIP_HEADER.size
+
+        _COUNT.pack_into(buffer, offset, len(records))
+        offset += _COUNT.size
+
+        index = table.index
+        pack_member = _MEMBER.pack_into
+        for member_id, host, port, heartbeat, incarnation, status in records:
+            pack_member(
+                buffer, offset, index[member_id], index[host], port,
+                heartbeat, incarnation, status.value
+            )
+            offset += _MEMBER.size
+
+        self.length = offset
+
+    def payload(self, ack: int) -> bytes | memoryview:
+        """
+        The encoded round, addressed to a target that acknowledged ack
+
+        Args:
+            ack (int): the target's version we have merged
+
+        Returns:
+            bytes | memoryview: the datagram to send
+        """
+        if self.wire_format == WireFormat.JSON:
+            raw: dict = {
+                "command": Command.GOSSIP.name,
+                "data": {
+                    member_id: {
+                        "id": member_id,
+                        "address": [host, port],
+                        "heartbeat": heartbeat,
+                        "status": [incarnation, status.name],
+                    }
+                    for member_id, host, port, heartbeat, incarnation, status
+                    in self.records
+                },
+            }
+            if self.sender is not None:
+                raw["sender"] = self.sender
+                raw["version"] = self.version
+                raw["ack"] = ack
+            return json.dumps(raw).encode()
+
+        _ACK.pack_into(self.buffer, self.ack_offset, ack)
+        return memoryview(self.buffer)[:self.length]
+
+
+def encode_node_table(
+    table: dict[str, dict],
+    wire_format: WireFormat = WireFormat.BINARY
+) -> bytes:
+    """
+    Encode a server.py membership table (node name -> node data)
+
+    Entries may be partial (e.g. a join request only carries a status);
+    missing counters are sent as zero.
+
+    Args:
+        table (dict): the membership table to encode
+        wire_format (WireFormat): binary (default) or JSON for debugging
+
+    Returns:
+        bytes: the encoded datagram
+    """
+    if wire_format == WireFormat.JSON:
+        return json.dumps(table).encode()
+
+    names = _StringTable()
+    records = bytearray(_COUNT.pack(len(table)))
+
+    for node, node_data in table.items():
+        records += _NODE_ENTRY.pack(
+            names.intern(node),
+            node_data.get("heartbeat_counter", 0),
+            node_data.get("local_clock", 0),
+            node_data.get("timestamp", 0),
+            node_data.get("version_id", 0),
+            NODE_STATUSES.index(node_data["status"]),
+            node_data.get("incarnation", 0),
+        )
+
+    body = bytearray()
+    names.write(body)
+    body += records
+    return _frame(KIND_NODE_TABLE, body)
+
+
+def _check_node_table(table: object) -> dict[str, dict]:
+    # JSON decodes anything, e.g. server_new.py's gossip; only let through
+    # what server.py can merge and encode_node_table can send on again
+    if not isinstance(table, dict) or not table:
+        raise DecodeError("not a node table")
+    for node_data in table.values():
+        if (
+            not isinstance(node_data, dict) or
+            node_data.get("status") not in NODE_STATUSES
+        ):
+            raise DecodeError("not a node table entry")
+        joining = node_data["status"] == "joining"
+        for field in _NODE_FIELDS:
+            # a join request carries no counters, zero when sent on
+            if not (joining and field not in node_data):
+                _json_value(node_data.get(field), field, int)
+        if not (joining and "timestamp" not in node_data):
+            _check_timestamp(node_data.get("timestamp"))
+    return table
+
+
+def _check_timestamp(timestamp: object) -> None:
+    # sent as a double, which holds neither inf nor ints past its range
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        try:
+            if math.isfinite(timestamp):
+                return
+        except OverflowError:
+            pass
+    raise DecodeError("missing or mistyped field 'timestamp'")
+
+
+def decode_node_table(data: bytes | bytearray | memoryview) -> dict[str, dict]:
+    """
+    Decode a datagram produced by encode_node_table, in either wire format
+
+    Args:
+        data (bytes): the received datagram
+
+    Raises:
+        DecodeError: if the datagram is malformed or truncated
+
+    Returns:
+        dict: the membership table
+    """
+    if len(data) == 0:
+        raise DecodeError("empty message")
+
+    try:
+        if data[0] != WIRE_MAGIC:
+            return _check_node_table(json.loads(bytes(data).decode()))
+
+        kind, body = _unframe(data)
+        if kind != KIND_NODE_TABLE:
+            raise DecodeError(f"unexpected message kind {kind}")
+
+        names, offset = _read_table(body, 0)
+        (count,) = _COUNT.unpack_from(body, offset)
+        offset += _COUNT.size
+        if count == 0:
+            raise DecodeError("empty node table")
+
+        table: dict[str, dict] = {}
+        for _ in range(count):
+            (
+                name_index, heartbeat_counter, local_clock, timestamp,
+                version_id, status, incarnation
+            ) = _NODE_ENTRY.unpack_from(body, offset)
+            offset += _NODE_ENTRY.size
+
+            if NODE_STATUSES[status] == "joining":
+                # join requests carry nothing but their status
+                table[names[name_index]] = {"status": "joining"}
+                continue
+
+            table[names[name_index]] = {
+                "heartbeat_counter": heartbeat_counter,
+                "local_clock": local_clock,
+                "timestamp": timestamp,
+                "version_id": version_id,
+                "status": NODE_STATUSES[status],
+                "incarnation": incarnation,
+            }
+
+        return table
+    except DecodeError:
+        raise
+    except (struct.error, IndexError, ValueError, UnicodeDecodeError) as e:
+        raise DecodeError(str(e)) from e
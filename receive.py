@@ -0,0 +1,149 @@
+"""
+Allocation-free datagram receiving.
+
+DatagramReader switches a UDP socket to non-blocking mode and drains it
+with recvfrom_into into one preallocated arena: datagrams are packed back
+to back until the arena cannot hold another maximum sized one (or the
+socket would block), then each is handed to the caller as a memoryview
+slice of the arena and the arena is reused for the next batch.  No bytes
+object is allocated per datagram, and a burst of datagrams costs one
+wakeup instead of one per datagram.
+
+Readers whose batches are handled on the same thread, like the nodes of
+one event loop, can share an arena: each batch is handled completely
+before the next one is received.
+
+Handlers must not keep the memoryview they are given: its contents are
+overwritten by the next batch.  The decoder in protocol.py copies what it
+keeps.
+"""
+import selectors
+import socket
+
+from typing import Callable
+
+from protocol import MAX_DATAGRAM_SIZE
+
+DEFAULT_ARENA_SIZE = 1 << 20    # room for ~700 MTU sized datagrams
+
+DatagramHandler = Callable[[memoryview, tuple[str, int]], None]
+
+
+class DatagramReader(object):
+    def __init__(
+        self,
+        sock: socket.socket,
+        arena_size: int = DEFAULT_ARENA_SIZE,
+        datagram_size: int = MAX_DATAGRAM_SIZE,
+        arena: bytearray | None = None
+    ):
+        """
+        Args:
+            sock (socket.socket): the UDP socket, made non-blocking
+            arena_size (int): bytes of datagrams received per batch
+            datagram_size (int): the largest datagram received
+            arena (bytearray | None): an arena to use instead of a new one,
+                readers on the same thread may share one (see node.py)
+        """
+        sock.setblocking(False)
+        self.socket = sock
+        self.datagram_size = datagram_size
+        if arena is None or len(arena) < datagram_size:
+            arena = bytearray(max(arena_size, datagram_size))
+        self.arena = arena
+        self.view = memoryview(self.arena)
+        # (offset, length, address) of each datagram in the current batch
+        self.batch: list[tuple[int, int, tuple[str, int]]] = []
+        # only needed by callers that block in wait(), not by event loops
+        self.selector: selectors.BaseSelector | None = None
+
+    def wait(self, timeout: float | None) -> bool:
+        """
+        Block until a datagram is pending
+
+        Args:
+            timeout (float | None): seconds to wait, None for no limit
+
+        Returns:
+            bool: whether a datagram is pending
+        """
+        if self.selector is None:
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.socket, selectors.EVENT_READ)
+        return bool(self.selector.select(timeout))
+
+    def fill(self) -> bool:
+        """
+        Receive pending datagrams into the arena
+
+        Returns:
+            bool: whether the socket was drained (as opposed to the arena
+                running out of room)
+        """
+        receive = self.socket.recvfrom_into
+        view = self.view
+        size = self.datagram_size
+        limit = len(self.arena) - size
+        batch = self.batch
+        offset = 0
+
+        while offset <= limit:
+            try:
+                length, address = receive(view[offset:], size)
+            except (BlockingIOError, InterruptedError):
+                return True
+            batch.append((offset, length, address))
+            offset += length
+        return False
+
+    def read_batch(self, handle: DatagramHandler) -> bool:
+        """
+        Receive and handle at most one arena of datagrams
+
+        Args:
+            handle (DatagramHandler): called with each datagram and its
+                source address
+
+        Returns:
+            bool: whether the socket was drained
+        """
+        view = self.view
+        batch = self.batch
+
+        drained = self.fill()
+        try:
+            for offset, length, address in batch:
+                handle(view[offset:offset + length], address)
+        finally:
+            batch.clear()
+        return drained
+
+    def drain(self, handle: DatagramHandler) -> int:
+        """
+        Receive and handle datagrams until the socket would block
+
+        Args:
+            handle (DatagramHandler): called with each datagram and its
+                source address
+
+        Returns:
+            int: the number of datagrams handled
+        """
+        view = self.view
+        batch = self.batch
+        handled = 0
+
+        while True:
+            drained = self.fill()
+            try:
+                for offset, length, address in batch:
+                    handle(view[offset:offset + length], address)
+                handled += len(batch)
+            finally:
+                batch.clear()
+            if drained:
+                return handled
+
+    def close(self) -> None:
+        if self.selector is not None:
+            self.selector.close()
@@ -0,0 +1,263 @@
+"""
+Offline replay of a datagram trace.
+
+Feeds the datagrams a member recorded (see capture.py) through a fresh
+MembershipEngine that takes the recording member's place, with its clock
+set to each datagram's arrival time and the failure sweep
+(update_member_list) run every t_update of trace time in between.  Replies
+the engine would send (join responses, acks) are counted and dropped.
+
+By default the trace is replayed as fast as possible, which measures the
+merge path against real load; with --realtime datagrams are handed over at
+their recorded pace.  Either way the engine sees the same times, so the
+resulting state transitions only depend on the trace and the settings.
+Traces of server.py node tables are converted to engine members first.
+
+Reports the datagrams and bytes replayed, the replay throughput, the time
+spent merging and sweeping, the member events (state transitions) seen and
+the final member counts by status.
+
+Usage:
+    python server_new.py -l -p 8001 -T node.trace
+    python replay.py node.trace --t-suspect 2 --t-fail 4
+"""
+import argparse
+import json
+import random
+import time
+
+from typing import Any
+
+from capture import Address, TraceKind, TraceReader, TraceError
+from engine import (
+    MembershipEngine, MemberEvent, DEFAULT_T_SUSPECT, DEFAULT_T_FAIL,
+    DEFAULT_T_CLEANUP, DEFAULT_T_UPDATE
+)
+from phi import DEFAULT_PHI_THRESHOLD
+from protocol import DecodeError, Member, Status, decode_node_table
+from simulator import VirtualClock
+from swim import Detector
+from util import Logger
+
+NODE_STATUSES = {
+    "online": Status.ALIVE,
+    "suspect": Status.SUSPECTED,
+    "failed": Status.FAILED,
+}
+
+# replayed members have no address, the engine never sends to them
+NO_ADDRESS = ("0.0.0.0", 0)
+
+
+class DiscardingSender(object):
+    """ The DatagramSender of a replay, replies are counted and dropped """
+
+    def __init__(self):
+        self.datagrams = 0
+        self.bytes = 0
+
+    def sendto(self, data, address: Address) -> None:
+        self.datagrams += 1
+        self.bytes += len(data)
+
+
+def node_table_members(data: bytes) -> dict[str, Member]:
+    """
+    The entries of a server.py node table as engine members, join
+    requests left out
+
+    Raises:
+        DecodeError: if the datagram is malformed
+    """
+    members: dict[str, Member] = {}
+    for node, node_data in decode_node_table(data).items():
+        status = NODE_STATUSES.get(node_data.get("status"))
+        if status is None:
+            continue
+        members[node] = {
+            "id": node,
+            "address": NO_ADDRESS,
+            "heartbeat": node_data["heartbeat_counter"],
+            "time": 0.0,
+            "status": (node_data["incarnation"], status),
+            "failed_time": 0.0,
+        }
+    return members
+
+
+def replay(
+    path: str,
+    realtime: bool = False,
+    t_update: float = DEFAULT_T_UPDATE,
+    t_suspect: float = DEFAULT_T_SUSPECT,
+    t_fail: float = DEFAULT_T_FAIL,
+    t_cleanup: float = DEFAULT_T_CLEANUP,
+    enable_suspicion: bool = False,
+    detector: Detector = Detector.HEARTBEAT,
+    phi_threshold: float = DEFAULT_PHI_THRESHOLD,
+    seed: int = 0
+) -> dict[str, Any]:
+    """
+    Replay the trace at path through a fresh engine
+
+    Args:
+        path (str): the trace file
+        realtime (bool): hand datagrams over at their recorded pace
+        t_update (float): trace seconds between failure sweeps
+        t_suspect, t_fail, t_cleanup, enable_suspicion, detector,
+            phi_threshold: the engine settings, see MembershipEngine
+        seed (int): seeds the engine's random choices
+
+    Raises:
+        TraceError: if path is not a trace
+
+    Returns:
+        dict[str, Any]: the report
+    """
+    reader = TraceReader(path)
+    clock = VirtualClock()
+    sender = DiscardingSender()
+    events = {event.name.lower(): 0 for event in MemberEvent}
+    engine: MembershipEngine | None = None
+
+    datagrams = 0
+    size = 0
+    malformed = 0
+    first = last = next_update = 0.0
+    start = time.perf_counter()
+
+    try:
+        for arrived, data, address in reader:
+            if engine is None:
+                first = next_update = clock.now = arrived
+                engine = MembershipEngine(
+                    reader.member_id,
+                    NO_ADDRESS,
+                    NO_ADDRESS,
+                    t_suspect=t_suspect,
+                    t_fail=t_fail,
+                    t_cleanup=t_cleanup,
+                    enable_suspicion=enable_suspicion,
+                    detector=detector,
+                    phi_threshold=phi_threshold,
+                    clock=clock,
+                    rng=random.Random(seed),
+                    logger=Logger(0),
+                )
+
+                def count(event: MemberEvent, member_id: str) -> None:
+                    events[event.name.lower()] += 1
+
+                engine.add_listener(count)
+
+            while next_update <= arrived:
+                clock.now = next_update
+                engine.update_member_list()
+                engine.flush_joins(sender)
+                next_update += t_update
+
+            if realtime:
+                delay = (arrived - first) - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            clock.now = last = arrived
+            datagrams += 1
+            size += len(data)
+            if reader.kind == TraceKind.ENGINE:
+                engine.handle_datagram(sender, data, address)
+                continue
+            try:
+                members = node_table_members(data)
+            except DecodeError:
+                malformed += 1
+                continue
+            engine.merge_to_member_list(members)
+    finally:
+        reader.close()
+    elapsed = time.perf_counter() - start
+
+    statuses = {status.name.lower(): 0 for status in Status}
+    merge_seconds = sweep_seconds = 0.0
+    if engine is not None:
+        malformed += engine.metrics.decode_failures.value
+        merge_seconds = engine.metrics.merge_seconds.sum
+        sweep_seconds = engine.metrics.sweep_seconds.sum
+        for member in engine.member_list.values():
+            if member.id != engine.id:
+                statuses[member.status.name.lower()] += 1
+
+    return {
+        "member": reader.member_id,
+        "kind": reader.kind.name.lower(),
+        "datagrams": datagrams,
+        "bytes": size,
+        "malformed": malformed,
+        "trace_seconds": round(last - first, 3),
+        "replay_seconds": round(elapsed, 3),
+        "datagrams_per_second": round(datagrams / elapsed) if elapsed else 0,
+        "merge_seconds": round(merge_seconds, 3),
+        "sweep_seconds": round(sweep_seconds, 3),
+        "replies_dropped": sender.datagrams,
+        "events": events,
+        "members": statuses,
+    }
+
+
+def main():
+    """ Replay one trace and print its report """
+
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded datagram trace through the engine"
+    )
+    parser.add_argument("trace", type=str,
+                        help="A trace recorded with --trace")
+    parser.add_argument("--realtime", action="store_true",
+                        help="Replay at the recorded pace")
+    parser.add_argument("--t-update", type=float, default=DEFAULT_T_UPDATE)
+    parser.add_argument("--t-suspect", type=float, default=DEFAULT_T_SUSPECT)
+    parser.add_argument("--t-fail", type=float, default=DEFAULT_T_FAIL)
+    parser.add_argument("--t-cleanup", type=float, default=DEFAULT_T_CLEANUP)
+    parser.add_argument("--suspicion", action="store_true",
+                        help="Enable the suspicion strategy")
+    parser.add_argument("--detector", type=str,
+                        choices=[Detector.HEARTBEAT.value, Detector.PHI.value],
+                        default=Detector.HEARTBEAT.value)
+    parser.add_argument("--phi-threshold", type=float,
+                        default=DEFAULT_PHI_THRESHOLD)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true",
+                        help="Print the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        report = replay(
+            args.trace,
+            realtime=args.realtime,
+            t_update=args.t_update,
+            t_suspect=args.t_suspect,
+            t_fail=args.t_fail,
+            t_cleanup=args.t_cleanup,
+            enable_suspicion=args.suspicion,
+            detector=Detector(args.detector),
+            phi_threshold=args.phi_threshold,
+            seed=args.seed,
+        )
+    except (OSError, TraceError) as e:
+        parser.error(f"{args.trace}: {e}")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{key}:")
+            for sub_key, sub_value in value.items():
+                print(f"  {sub_key}: {sub_value}")
+        else:
+            print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,69 @@
+import select
 import socket
 import threading
 import time
-import json
 import sys
 import random
 
+from capture import TraceKind, TraceRecorder
+from deadlines import DeadlineQueue
+from eventlog import EventLog
+from metrics import EngineMetrics, serve_metrics
+from peers import PeerSelector
+from statefile import WARM_START_PEERS, read_state, write_state
+from protocol import (
+    Command, DecodeError, Status, WireFormat, MAX_DATAGRAM_SIZE,
+    encode_node_table, decode_node_table
+)
+
 T_GOSSIP = 0.5
 FAILURE_THRESHOLD = 8
 T_CLEANUP = 8
+# every FULL_SYNC_INTERVAL rounds the whole membership list is sent
+FULL_SYNC_INTERVAL = 10
+# pass --json-wire after the node name to gossip human readable JSON
+WIRE_FORMAT = WireFormat.BINARY
+# pass --json-log after the node name to log JSON lines with timestamps
+STRUCTURED_LOG = False
+# pass --metrics-port PORT after the node name to serve metrics over HTTP
+METRICS_PORT = None
+# pass --seeds node1,node3 after the node name to join through other nodes;
+# the first seed starts the cluster instead of joining
+SEEDS = ["node1"]
+# pass --state-file PATH after the node name to save the membership list
+# every SAVE_INTERVAL rounds, and --warm-start to rejoin through the nodes
+# saved there before the seeds
+STATE_FILE = None
+WARM_START = False
+SAVE_INTERVAL = 10
+# pass --trace PATH after the node name to record every received datagram
+# for replay.py
+TRACE_FILE = None
+# datagrams already queued on the socket, up to this many, are pre-merged
+# into one table and merged under one lock and one snapshot
+RECEIVE_BATCH = 64
+
+
+def publish_snapshot():
+    # must be called with lock held, at the end of every change
+    # readers print membership_snapshot instead of taking the lock; it is a
+    # copy that is replaced, never mutated, so a reader holding it never
+    # sees a half applied update
+    global membership_snapshot
+    membership_snapshot = {
+        node: dict(node_data) for node, node_data in membership_list.items()
+    }
 
 
-def log_event(message, filename):
-    with open(filename, "a") as f:
-        message = message + "\n"
-        f.write(message)
+def track_peer(node):
+    # must be called with lock held, after node's entry changed
+    # every configured node is gossiped to unless it is known to have failed
+    if node == node_name or node not in NODES:
+        return
+    if node in membership_list and membership_list[node]["status"] == "failed":
+        peers.remove(node)
+    else:
+        peers.add(node)
 
 
 def command_line_interface():
@@ -40,6 +90,7 @@ def command_line_interface():
                 "status"
             ] = status  # Update local membership status
             membership_list[node_name]["version_id"] += 1
+            publish_snapshot()
             lock.release()
             print("Node set to 'online' status.")
         elif cmd == "disable suspicion":
@@ -49,300 +100,440 @@ def command_line_interface():
             suspicion = True
             print("enable gossip s")
         elif cmd == "list_mem":
-            print(membership_list)
+            print(membership_snapshot)
         elif cmd == "list_self":
-            print(membership_list[node_name])
+            print(membership_snapshot[node_name])
         else:
             print(f"Unknown command: {cmd}")
 
 
-def receiver(name, s):
-    while True:
-        # Receive data
-        if status == "online":
-            if suspicion == False:
-                try:
-                    data, addr = s.recvfrom(4096)
-                    received_list = json.loads(data.decode())
-                    lock.acquire()
-                    first_key = list(received_list.keys())[0]
+def merge_received(received_list):
+    # must be called with lock held
+    # merges one received membership table (or queues a join request)
+    if suspicion == False:
+        first_key = list(received_list.keys())[0]
+        if received_list[first_key]["status"] == "joining":
+            # any node answers joins; the gossip loop replies
+            # to all joiners of a round with one encoding
+            pending_joins.add(first_key)
+        else:
+            for node, node_data in received_list.items():
+                if (
+                    node not in membership_list
+                    and node_data["status"] != "failed"
+                ):
+                    membership_list[node] = {
+                        "heartbeat_counter": 0,
+                        "local_clock": 0,
+                        "timestamp": 0,
+                        "version_id": 0,
+                        "status": "online",
+                        "incarnation": 0,
+                    }
+                    output = node + " joined"
+                    print(output)
+                    event_log.log(output)
+                # Update if the received heartbeat_counter is newer
+                if node_data["status"] != "failed":
                     if (
-                        node_name == "node1"
-                        and received_list[first_key]["status"] == "joining"
+                        node_data["heartbeat_counter"]
+                        > membership_list[node]["heartbeat_counter"]
                     ):
-                        target_ip, target_port = NODES[first_key]
-                        s.sendto(
-                            json.dumps(membership_list).encode(),
-                            (target_ip, target_port),
-                        )
-                    else:
-                        for node, node_data in received_list.items():
-                            if (
-                                node not in membership_list
-                                and node_data["status"] != "failed"
-                            ):
-                                membership_list[node] = {
-                                    "heartbeat_counter": 0,
-                                    "local_clock": 0,
-                                    "timestamp": 0,
-                                    "version_id": 0,
-                                    "status": "online",
-                                    "incarnation": 0,
-                                }
-                                output = node + " joined"
-                                print(output)
-                                log_event(output, filename)
-                            # Update if the received heartbeat_counter is newer
-                            if node_data["status"] != "failed":
-                                if (
-                                    node_data["heartbeat_counter"]
-                                    > membership_list[node]["heartbeat_counter"]
-                                ):
-                                    membership_list[node] = node_data
-                                    membership_list[node][
-                                        "local_clock"
-                                    ] = membership_list[node_name]["local_clock"]
-                    lock.release()
-                except socket.timeout:
-                    pass
-            else:
-                try:
-                    data, addr = s.recvfrom(4096)
-                    received_list = json.loads(data.decode())
-                    lock.acquire()
-                    first_key = list(received_list.keys())[0]
+                        membership_list[node] = node_data
+                        membership_list[node][
+                            "local_clock"
+                        ] = membership_list[node_name]["local_clock"]
+                track_peer(node)
+    else:
+        first_key = list(received_list.keys())[0]
+        if received_list[first_key]["status"] == "joining":
+            pending_joins.add(first_key)
+        for node, node_data in received_list.items():
+            if node_data["status"] == "joining":
+                # a join request carries no counters to merge
+                continue
+            if (
+                node not in membership_list
+                and node_data["status"] != "failed"
+            ):
+                membership_list[node] = {
+                    "heartbeat_counter": 0,
+                    "local_clock": 0,
+                    "timestamp": 0,
+                    "version_id": 0,
+                    "status": "online",
+                    "incarnation": 0,
+                }
+                membership_list[node] = node_data
+                membership_list[node]["local_clock"] = membership_list[
+                    node_name
+                ]["local_clock"]
+                output = node + " joined"
+                print(output)
+                event_log.log(output)
+            # Update if the received heartbeat_counter is newer
+            elif node in membership_list:
+                if (
+                    membership_list[node]["status"] == "online"
+                    and node_data["status"] == "suspect"
+                ):
                     if (
-                        node_name == "node1"
-                        and received_list[first_key]["status"] == "joining"
+                        membership_list[node]["incarnation"]
+                        < node_data["incarnation"]
                     ):
-                        target_ip, target_port = NODES[first_key]
-                        s.sendto(
-                            json.dumps(membership_list).encode(),
-                            (target_ip, target_port),
-                        )
-                    for node, node_data in received_list.items():
-                        if (
-                            node not in membership_list
-                            and node_data["status"] != "failed"
-                        ):
-                            membership_list[node] = {
-                                "heartbeat_counter": 0,
-                                "local_clock": 0,
-                                "timestamp": 0,
-                                "version_id": 0,
-                                "status": "online",
-                                "incarnation": 0,
-                            }
-                            membership_list[node] = node_data
-                            membership_list[node]["local_clock"] = membership_list[
-                                node_name
-                            ]["local_clock"]
-                            output = node + " joined"
-                            print(output)
-                            log_event(output, filename)
-                        # Update if the received heartbeat_counter is newer
-                        elif node in membership_list:
-                            if (
-                                membership_list[node]["status"] == "online"
-                                and node_data["status"] == "suspect"
-                            ):
-                                if (
-                                    membership_list[node]["incarnation"]
-                                    < node_data["incarnation"]
-                                ):
-                                    membership_list[node] = node_data
-                                    membership_list[node][
-                                        "local_clock"
-                                    ] = membership_list[node_name]["local_clock"]
-                                    membership_list[node]["status"] = "suspect"
-                            elif (
-                                membership_list[node]["status"] == "suspect"
-                                and node_data["status"] == "online"
-                            ):
-                                if (
-                                    membership_list[node]["incarnation"]
-                                    < node_data["incarnation"]
-                                ):
-                                    membership_list[node] = node_data
-                                    membership_list[node][
-                                        "local_clock"
-                                    ] = membership_list[node_name]["local_clock"]
-                                    membership_list[node]["status"] = "online"
-                            elif (
-                                membership_list[node]["status"] == "suspect"
-                                and node_data["status"] == "suspect"
-                            ):
-                                if (
-                                    membership_list[node]["incarnation"]
-                                    < node_data["incarnation"]
-                                ):
-                                    membership_list[node] = node_data
-                                    membership_list[node][
-                                        "local_clock"
-                                    ] = membership_list[node_name]["local_clock"]
-                                    membership_list[node]["status"] = "suspect"
-                            elif (
-                                membership_list[node]["status"] == "online"
-                                and node_data["status"] == "online"
-                            ):
-                                if (
-                                    node_data["heartbeat_counter"]
-                                    > membership_list[node]["heartbeat_counter"]
-                                ):
-                                    membership_list[node] = node_data
-                                    membership_list[node][
-                                        "local_clock"
-                                    ] = membership_list[node_name]["local_clock"]
-
-                        if node == node_name and node_data["status"] == "suspect":
-                            membership_list[node]["status"] = "online"
-                            membership_list[node]["local_clock"] = membership_list[
-                                node_name
-                            ]["local_clock"]
-                            membership_list[node]["incarnation"] += 1
-
-                    lock.release()
-                except socket.timeout:
-                    pass
-
-
-def failure_detector(node_name):
-    while True:
-        # if status == 'online':
-        if suspicion is False:
-            lock.acquire()
-            for node, node_data in membership_list.items():
-                if (
-                    node != node_name
-                    and membership_list[node_name]["local_clock"]
-                    - node_data["local_clock"]
-                    >= FAILURE_THRESHOLD
+                        membership_list[node] = node_data
+                        membership_list[node][
+                            "local_clock"
+                        ] = membership_list[node_name]["local_clock"]
+                        membership_list[node]["status"] = "suspect"
+                elif (
+                    membership_list[node]["status"] == "suspect"
                     and node_data["status"] == "online"
                 ):
-                    print(f"{node_name} : {node} has failed!")
-                    output = node + " has failed!"
-                    log_event(output, filename)
-                    membership_list[node]["status"] = "failed"
-                    failed_nodes[node] = membership_list[node_name]["local_clock"]
-
-            # Check if any suspected node has surpassed the T_CLEANUP interval
-            nodes_to_remove = [
-                node
-                for node, suspect_time in failed_nodes.items()
-                if membership_list[node_name]["local_clock"] - suspect_time > T_CLEANUP
-            ]
-
-            # Remove nodes that have surpassed the T_CLEANUP from the membership list and failed_nodes list
-            for node in nodes_to_remove:
-                output = "Removing " + node + " from membership list after T_cleanup."
-                print(output)
-                log_event(output, filename)
-                if node in membership_list:
-                    del membership_list[node]
-                del failed_nodes[node]
-            lock.release()
-        else:
-            lock.acquire()
-            for node, node_data in membership_list.items():
-                if (
-                    node_data["status"] == "online"
-                    and membership_list[node_name]["local_clock"]
-                    - node_data["local_clock"]
-                    <= T_CLEANUP
-                    and node in suspected_nodes
+                    if (
+                        membership_list[node]["incarnation"]
+                        < node_data["incarnation"]
+                    ):
+                        membership_list[node] = node_data
+                        membership_list[node][
+                            "local_clock"
+                        ] = membership_list[node_name]["local_clock"]
+                        membership_list[node]["status"] = "online"
+                elif (
+                    membership_list[node]["status"] == "suspect"
+                    and node_data["status"] == "suspect"
                 ):
-                    print(f"{node} is now active again.")
-                    output = node + " is now active again."
-                    log_event(output, filename)
-                    del suspected_nodes[node]
-
+                    if (
+                        membership_list[node]["incarnation"]
+                        < node_data["incarnation"]
+                    ):
+                        membership_list[node] = node_data
+                        membership_list[node][
+                            "local_clock"
+                        ] = membership_list[node_name]["local_clock"]
+                        membership_list[node]["status"] = "suspect"
                 elif (
-                    node != node_name
-                    and membership_list[node_name]["local_clock"]
-                    - node_data["local_clock"]
-                    > FAILURE_THRESHOLD
+                    membership_list[node]["status"] == "online"
                     and node_data["status"] == "online"
                 ):
-                    print(f"{node_name} suspects {node} has failed!")
-                    output = "suspect " + node + " has failed!"
-                    log_event(output, filename)
-                    membership_list[node]["status"] = "suspect"
-                    suspected_nodes[node] = membership_list[node_name]["local_clock"]
-
-            # Check if any suspected node has surpassed the FAILURE_THRESHOLD interval
-            nodes_that_failed = [
-                node
-                for node, suspect_time in suspected_nodes.items()
-                if membership_list[node_name]["local_clock"] - suspect_time
-                > FAILURE_THRESHOLD
-            ]
+                    if (
+                        node_data["heartbeat_counter"]
+                        > membership_list[node]["heartbeat_counter"]
+                    ):
+                        membership_list[node] = node_data
+                        membership_list[node][
+                            "local_clock"
+                        ] = membership_list[node_name]["local_clock"]
+
+            if node == node_name and node_data["status"] == "suspect":
+                membership_list[node]["status"] = "online"
+                membership_list[node]["local_clock"] = membership_list[
+                    node_name
+                ]["local_clock"]
+                membership_list[node]["incarnation"] += 1
+            track_peer(node)
+
+
+def dominated(kept, node_data):
+    # with suspicion, whether merging node_data right after kept (the last
+    # entry kept for the node that was not failed) cannot change anything,
+    # whether kept itself was merged or not: merge_received takes an online
+    # entry over an online one by heartbeat and anything else only with a
+    # higher incarnation
+    if kept["status"] != node_data["status"]:
+        return False
+    if node_data["incarnation"] > kept["incarnation"]:
+        return False
+    return node_data["status"] == "suspect" or (
+        node_data["heartbeat_counter"] <= kept["heartbeat_counter"]
+    )
 
-            # Remove nodes that have surpassed the FAILURE_THRESHOLD from the membership list and suspected_nodes list
-            for node in nodes_that_failed:
-                output = node + " failed"
-                print(output)
-                log_event(output, filename)
-                if node in membership_list:
-                    membership_list[node]["status"] = "failed"
-                    readytoremove_nodes[node] = membership_list[node_name][
-                        "local_clock"
-                    ]
-                del suspected_nodes[node]
-                # for node in suspected_nodes:
-                #    del membership_list[node]
-            nodes_to_remove = [
-                node
-                for node, suspect_time in readytoremove_nodes.items()
-                if membership_list[node_name]["local_clock"] - suspect_time > T_CLEANUP
-            ]
-
-            # Remove nodes that have surpassed the FAILURE_THRESHOLD from the membership list and readytoremove_nodes list
-            for node in nodes_to_remove:
-                print(f"Removing {node} from membership list after T_cleanup.")
-                output = "Removing " + node + " from membership list after T_cleanup."
-                log_event(output, filename)
-                if node in membership_list:
-                    del membership_list[node]
-                del readytoremove_nodes[node]
-                # for node in suspected_nodes:
-                #    del membership_list[node]
+
+def premerge(received_lists):
+    # reduces a batch of received tables, without the lock, to the nodes
+    # asking to join and the tables to merge in turn, in order, with only
+    # the entries that can change the result of merging the whole batch:
+    # without suspicion the first entry with the highest heartbeat of every
+    # node, with it every entry not dominated by the one kept before it.
+    # A failed entry is never merged, so only the first is kept for a node
+    # nothing else came for.  Entries for ourselves are all kept, each
+    # suspect one is refuted in turn
+    joins = []
+    tables = []
+    for received_list in received_lists:
+        first_key = next(iter(received_list))
+        if received_list[first_key]["status"] == "joining":
+            joins.append(first_key)
+        else:
+            tables.append(received_list)
+
+    if suspicion:
+        last = {}
+        seen = set()
+        kept_tables = []
+        for table in tables:
+            kept_table = {}
+            for node, node_data in table.items():
+                if node_data["status"] == "joining":
+                    # a join request carries no counters to merge
+                    continue
+                if node != node_name:
+                    if node_data["status"] == "failed":
+                        if node in seen:
+                            continue
+                    elif node in last and dominated(last[node], node_data):
+                        continue
+                kept_table[node] = node_data
+                seen.add(node)
+                if node_data["status"] != "failed":
+                    last[node] = node_data
+            kept_tables.append(kept_table)
+    else:
+        # merge_received keeps the first entry with the highest heartbeat
+        best = {}
+        for i, table in enumerate(tables):
+            for node, node_data in table.items():
+                if node_data["status"] == "joining":
+                    continue
+                kept = best.get(node)
+                if kept is None or (
+                    node_data["status"] != "failed"
+                    and (
+                        kept[1]["status"] == "failed"
+                        or node_data["heartbeat_counter"]
+                        > kept[1]["heartbeat_counter"]
+                    )
+                ):
+                    best[node] = (i, node_data)
+        kept_tables = [
+            {
+                node: node_data
+                for node, node_data in table.items()
+                if node_data["status"] != "joining"
+                and (node == node_name or best[node][0] == i)
+            }
+            for i, table in enumerate(tables)
+        ]
+    return joins, [table for table in kept_tables if table]
+
+
+def receive_batch(s):
+    # waits for one datagram as recvfrom does, then takes the ones already
+    # queued behind it without waiting
+    batch = [s.recvfrom(MAX_DATAGRAM_SIZE)]
+    while len(batch) < RECEIVE_BATCH and select.select([s], [], [], 0)[0]:
+        batch.append(s.recvfrom(MAX_DATAGRAM_SIZE))
+    return batch
+
+
+def receiver(name, s):
+    while True:
+        # Receive data
+        if status == "online":
+            try:
+                batch = receive_batch(s)
+            except socket.timeout:
+                continue
+            received_lists = []
+            for data, addr in batch:
+                if recorder is not None:
+                    recorder.record(data, addr)
+                try:
+                    received_lists.append(decode_node_table(data))
+                except DecodeError as e:
+                    # a stray or truncated datagram must not stop receiving
+                    print(f"Malformed message from {addr} dropped: {e}")
+                    metrics.decode_failures.inc()
+                    continue
+                metrics.received(Command.GOSSIP, len(data))
+            if not received_lists:
+                continue
+            joins, tables = premerge(received_lists)
+            lock.acquire()
+            pending_joins.update(joins)
+            for table in tables:
+                merge_received(table)
+            publish_snapshot()
             lock.release()
 
+
+def detect_failures(node_name):
+    # one pass of the failure detector: fails (or suspects) nodes that have
+    # not been heard from and removes failed nodes after T_CLEANUP
+    # if status == 'online':
+    if suspicion is False:
+        lock.acquire()
+        start = time.perf_counter()
+        for node, node_data in membership_list.items():
+            if (
+                node != node_name
+                and membership_list[node_name]["local_clock"]
+                - node_data["local_clock"]
+                >= FAILURE_THRESHOLD
+                and node_data["status"] == "online"
+            ):
+                print(f"{node_name} : {node} has failed!")
+                output = node + " has failed!"
+                event_log.log(output)
+                metrics.transition(Status.ALIVE, Status.FAILED)
+                membership_list[node]["status"] = "failed"
+                peers.remove(node)
+                failed_nodes.schedule(
+                    node, membership_list[node_name]["local_clock"] + T_CLEANUP
+                )
+
+        # Remove nodes that have surpassed the T_CLEANUP from the membership list,
+        # popping them off failed_nodes only once their deadline has passed
+        now = membership_list[node_name]["local_clock"]
+        for node in list(failed_nodes.pop_expired(now)):
+            output = "Removing " + node + " from membership list after T_cleanup."
+            print(output)
+            event_log.log(output)
+            if node in membership_list:
+                del membership_list[node]
+            track_peer(node)
+        publish_snapshot()
+        metrics.sweep_seconds.observe(time.perf_counter() - start)
+        lock.release()
+    else:
+        lock.acquire()
+        start = time.perf_counter()
+        for node, node_data in membership_list.items():
+            if (
+                node_data["status"] == "online"
+                and membership_list[node_name]["local_clock"]
+                - node_data["local_clock"]
+                <= T_CLEANUP
+                and node in suspected_nodes
+            ):
+                print(f"{node} is now active again.")
+                output = node + " is now active again."
+                event_log.log(output)
+                suspected_nodes.cancel(node)
+
+            elif (
+                node != node_name
+                and membership_list[node_name]["local_clock"]
+                - node_data["local_clock"]
+                > FAILURE_THRESHOLD
+                and node_data["status"] == "online"
+            ):
+                print(f"{node_name} suspects {node} has failed!")
+                output = "suspect " + node + " has failed!"
+                event_log.log(output)
+                metrics.transition(Status.ALIVE, Status.SUSPECTED)
+                membership_list[node]["status"] = "suspect"
+                suspected_nodes.schedule(
+                    node,
+                    membership_list[node_name]["local_clock"] + FAILURE_THRESHOLD,
+                )
+
+        # Mark suspected nodes that have surpassed the FAILURE_THRESHOLD as failed;
+        # only nodes whose deadline has passed are popped off suspected_nodes
+        now = membership_list[node_name]["local_clock"]
+        for node in list(suspected_nodes.pop_expired(now)):
+            output = node + " failed"
+            print(output)
+            event_log.log(output)
+            if node in membership_list:
+                metrics.transition(Status.SUSPECTED, Status.FAILED)
+                membership_list[node]["status"] = "failed"
+                peers.remove(node)
+                readytoremove_nodes.schedule(node, now + T_CLEANUP)
+            # for node in suspected_nodes:
+            #    del membership_list[node]
+
+        # Remove nodes that have surpassed the T_CLEANUP from the membership list
+        for node in list(readytoremove_nodes.pop_expired(now)):
+            print(f"Removing {node} from membership list after T_cleanup.")
+            output = "Removing " + node + " from membership list after T_cleanup."
+            event_log.log(output)
+            if node in membership_list:
+                del membership_list[node]
+            track_peer(node)
+            # for node in suspected_nodes:
+            #    del membership_list[node]
+        publish_snapshot()
+        metrics.sweep_seconds.observe(time.perf_counter() - start)
+        lock.release()
+
+
+def failure_detector(node_name):
+    while True:
+        detect_failures(node_name)
         time.sleep(T_GOSSIP)
 
 
+def changed_entries(targets, full):
+    # must be called with lock held
+    # returns a copy of the entries whose state differs from what any of the
+    # targets last got, so one encoding can be sent to all of them
+    sent = [sent_states.setdefault(target_node, {}) for target_node in targets]
+    entries = {}
+    for node, node_data in membership_list.items():
+        state = (
+            node_data["heartbeat_counter"],
+            node_data["status"],
+            node_data["incarnation"],
+        )
+        if full or any(target_sent.get(node) != state for target_sent in sent):
+            entries[node] = dict(node_data)
+            for target_sent in sent:
+                target_sent[node] = state
+    return entries
+
+
 def gossip(node_name):
     ip, port = NODES[node_name]
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.bind((ip, port))
-    if node_name != "node1":  # If it's not node1, then request to join
-        introducer_ip, introducer_port = NODES["node1"]
+    # unless this node starts the cluster, request to join through the
+    # first seed that answers; joins are answered once per gossip round
+    data = ""
+    seeds = [] if node_name == SEEDS[0] else SEEDS
+    seeds = warm_peers[:WARM_START_PEERS] + seeds
+    for seed in [seed for seed in seeds if seed != node_name]:
+        introducer_ip, introducer_port = NODES[seed]
         msg = {node_name: {"status": "joining"}}
         try:
-            s.sendto(json.dumps(msg).encode(), (introducer_ip, introducer_port))
+            s.sendto(
+                encode_node_table(msg, WIRE_FORMAT),
+                (introducer_ip, introducer_port)
+            )
         except Exception as e:
             print("Error sending data: %s" % e)
             print(introducer_ip, introducer_port)
-        s.settimeout(0.3)
-        data = ""
+        s.settimeout(2 * T_GOSSIP)
         try:
-            data, _ = s.recvfrom(4096)
-            received_list = json.loads(data.decode())
+            data, _ = s.recvfrom(MAX_DATAGRAM_SIZE)
+            received_list = decode_node_table(data)
+            break
         except socket.timeout:
             # print("Server did not respond in time. It might be down.")
-            pass
+            data = ""
+        except DecodeError as e:
+            print("Malformed join reply dropped: %s" % e)
+            metrics.decode_failures.inc()
+            data = ""
         except Exception as e:
             # print("Error receiving data: %s" % e)
-            pass
+            data = ""
 
-        if data != "":
-            received_list = json.loads(data.decode())
-            membership_list.update(received_list)
-            for node, node_data in membership_list.items():
-                if node != node_name:
-                    output = node + " joined"
-                    print(output)
-                    log_event(output, filename)
+    if data != "":
+        lock.acquire()
+        for node, node_data in received_list.items():
+            # the seed's copy of our own entry predates this start, and a
+            # join request arriving first carries no counters to keep
+            if node != node_name and node_data["status"] != "joining":
+                membership_list[node] = node_data
+            track_peer(node)
+        publish_snapshot()
+        lock.release()
+        for node, node_data in membership_list.items():
+            if node != node_name:
+                output = node + " joined"
+                print(output)
+                event_log.log(output)
     # print(membership_list)
 
     # Start the receiver in a separate thread
@@ -354,34 +545,62 @@ def gossip(node_name):
     )
     failure_detector_thread.start()
 
+    rounds = 0
     while True:
+        rounds += 1
+        full = rounds % FULL_SYNC_INTERVAL == 0
         lock.acquire()
         membership_list[node_name]["timestamp"] = time.time()
         membership_list[node_name]["local_clock"] += 1
         membership_list[node_name]["heartbeat_counter"] += 1
 
         # Update and send own data only if the node is online
+        targets = []
         if status == "online":
-            # Send membership list to all other nodes
-            i = 0
-            nodeList = list(NODES.keys())
-            while i < 4:
-                target_node = random.choice(nodeList)
+            # Send membership list to the next 4 nodes in shuffled
+            # round-robin order, failed nodes are skipped (see peers.py)
+            targets = peers.take(4)
+            entries = changed_entries(targets, full)
+
+        publish_snapshot()
+        saved_table = membership_snapshot
+        joiners = list(pending_joins)
+        pending_joins.clear()
+        join_table = membership_snapshot
+        lock.release()
+
+        if STATE_FILE is not None and rounds % SAVE_INTERVAL == 0:
+            try:
+                write_state(
+                    STATE_FILE, encode_node_table(saved_table), time.time()
+                )
+            except OSError as e:
+                print("Error saving state: %s" % e)
+
+        # Answer every joiner of this round with one encoding
+        if joiners:
+            data = encode_node_table(join_table, WIRE_FORMAT)
+            for joiner in joiners:
+                try:
+                    s.sendto(data, NODES[joiner])
+                    metrics.sent(Command.GOSSIP, len(data))
+                except Exception as e:
+                    print("Error sending data: %s" % e)
+                    print(joiner)
+
+        # Encode once and send outside the lock
+        if targets:
+            data = encode_node_table(entries, WIRE_FORMAT)
+            for target_node in targets:
                 target_ip, target_port = NODES[target_node]
-                if target_node != node_name:
-                    nodeList.remove(target_node)
-                    try:
-                        s.sendto(
-                            json.dumps(membership_list).encode(),
-                            (target_ip, target_port),
-                        )
-                        i += 1
-                    except Exception as e:
-                        print("Error sending data: %s" % e)
-                        print(target_node)
-                        print(target_ip, target_port)
+                try:
+                    s.sendto(data, (target_ip, target_port))
+                    metrics.sent(Command.GOSSIP, len(data))
+                except Exception as e:
+                    print("Error sending data: %s" % e)
+                    print(target_node)
+                    print(target_ip, target_port)
 
-        lock.release()
         time.sleep(T_GOSSIP)
 
     receiver_thread.join()
@@ -425,13 +644,28 @@ if __name__ == "__main__":
     # Node status (online/failed)
     status = "online"
     suspicion = True
-    lock = threading.Lock()
+    metrics = EngineMetrics()
+    lock = metrics.lock()  # times lock waits and holds
 
     if len(sys.argv) < 2:
         print("Usage: python script_name.py node_name")
         sys.exit(1)
 
     node_name = sys.argv[1]
+    if "--json-wire" in sys.argv[2:]:
+        WIRE_FORMAT = WireFormat.JSON
+    if "--json-log" in sys.argv[2:]:
+        STRUCTURED_LOG = True
+    if "--seeds" in sys.argv[2:-1]:
+        SEEDS = sys.argv[sys.argv.index("--seeds") + 1].split(",")
+    if "--metrics-port" in sys.argv[2:-1]:
+        METRICS_PORT = int(sys.argv[sys.argv.index("--metrics-port") + 1])
+    if "--state-file" in sys.argv[2:-1]:
+        STATE_FILE = sys.argv[sys.argv.index("--state-file") + 1]
+    if "--warm-start" in sys.argv[2:]:
+        WARM_START = True
+    if "--trace" in sys.argv[2:-1]:
+        TRACE_FILE = sys.argv[sys.argv.index("--trace") + 1]
     # Membership list initialization
     initial_data = {
         "heartbeat_counter": 0,
@@ -442,17 +676,59 @@ if __name__ == "__main__":
         "incarnation": 0,
     }
     membership_list = {node_name: initial_data}
-    failed_nodes = {}  # To keep track of when nodes were first failed
-    suspected_nodes = {}
-    readytoremove_nodes = {}
+    membership_snapshot = {}
+    warm_peers = []  # nodes from the state file, tried before the seeds
+    saved = None
+    if WARM_START and STATE_FILE is not None:
+        saved = read_state(STATE_FILE, decode_node_table)
+    if saved is not None:
+        saved_table, _ = saved
+        own_data = saved_table.pop(node_name, None)
+        if own_data is not None:
+            # continue past our old counters so peers take them as new
+            initial_data["heartbeat_counter"] = own_data["heartbeat_counter"] + 1
+            initial_data["incarnation"] = own_data["incarnation"] + 1
+        for node, node_data in saved_table.items():
+            if node in NODES and node_data["status"] != "failed":
+                node_data["local_clock"] = 0
+                membership_list[node] = node_data
+                warm_peers.append(node)
+        random.shuffle(warm_peers)
+    publish_snapshot()
+    # node -> local clock deadline for its next step
+    failed_nodes = DeadlineQueue()  # cleanup of nodes that have failed
+    suspected_nodes = DeadlineQueue()  # failure of suspected nodes
+    readytoremove_nodes = DeadlineQueue()  # cleanup after suspicion
+    sent_states = {}  # per peer: node -> (heartbeat, status, incarnation) last sent
+    pending_joins = set()  # nodes to send the membership list to next round
+    peers = PeerSelector()  # gossip targets, maintained by track_peer
+    recorder = None
+    if TRACE_FILE is not None:
+        recorder = TraceRecorder(TRACE_FILE, TraceKind.NODE_TABLE, node_name)
     filename = node_name + "log.txt"
-    f = open(filename, "w")
-    f.write(f"{node_name} joined\n")
+    # events are written by a background thread, never under lock
+    event_log = EventLog(
+        filename, structured=STRUCTURED_LOG, append=saved is not None
+    )
+    event_log.log(f"{node_name} joined")
     print(f"{node_name} joined\n")
-    f.close()
     if node_name not in NODES:
         print(f"Unknown node name. Choose from: {', '.join(NODES.keys())}")
         sys.exit(1)
+    for node in NODES:
+        track_peer(node)
+
+    for node_status in ("online", "suspect", "failed"):
+        metrics.registry.gauge(
+            "gossip_members", "Members by status",
+            lambda node_status=node_status: sum(
+                1 for node_data in membership_snapshot.values()
+                if node_data["status"] == node_status
+            ),
+            status=node_status
+        )
+    if METRICS_PORT is not None:
+        serve_metrics(metrics.registry, port=METRICS_PORT)
 
     cli_thread = threading.Thread(target=command_line_interface)
     cli_thread.start()
@@ -1,23 +1,48 @@
+import asyncio
 import socket
 import threading
 import time
-import json
 import sys
-import random
 import argparse
 import uuid
 
 from util import Logger, clamp, if_then_else, with_default
-from enum import Enum
-from typing import TypedDict, Literal, cast
+from delta import DEFAULT_FULL_SYNC_INTERVAL
+from engine import (
+    MembershipEngine, MemberEvent, DEFAULT_T_GOSSIP, DEFAULT_T_SUSPECT,
+    DEFAULT_T_FAIL, DEFAULT_T_CLEANUP, DEFAULT_T_UPDATE, DEFAULT_MAX_PAGES
+)
+from capture import TraceKind, TraceRecorder
+from eventlog import EventLog, DEFAULT_MAX_BYTES
+from hashring import DEFAULT_VNODES, attach as attach_ring
+from localapi import serve_local_api
+from metrics import serve_metrics
+from node import GossipNode
+from swim import (
+    Detector, DEFAULT_T_PROBE, DEFAULT_T_ACK, DEFAULT_INDIRECT_PROBES
+)
+from phi import DEFAULT_PHI_THRESHOLD
+from receive import DatagramReader
+from ingest import (
+    DEFAULT_WORKERS, drain_premerged, engine_merger, handle_batch,
+    reuse_port_socket, start_workers, supports_reuse_port
+)
+from statefile import (
+    DEFAULT_T_SAVE, WARM_START_PEERS, load_engine_state, restore_engine_state,
+    save_engine_state
+)
+from transfer import (
+    DEFAULT_T_RESYNC, exchange_state, serve_state_transfer
+)
+from protocol import (
+    Command, GossipMessage, WireFormat, DecodeError, DEFAULT_MTU, MAX_DATAGRAM_SIZE,
+    decode_message
+)
+from multiprocessing.connection import Connection, wait
+from typing import cast
 
 # GLOBAL CONSTANTS
 
-DEFAULT_T_GOSSIP = 0.5
-DEFAULT_T_SUSPECT = 1.0   # After 2 * T_GOSSIP, suspect
-DEFAULT_T_FAIL = 2.0      # After 4 * T_GOSSIP, fail
-DEFAULT_T_CLEANUP = 2.0   # When failed, cleanup after 2.0 seconds
-
 DEFAULT_SELF_LOCAL = ("localhost", 8000)
 DEFAULT_SELF_REMOTE = (socket.gethostbyname(socket.gethostname()), 80)
 DEFAULT_SELF_ID = str(uuid.uuid4())
@@ -27,385 +52,309 @@ DEFAULT_INTRODUCER_REMOTE = ("fa23-cs425-7601.cs.illinois.edu", 80)
 DEFAULT_MESSAGE_DROP_RATE = 0.0  # APPLIED AT RECEIVER SIDE
 
 DEFAULT_VERBOSITY = 1
+DEFAULT_WIRE_FORMAT = WireFormat.BINARY
+DEFAULT_RUNTIME = "threaded"
 
 T_GOSSIP = DEFAULT_T_GOSSIP
-T_SUSPECT = DEFAULT_T_SUSPECT
-T_FAIL = DEFAULT_T_FAIL
-T_CLEANUP = DEFAULT_T_CLEANUP
-T_UPDATE = 0.1
+T_UPDATE = DEFAULT_T_UPDATE
+T_RESYNC = DEFAULT_T_RESYNC
+T_SAVE = DEFAULT_T_SAVE
 
-INTRODUCER_ADDRESS = DEFAULT_INTRODUCER_REMOTE
-
-CONNECTION_BUFFER_SIZE = 1024
-MESSAGE_DROP_RATE = DEFAULT_MESSAGE_DROP_RATE
+CONNECTION_BUFFER_SIZE = MAX_DATAGRAM_SIZE
 VERBOSITY = 1
 LOGGER = Logger(VERBOSITY)
 
-# ENUMS AND TYPED DICTS
-
-
-class Command(Enum):
-    JOIN = 0
-    LEAVE = 1
-    GOSSIP = 2
-
-
-class Status(Enum):
-    ALIVE = 0
-    SUSPECTED = 1
-    FAILED = 2
-
-
-class Member(TypedDict):
-    id: str
-    address: tuple[str, int]
-    heartbeat: int
-    time: float
-    status: tuple[int, Status]  # (incarnation, status)
-    failed_time: float          # time when failed
 
+def receive_join_reply(sock: socket.socket) -> GossipMessage | None:
+    """
+    Wait, up to the socket's timeout (which must be set), for the gossip a
+    seed answers a join with.  Anything else that arrives meanwhile (a probe from a member that
+    already knows us, a malformed datagram) is ignored.
 
-class JoinMessageData(TypedDict):
-    id: str
-    host: str
-    port: int
-
-
-class LeaveMessageData(TypedDict):
-    id: str
-
-
-class LeaveMessage(TypedDict):
-    command: Literal[Command.LEAVE]
-    data: LeaveMessageData
-
+    Args:
+        sock (socket.socket): the node's socket the join was sent from
 
-class JoinMessage(TypedDict):
-    command: Literal[Command.JOIN]
-    data: JoinMessageData
+    Returns:
+        GossipMessage | None: the reply, None if none came in time
+    """
+    timeout = sock.gettimeout()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            data, address = sock.recvfrom(CONNECTION_BUFFER_SIZE)
+            try:
+                message = decode_message(data)
+            except DecodeError as e:
+                LOGGER.log(f"Malformed reply from {address}: {e}")
+            else:
+                if message["command"] == Command.GOSSIP:
+                    return cast(GossipMessage, message)
+                LOGGER.log(
+                    f"Ignored {message['command'].name} from {address} "
+                    "while joining", verbosity=2
+                )
 
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            sock.settimeout(remaining)
+    except socket.timeout:
+        return None
+    finally:
+        sock.settimeout(timeout)
 
-class GossipMessage(TypedDict):
-    command: Literal[Command.GOSSIP]
-    data: dict[str, Member]
 
+def initialize_node(
+    engine: MembershipEngine,
+    reuse_port: bool = False,
+    known_peers: list[tuple[str, tuple[str, int]]] | None = None
+) -> socket.socket:
 
-class Message(TypedDict):
-    command: Command
-    data: dict[str, Member] | JoinMessageData | LeaveMessageData
+    try:
+        if reuse_port:
+            # shared with the receiver workers started later
+            self_socket = reuse_port_socket(engine.address)
+        else:
+            self_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self_socket.bind(engine.address)
+        self_socket.settimeout(1.0)
+    except socket.error:
+        LOGGER.log("Failed to bind socket")
+        sys.exit(1)
 
+    # if self is introducer, do nothing
+    if engine.is_introducer:
+        return self_socket
 
-class SelfNodeType(TypedDict):
-    Id: str
-    Address: tuple[str, int]
-    IsOnline: bool
-    Incarnation: int
+    # after a warm start, sync with members we knew before the introducer
+    for member_id, address in with_default(known_peers, [])[:WARM_START_PEERS]:
+        try:
+            exchange_state(engine, address)
+            LOGGER.log(f"Rejoined through {member_id}", verbosity=2)
+            return self_socket
+        except (OSError, DecodeError) as e:
+            LOGGER.log(f"{member_id} is not responding: {e}", verbosity=2)
+
+    # otherwise join through the first seed that answers, over TCP so
+    # the member list is not limited to what fits in datagrams
+    for seed in engine.join_seeds():
+        try:
+            entries = exchange_state(engine, seed)
+            LOGGER.log(
+                f"Joined through {seed}, {entries} members", verbosity=2
+            )
+            return self_socket
+        except (OSError, DecodeError) as e:
+            LOGGER.log(f"State transfer from {seed} failed ({e}), joining "
+                       "over UDP", verbosity=2)
 
+        try:
+            self_socket.sendto(engine.join_message(), seed)
+        except socket.error:
+            LOGGER.log(f"Failed to send message to seed {seed}")
+            continue
 
-# GLOBAL VARIABLES
+        message = receive_join_reply(self_socket)
+        if message is None:
+            LOGGER.log(f"Seed {seed} is not responding")
+            continue
 
+        engine.merge_to_member_list(message["data"])
+        return self_socket
 
-MemberList: dict[str, Member] = {}
-MemberListLock = threading.Lock()
-EnableSuspicionStrategy = False
-SelfNode = SelfNodeType(
-    Id=DEFAULT_SELF_ID,
-    Address=DEFAULT_SELF_LOCAL,
-    IsOnline=True,
-    Incarnation=0,
-)
+    LOGGER.log("No seed is responding. Exiting...")
+    sys.exit(1)
 
 
-def de_suspect(status: tuple[int, Status]) -> tuple[int, Status]:
-    return (status[0], if_then_else(
-        status[1] == Status.SUSPECTED and EnableSuspicionStrategy,
-        Status.ALIVE,
-        status[1]
-    ))
+def parse_address(address: str) -> tuple[str, int]:
+    """ host:port to an address tuple """
+    host, _, port = address.rpartition(":")
+    return (host, int(port))
 
 
-def mark_as_failed(member: Member) -> None:
+def log_member_events(engine: MembershipEngine, event_log: EventLog) -> None:
     """
-    Mark a member as failed, must be called with lock acquired
+    Log every member list change.  Listeners run with the engine lock held,
+    which is fine because EventLog.log only queues the event.
 
     Args:
-        member (Member): the member to be marked as failed
+        engine (MembershipEngine): the engine whose events are logged
+        event_log (EventLog): where they are logged
     """
-    MemberList[member["id"]]["status"] = (
-        member["status"][0],
-        Status.FAILED
-    )
-    MemberList[member["id"]]["failed_time"] = time.time()
-
-
-def merge_to_member_list(gossip_member_list: dict[str, Member]) -> None:
 
-    MemberListLock.acquire()
-
-    for member_id, new_member in gossip_member_list.items():
-        if member_id not in MemberList:
-            # new member
+    def listener(event: MemberEvent, member_id: str) -> None:
+        event_log.log(
+            f"{member_id} {event.name.lower()}",
+            member=member_id,
+            kind=event.name.lower()
+        )
 
-            MemberList[member_id] = Member(
-                id=new_member["id"],
-                address=new_member["address"],
-                heartbeat=new_member["heartbeat"],
-                time=time.time(),
-                status=de_suspect(new_member["status"]),
-                failed_time=0.0
-            )
-        else:
-            old_member = MemberList[member_id]
+    engine.add_listener(listener)
 
-            # heartbeat rule
-            if new_member["heartbeat"] > old_member["heartbeat"]:
-                MemberList[member_id]["heartbeat"] = new_member["heartbeat"]
-                MemberList[member_id]["time"] = time.time()
 
-            # incarnation rule
-            new_incarnation, new_status = de_suspect(new_member["status"])
-            old_incarnation, _ = old_member["status"]
+def handle_updating_member_list(
+    engine: MembershipEngine,
+    self_socket: socket.socket
+) -> None:
+    while True:
 
-            if new_status == Status.FAILED:
-                MemberList[member_id]["status"] = (new_incarnation, new_status)
-            elif new_incarnation > old_incarnation:
-                MemberList[member_id]["status"] = (new_incarnation, new_status)
-            elif new_incarnation == old_incarnation and new_status == Status.SUSPECTED:
-                MemberList[member_id]["status"] = (new_incarnation, new_status)
+        if not engine.is_online:
+            time.sleep(T_UPDATE)
+            continue
 
-    MemberListLock.release()
+        engine.update_member_list()
+        engine.flush_joins(self_socket)
 
+        time.sleep(T_UPDATE)
 
-def initialize_node() -> socket.socket:
 
+def resync(engine: MembershipEngine) -> None:
+    """ Exchange member lists with a random member over TCP """
+    peer = engine.random_peer()
+    if peer is None:
+        return
+    member_id, address = peer
     try:
-        self_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
-        self_socket.bind(SelfNode["Address"])
-        self_socket.settimeout(1.0)
-    except socket.error:
-        LOGGER.log("Failed to bind socket")
-        sys.exit(1)
+        exchange_state(engine, address)
+    except (OSError, DecodeError) as e:
+        LOGGER.log(f"Resync with {member_id} failed: {e}", verbosity=2)
 
-    # remember to put yourself in the member list
-    MemberList[SelfNode["Id"]] = Member(
-        id=SelfNode["Id"],
-        address=SelfNode["Address"],
-        heartbeat=0,
-        time=time.time(),
-        status=(0, Status.ALIVE),
-        failed_time=0.0
-    )
 
-    # if self is introducer, do nothing
-    if SelfNode["Address"] == INTRODUCER_ADDRESS:
-        return self_socket
+def handle_resyncing(engine: MembershipEngine) -> None:
+    while True:
 
-    try:
-        # otherwise connect to introducer
-        self_socket.sendto(json.dumps(JoinMessage(
-            command=Command.JOIN,
-            data=JoinMessageData(
-                id=SelfNode["Id"],
-                host=SelfNode["Address"][0],
-                port=SelfNode["Address"][1],
-            )
-        )).encode(), INTRODUCER_ADDRESS)
-    except socket.error:
-        LOGGER.log("Failed to send message to introducer")
-        sys.exit(1)
+        time.sleep(T_RESYNC)
 
-    try:
-        data, _ = self_socket.recvfrom(CONNECTION_BUFFER_SIZE)
-        message: GossipMessage = json.loads(data.decode())
+        if engine.is_online:
+            resync(engine)
 
-        merge_to_member_list(message["data"])
 
-        return self_socket
-    except socket.timeout:
-        LOGGER.log("Introducer is not responding. Exiting...")
-        sys.exit(1)
+def save_state(engine: MembershipEngine, path: str) -> None:
+    try:
+        save_engine_state(engine, path)
+    except OSError as e:
+        LOGGER.log(f"Failed to save the state file: {e}")
 
 
-def handle_updating_member_list() -> None:
+def handle_saving_state(engine: MembershipEngine, path: str) -> None:
     while True:
 
-        if not SelfNode["IsOnline"]:
-            time.sleep(T_UPDATE)
-            continue
+        time.sleep(T_SAVE)
 
-        MemberListLock.acquire()
+        if engine.is_online:
+            save_state(engine, path)
 
-        for member_id, member in MemberList.items():
-            if member_id == SelfNode["Id"]:
-                member["heartbeat"] += 1
-                member["time"] = time.time()
-                member["status"] = (
-                    member["status"][0] + 1,
-                    Status.ALIVE
-                )
-                continue
 
-            if (
-                member["status"][1] == Status.ALIVE and
-                time.time() - member["time"] > T_SUSPECT and
-                EnableSuspicionStrategy
-            ):
-                MemberList[member_id]["status"] = (
-                    member["status"][0],
-                    Status.SUSPECTED
-                )
-            elif (
-                member["status"][1] == Status.SUSPECTED and
-                time.time() - member["time"] > T_FAIL
-            ):
-                mark_as_failed(member)
-            elif (
-                member["status"][1] == Status.FAILED and
-                time.time() - member["failed_time"] > T_CLEANUP
-            ):
-                del MemberList[member_id]
-
-        MemberListLock.release()
+def handle_probing(
+    engine: MembershipEngine,
+    self_socket: socket.socket
+) -> None:
+    while True:
+
+        if engine.is_online:
+            engine.probe_tick(self_socket)
 
         time.sleep(T_UPDATE)
 
 
-def handle_join_message(
+def handle_receiving_message(
+    engine: MembershipEngine,
     self_socket: socket.socket,
-    join_data: JoinMessageData
+    recorder: TraceRecorder | None = None
 ) -> None:
-    if join_data["id"] in MemberList:
-        # already in the member list (should not happen)
-        LOGGER.log(
-            f"Member {join_data['id']} already in the member list",
-            verbosity=2
-        )
-        return
-    elif SelfNode["Address"] != INTRODUCER_ADDRESS:
-        # not the introducer, you should only receive
-        # join message from introducer
-        LOGGER.log(
-            f"{join_data['id']} attempts to join from"
-            f"{SelfNode['Id']} but not the introducer",
-            verbosity=2
-        )
-        return
-    else:
-        # add to member list
-        merge_to_member_list({
-            join_data["id"]: Member(
-                id=join_data["id"],
-                address=(join_data["host"], join_data["port"]),
-                heartbeat=0,
-                time=time.time(),
-                status=(0, Status.ALIVE),
-                failed_time=0.0
-            )
-        })
-
-        # send back the member list
-        try:
-            self_socket.sendto(json.dumps(GossipMessage(
-                command=Command.GOSSIP,
-                data=MemberList
-            )).encode(), (join_data["host"], join_data["port"]))
-        except socket.error:
-            LOGGER.log(f"Failed to send message to joiner {join_data['id']}")
-
-
-def handle_leave_message(
-    leave_data: LeaveMessageData
-) -> None:
-    if leave_data["id"] not in MemberList:
-        # not in the member list (should not happen)
-        LOGGER.log(
-            f"Member {leave_data['id']} not in the member list",
-            verbosity=2
-        )
-        return
-    else:
-        # mark that member as failed
-        mark_as_failed(MemberList[leave_data["id"]])
-
+    reader = DatagramReader(self_socket, datagram_size=CONNECTION_BUFFER_SIZE)
+    merger = engine_merger(engine)
 
-def handle_receiving_message(self_socket: socket.socket) -> None:
     while True:
-        if not SelfNode["IsOnline"]:
+        if not engine.is_online:
             time.sleep(T_UPDATE)
             continue
 
-        try:
-            data, address = self_socket.recvfrom(CONNECTION_BUFFER_SIZE)
-
-            if random.random() < MESSAGE_DROP_RATE:
-                LOGGER.log(f"Simulated Data Drop From {address}", verbosity=3)
-                continue
-
-            message: Message = json.loads(data.decode())
-
-            match message["command"]:
-                case Command.JOIN:
-                    handle_join_message(
-                        self_socket,
-                        cast(JoinMessage, message)["data"]
-                    )
-                case Command.LEAVE:
-                    handle_leave_message(
-                        cast(LeaveMessage, message)["data"]
-                    )
-                case Command.GOSSIP:
-                    merge_to_member_list(cast(GossipMessage, message)["data"])
-
-        except socket.timeout:
+        if not reader.wait(1.0):
             LOGGER.log("Socket timeout", verbosity=2)
             continue
 
-        time.sleep(T_UPDATE)
+        # the gossip of a whole burst is merged at once (see ingest.py)
+        drain_premerged(engine, self_socket, reader, merger, recorder)
 
 
-def handle_sending_gossip(self_socket: socket.socket) -> None:
+def handle_worker_batches(
+    engine: MembershipEngine,
+    self_socket: socket.socket,
+    connections: list[Connection]
+) -> None:
+    while connections:
+        for connection in wait(connections, timeout=1.0):
+            connection = cast(Connection, connection)
+            try:
+                batch = connection.recv()
+            except EOFError:
+                LOGGER.log("Receiver worker exited")
+                connections.remove(connection)
+                continue
+            handle_batch(engine, self_socket, batch)
+
+
+def handle_sending_gossip(
+    engine: MembershipEngine,
+    self_socket: socket.socket
+) -> None:
     while True:
-        if not SelfNode["IsOnline"]:
+        if not engine.is_online:
             time.sleep(T_GOSSIP)
             continue
 
-        MemberListLock.acquire()
-
-        select_count = min(4, len(MemberList))
+        engine.gossip_round(self_socket)
 
-        selected_members = random.sample(
-            list(MemberList.items()),
-            select_count
-        )
-
-        for member_id, member in selected_members:
-            if member_id == SelfNode["Id"]:
-                continue
+        time.sleep(T_GOSSIP)
 
-            if member["status"][1] == Status.FAILED:
-                continue
 
-            try:
-                self_socket.sendto(json.dumps(GossipMessage(
-                    command=Command.GOSSIP,
-                    data=MemberList
-                )).encode(), member["address"])
-            except socket.error:
-                LOGGER.log("Failed to send message to introducer", verbosity=2)
-                sys.exit(1)
+async def serve_asyncio(
+    engine: MembershipEngine,
+    self_socket: socket.socket,
+    connections: list[Connection] | None = None,
+    state_file: str | None = None,
+    recorder: TraceRecorder | None = None
+) -> None:
+    """
+    Run the node on an asyncio event loop as a GossipNode (see node.py):
+    whenever the socket is readable every pending datagram is drained and
+    its gossip merged a burst at a time (see ingest.drain_premerged), and
+    gossip and the member list update run as scheduled callbacks instead
+    of sleeping threads.
 
-        MemberListLock.release()
+    Args:
+        engine (MembershipEngine): the node's membership engine
+        self_socket (socket.socket): the bound socket from initialize_node
+        connections (list[Connection] | None): pipes of receiver workers
+            (see ingest.py)
+        state_file (str | None): where to save the member list every
+            T_SAVE seconds
+        recorder (TraceRecorder | None): records every datagram received
+    """
+    node = GossipNode(
+        engine,
+        t_gossip=T_GOSSIP,
+        t_update=T_UPDATE,
+        t_resync=T_RESYNC,
+        t_save=T_SAVE,
+        state_file=state_file,
+        sock=self_socket,
+        connections=connections,
+        recorder=recorder,
+    )
+    await node.start()
 
-        time.sleep(T_GOSSIP)
+    try:
+        await asyncio.get_running_loop().create_future()  # until cancelled
+    finally:
+        await node.stop(leave=False)
 
 
 def main():
     """ The main Function """
 
-    global T_GOSSIP, T_SUSPECT, T_FAIL, T_CLEANUP
-    global MESSAGE_DROP_RATE, VERBOSITY, LOGGER
-    global INTRODUCER_ADDRESS, SelfNode
-    global EnableSuspicionStrategy
+    global T_GOSSIP, T_RESYNC, T_SAVE, VERBOSITY, LOGGER
 
     # Parse Arguments
 
@@ -433,6 +382,12 @@ def main():
         help="Introducer Port Number"
     )
 
+    parser.add_argument(
+        "-sd", "--seed", dest="seeds", type=str, action="append",
+        help="Another Member to Join Through (host:port), Repeatable",
+        default=[]
+    )
+
     parser.add_argument(
         "-tG", "--t-gossip", dest="t_gossip", type=float,
         help="Time Interval for Gossiping", default=DEFAULT_T_CLEANUP
@@ -464,6 +419,36 @@ def main():
         help="Enable Suspicion Strategy"
     )
 
+    parser.add_argument(
+        "-D", "--detector", dest="detector", type=str,
+        choices=[detector.value for detector in Detector],
+        help="Failure Detector: heartbeat timeouts, SWIM probes or phi "
+             "accrual over heartbeat arrivals",
+        default=Detector.HEARTBEAT.value
+    )
+
+    parser.add_argument(
+        "-tP", "--t-probe", dest="t_probe", type=float,
+        help="SWIM Protocol Period", default=DEFAULT_T_PROBE
+    )
+
+    parser.add_argument(
+        "-tA", "--t-ack", dest="t_ack", type=float,
+        help="SWIM Direct Ack Timeout", default=DEFAULT_T_ACK
+    )
+
+    parser.add_argument(
+        "-k", "--indirect-probes", dest="indirect_probes", type=int,
+        help="Members Asked to Probe a Silent Target",
+        default=DEFAULT_INDIRECT_PROBES
+    )
+
+    parser.add_argument(
+        "-pT", "--phi-threshold", dest="phi_threshold", type=float,
+        help="Phi at which the Phi Accrual Detector Gives up on a Member",
+        default=DEFAULT_PHI_THRESHOLD
+    )
+
     parser.add_argument(
         "-l", "--local", dest="local", action="store_true",
         help="Enable Local Mode"
@@ -474,6 +459,108 @@ def main():
         help="Log Verbosity Level", default=DEFAULT_VERBOSITY
     )
 
+    parser.add_argument(
+        "-fS", "--full-sync-interval", dest="full_sync_interval", type=int,
+        help="Gossip Rounds Between Full Member Lists to a Peer",
+        default=DEFAULT_FULL_SYNC_INTERVAL
+    )
+
+    parser.add_argument(
+        "-r", "--runtime", dest="runtime", type=str,
+        choices=["threaded", "asyncio"],
+        help="Run on three polling threads or on an asyncio event loop",
+        default=DEFAULT_RUNTIME
+    )
+
+    parser.add_argument(
+        "-w", "--wire-format", dest="wire_format", type=str,
+        choices=[wire_format.value for wire_format in WireFormat],
+        help="Wire Format (json is a debugging fallback)",
+        default=DEFAULT_WIRE_FORMAT.value
+    )
+
+    parser.add_argument(
+        "-m", "--mtu", dest="mtu", type=int,
+        help="Largest Gossip Datagram in Bytes", default=DEFAULT_MTU
+    )
+
+    parser.add_argument(
+        "-mP", "--max-pages", dest="max_pages", type=int,
+        help="Most Gossip Datagrams per Target and Round",
+        default=DEFAULT_MAX_PAGES
+    )
+
+    parser.add_argument(
+        "-tR", "--t-resync", dest="t_resync", type=float,
+        help="Time Interval for Full Resyncs over TCP (0 to Disable)",
+        default=DEFAULT_T_RESYNC
+    )
+
+    parser.add_argument(
+        "-W", "--workers", dest="workers", type=int,
+        help="Receiver Worker Processes Sharing the Port (SO_REUSEPORT)",
+        default=DEFAULT_WORKERS
+    )
+
+    parser.add_argument(
+        "-L", "--event-log", dest="event_log", type=str,
+        help="File to Log Member Joins, Suspicions and Failures to"
+    )
+
+    parser.add_argument(
+        "-J", "--json-event-log", dest="json_event_log", action="store_true",
+        help="Log Events as JSON Lines with Timestamps"
+    )
+
+    parser.add_argument(
+        "-R", "--event-log-max-bytes", dest="event_log_max_bytes", type=int,
+        help="Rotate the Event Log Past this Size",
+        default=DEFAULT_MAX_BYTES
+    )
+
+    parser.add_argument(
+        "-M", "--metrics-port", dest="metrics_port", type=int,
+        help="Serve Metrics over HTTP on this Local Port"
+    )
+
+    parser.add_argument(
+        "-S", "--metrics-socket", dest="metrics_socket", type=str,
+        help="Serve Metrics on this Unix Socket Path"
+    )
+
+    parser.add_argument(
+        "-sF", "--state-file", dest="state_file", type=str,
+        help="File to Save the Member List to for Warm Restarts"
+    )
+
+    parser.add_argument(
+        "-tW", "--t-save", dest="t_save", type=float,
+        help="Time Interval for Saving the State File",
+        default=DEFAULT_T_SAVE
+    )
+
+    parser.add_argument(
+        "-ws", "--warm-start", dest="warm_start", action="store_true",
+        help="Rejoin through the Members in the State File First"
+    )
+
+    parser.add_argument(
+        "-A", "--api-socket", dest="api_socket", type=str,
+        help="Serve Membership Queries and Watches on this Unix Socket Path"
+    )
+
+    parser.add_argument(
+        "-V", "--vnodes", dest="vnodes", type=int,
+        help="Hash Ring Tokens per Member for API Lookups (0 to Disable)",
+        default=DEFAULT_VNODES
+    )
+
+    parser.add_argument(
+        "-T", "--trace", dest="trace", type=str,
+        help="Record every Received Datagram to this Trace File "
+             "(see replay.py)"
+    )
+
     args = parser.parse_args()
 
     # Set Global Variables
@@ -489,50 +576,155 @@ def main():
         DEFAULT_INTRODUCER_REMOTE
     )
 
-    SelfNode["Address"] = (
-        default_self[0],
-        with_default(args.port, default_self[1])
-    )
-    SelfNode["Id"] = with_default(args.id, DEFAULT_SELF_ID)
-
-    EnableSuspicionStrategy = args.enable_suspicion_strategy
     T_GOSSIP = args.t_gossip
-    T_SUSPECT = args.t_suspect
-    T_FAIL = args.t_fail
-    T_CLEANUP = args.t_cleanup
+    T_RESYNC = max(0.0, args.t_resync)
+    T_SAVE = max(0.1, args.t_save)
     VERBOSITY = args.verbosity
     LOGGER = Logger(VERBOSITY)
 
-    MESSAGE_DROP_RATE = clamp(args.message_drop_rate, 0.0, 1.0)
-
     introducer_host = with_default(args.introducer_host, default_introducer[0])
     introducer_port = with_default(args.introducer_port, default_introducer[1])
 
-    INTRODUCER_ADDRESS = (introducer_host, introducer_port)
+    engine = MembershipEngine(
+        member_id=with_default(args.id, DEFAULT_SELF_ID),
+        address=(default_self[0], with_default(args.port, default_self[1])),
+        introducer=(introducer_host, introducer_port),
+        seeds=[parse_address(seed) for seed in args.seeds],
+        t_suspect=args.t_suspect,
+        t_fail=args.t_fail,
+        t_cleanup=args.t_cleanup,
+        enable_suspicion=args.enable_suspicion_strategy,
+        detector=Detector(args.detector),
+        t_probe=args.t_probe,
+        t_ack=args.t_ack,
+        indirect_probes=max(0, args.indirect_probes),
+        phi_threshold=args.phi_threshold,
+        full_sync_interval=max(1, args.full_sync_interval),
+        wire_format=WireFormat(args.wire_format),
+        mtu=args.mtu,
+        max_pages=args.max_pages,
+        message_drop_rate=clamp(args.message_drop_rate, 0.0, 1.0),
+        logger=LOGGER,
+    )
+
+    if args.metrics_port is not None or args.metrics_socket is not None:
+        serve_metrics(
+            engine.metrics.registry,
+            port=args.metrics_port,
+            path=args.metrics_socket
+        )
+
+    if args.api_socket is not None:
+        ring = attach_ring(engine, args.vnodes) if args.vnodes > 0 else None
+        serve_local_api(engine, args.api_socket, ring=ring)
+
+    if args.event_log:
+        log_member_events(engine, EventLog(
+            args.event_log,
+            structured=args.json_event_log,
+            max_bytes=args.event_log_max_bytes
+        ))
+
+    try:
+        serve_state_transfer(engine)
+    except socket.error:
+        LOGGER.log("Failed to bind the state transfer socket")
+        sys.exit(1)
+
+    workers = max(0, args.workers)
+    if workers and not supports_reuse_port():
+        LOGGER.log("SO_REUSEPORT is not supported, receiving in one thread")
+        workers = 0
+    if workers and args.trace is not None:
+        # workers receive in other processes, out of the recorder's reach
+        LOGGER.log("Tracing every datagram, receiving in one thread")
+        workers = 0
 
     # Initialize Node
 
-    self_socket = initialize_node()
+    known_peers = None
+    if args.warm_start and args.state_file is not None:
+        saved = load_engine_state(args.state_file)
+        if saved is None:
+            LOGGER.log("No usable state file, starting cold")
+        else:
+            members, saved_at = saved
+            known_peers = restore_engine_state(engine, members)
+            LOGGER.log(
+                f"Loaded {len(known_peers)} members saved "
+                f"{time.time() - saved_at:.1f}s ago", verbosity=2
+            )
+
+    self_socket = initialize_node(
+        engine, reuse_port=workers > 0, known_peers=known_peers
+    )
+    connections = start_workers(engine, workers, VERBOSITY)
+    recorder = None
+    if args.trace is not None:
+        recorder = TraceRecorder(args.trace, TraceKind.ENGINE, engine.id)
+
+    if args.runtime == "asyncio":
+        try:
+            asyncio.run(serve_asyncio(
+                engine, self_socket, connections, args.state_file, recorder
+            ))
+        except KeyboardInterrupt:
+            LOGGER.log("Keyboard Interrupt. Exiting...")
+            self_socket.close()
+            if recorder is not None:
+                recorder.close()
+        return
 
     # Start Threads
     try:
         thread_receive = threading.Thread(
             target=handle_receiving_message,
-            args=((self_socket, ))
+            args=((engine, self_socket, recorder))
         )
         thread_receive.start()
 
+        if connections:
+            thread_batches = threading.Thread(
+                target=handle_worker_batches,
+                args=((engine, self_socket, connections))
+            )
+            thread_batches.start()
+
         thread_gossip = threading.Thread(
             target=handle_sending_gossip,
-            args=((self_socket, ))
+            args=((engine, self_socket))
         )
         thread_gossip.start()
 
         thread_update = threading.Thread(
             target=handle_updating_member_list,
+            args=((engine, self_socket))
         )
         thread_update.start()
 
+        if engine.detector == Detector.SWIM:
+            thread_probe = threading.Thread(
+                target=handle_probing,
+                args=((engine, self_socket))
+            )
+            thread_probe.start()
+
+        if args.state_file is not None:
+            thread_save = threading.Thread(
+                target=handle_saving_state,
+                args=((engine, args.state_file)),
+                daemon=True
+            )
+            thread_save.start()
+
+        if T_RESYNC > 0:
+            thread_resync = threading.Thread(
+                target=handle_resyncing,
+                args=((engine,)),
+                daemon=True
+            )
+            thread_resync.start()
+
     except Exception as e:
         LOGGER.log(e)
         sys.exit(1)
@@ -0,0 +1,532 @@
+"""
+In-process cluster simulator.
+
+Runs many MembershipEngines in one process on a virtual clock, connected by
+a simulated network with loss, latency, jitter and partitions, and reports:
+
+* convergence time: from the last join until every live node lists every
+  live node as alive
+* failure detection latency: from a crash until the first live node, and
+  until every live node, suspects or fails the crashed node
+* false positives: suspicions/failures of nodes that were neither crashed
+  nor on the other side of a partition
+* bytes sent per node per second
+
+Usage:
+    python simulator.py -n 1000 --duration 30 --crash 10 --loss 0.01
+"""
+import argparse
+import heapq
+import itertools
+import json
+import random
+
+from typing import Callable
+
+from engine import (
+    MembershipEngine, MemberEvent, DEFAULT_T_GOSSIP, DEFAULT_T_SUSPECT,
+    DEFAULT_T_FAIL, DEFAULT_T_CLEANUP, DEFAULT_T_UPDATE, DEFAULT_FANOUT
+)
+from phi import DEFAULT_PHI_THRESHOLD
+from protocol import Status
+from swim import Detector
+from util import Logger
+
+Address = tuple[str, int]
+Receiver = Callable[[bytes, Address], None]
+
+
+class VirtualClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class VirtualNetwork(object):
+    """
+    A discrete event queue plus a lossy, delayed, partitionable datagram
+    network.  Loss generalizes MESSAGE_DROP_RATE: it applies to every
+    datagram in flight rather than at one receiver.
+    """
+
+    def __init__(
+        self,
+        clock: VirtualClock,
+        rng: random.Random,
+        loss: float = 0.0,
+        latency: float = 0.001,
+        jitter: float = 0.0,
+    ):
+        self.clock = clock
+        self.rng = rng
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+
+        self.events: list[tuple[float, int, Callable[[], None]]] = []
+        self.sequence = itertools.count()
+        self.endpoints: dict[Address, Receiver] = {}
+        self.groups: dict[Address, int] = {}
+
+        self.bytes_sent = 0
+        self.datagrams_sent = 0
+        self.datagrams_dropped = 0
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> None:
+        heapq.heappush(
+            self.events,
+            (self.clock.now + delay, next(self.sequence), callback)
+        )
+
+    def attach(self, address: Address, receiver: Receiver) -> None:
+        self.endpoints[address] = receiver
+
+    def detach(self, address: Address) -> None:
+        self.endpoints.pop(address, None)
+
+    def partition(self, groups: list[list[Address]]) -> None:
+        """ Split the network; addresses not listed stay in group 0 """
+        self.groups = {
+            address: index + 1
+            for index, group in enumerate(groups)
+            for address in group
+        }
+
+    def heal(self) -> None:
+        self.groups = {}
+
+    def reachable(self, source: Address, destination: Address) -> bool:
+        return self.groups.get(source, 0) == self.groups.get(destination, 0)
+
+    def send(self, source: Address, data: bytes, destination: Address) -> None:
+        self.bytes_sent += len(data)
+        self.datagrams_sent += 1
+
+        if (
+            destination not in self.endpoints or
+            not self.reachable(source, destination) or
+            self.rng.random() < self.loss
+        ):
+            self.datagrams_dropped += 1
+            return
+
+        def deliver() -> None:
+            receiver = self.endpoints.get(destination)
+            if receiver is not None:
+                receiver(data, source)
+
+        self.schedule(
+            self.latency + self.rng.uniform(0.0, self.jitter),
+            deliver
+        )
+
+    def run_until(self, end: float) -> None:
+        while self.events and self.events[0][0] <= end:
+            at, _, callback = heapq.heappop(self.events)
+            self.clock.now = at
+            callback()
+        self.clock.now = end
+
+
+class SimulatedLink(object):
+    """ The DatagramSender a simulated node's engine sends through """
+
+    def __init__(self, network: VirtualNetwork, address: Address):
+        self.network = network
+        self.address = address
+
+    def sendto(self, data, address: Address) -> None:
+        # the engine reuses its encode buffer, so copy what is in flight
+        self.network.send(self.address, bytes(data), address)
+
+
+class SimulatedNode(object):
+    def __init__(self, engine: MembershipEngine, link: SimulatedLink):
+        self.engine = engine
+        self.link = link
+        self.crashed = False
+
+
+class ClusterSimulator(object):
+    def __init__(
+        self,
+        nodes: int,
+        t_gossip: float = DEFAULT_T_GOSSIP,
+        t_update: float = DEFAULT_T_UPDATE,
+        t_suspect: float = DEFAULT_T_SUSPECT,
+        t_fail: float = DEFAULT_T_FAIL,
+        t_cleanup: float = DEFAULT_T_CLEANUP,
+        fanout: int = DEFAULT_FANOUT,
+        enable_suspicion: bool = True,
+        detector: Detector = Detector.HEARTBEAT,
+        phi_threshold: float = DEFAULT_PHI_THRESHOLD,
+        loss: float = 0.0,
+        latency: float = 0.001,
+        jitter: float = 0.001,
+        seed: int = 0,
+    ):
+        self.t_gossip = t_gossip
+        self.t_update = t_update
+        self.rng = random.Random(seed)
+        self.clock = VirtualClock()
+        self.network = VirtualNetwork(
+            self.clock, self.rng, loss, latency, jitter
+        )
+
+        # (time, observer, event, member)
+        self.events: list[tuple[float, str, MemberEvent, str]] = []
+        self.crash_times: dict[str, float] = {}
+        self.last_join = 0.0
+        self.convergence_time: float | None = None
+
+        introducer = self.address_of(0)
+        logger = Logger(0)
+        self.nodes: dict[str, SimulatedNode] = {}
+
+        for index in range(nodes):
+            address = self.address_of(index)
+            engine = MembershipEngine(
+                f"node-{index}",
+                address,
+                introducer,
+                t_suspect=t_suspect,
+                t_fail=t_fail,
+                t_cleanup=t_cleanup,
+                fanout=fanout,
+                enable_suspicion=enable_suspicion,
+                detector=detector,
+                phi_threshold=phi_threshold,
+                clock=self.clock,
+                rng=random.Random(self.rng.random()),
+                logger=logger,
+            )
+            engine.add_listener(self.recorder(engine.id))
+            self.nodes[engine.id] = SimulatedNode(
+                engine, SimulatedLink(self.network, address)
+            )
+
+    @staticmethod
+    def address_of(index: int) -> Address:
+        host = f"10.{index // 65536}.{index // 256 % 256}.{index % 256}"
+        return (host, 8000)
+
+    def recorder(self, observer: str) -> Callable[[MemberEvent, str], None]:
+        def record(event: MemberEvent, member_id: str) -> None:
+            self.events.append((self.clock.now, observer, event, member_id))
+        return record
+
+    def live_nodes(self) -> list[SimulatedNode]:
+        return [node for node in self.nodes.values() if not node.crashed]
+
+    # NODE LIFECYCLE
+
+    def start_node(self, node: SimulatedNode) -> None:
+        engine, link = node.engine, node.link
+
+        def receive(data: bytes, source: Address) -> None:
+            if not node.crashed:
+                engine.handle_datagram(link, data, source)
+
+        def gossip_tick() -> None:
+            if not node.crashed:
+                engine.gossip_round(link)
+                self.network.schedule(self.t_gossip, gossip_tick)
+
+        def update_tick() -> None:
+            if not node.crashed:
+                engine.update_member_list()
+                engine.flush_joins(link)
+                if engine.detector == Detector.SWIM:
+                    engine.probe_tick(link)
+                self.network.schedule(self.t_update, update_tick)
+
+        self.network.attach(engine.address, receive)
+        if not engine.is_introducer:
+            link.sendto(engine.join_message(), engine.introducer)
+
+        # random phases so that the nodes do not tick in lockstep
+        self.network.schedule(self.rng.uniform(0, self.t_gossip), gossip_tick)
+        self.network.schedule(self.rng.uniform(0, self.t_update), update_tick)
+        self.last_join = max(self.last_join, self.clock.now)
+
+    def start(self, join_window: float) -> None:
+        """ Join every node at a random time within join_window seconds """
+        for index, node in enumerate(self.nodes.values()):
+            delay = 0.0 if index == 0 else self.rng.uniform(0.0, join_window)
+            self.network.schedule(
+                delay,
+                lambda node=node: self.start_node(node)
+            )
+
+    def crash(self, node: SimulatedNode) -> None:
+        node.crashed = True
+        node.engine.is_online = False
+        self.network.detach(node.engine.address)
+        self.crash_times[node.engine.id] = self.clock.now
+
+    # METRICS
+
+    def converged(self) -> bool:
+        live = self.live_nodes()
+        expected = {node.engine.id for node in live}
+        for node in live:
+            members = node.engine.member_list
+            if members.keys() != expected or any(
+                member.status != Status.ALIVE
+                for member in members.values()
+            ):
+                return False
+        return True
+
+    def watch_convergence(self) -> None:
+        """ Check for convergence every T_GOSSIP until it happens """
+        def check() -> None:
+            if self.converged():
+                self.convergence_time = self.clock.now - self.last_join
+            else:
+                self.network.schedule(self.t_gossip, check)
+
+        self.network.schedule(self.t_gossip, check)
+
+    def detection_latencies(self) -> dict:
+        first: dict[str, float] = {}
+        per_observer: dict[tuple[str, str], float] = {}
+        detections = (
+            MemberEvent.SUSPECTED, MemberEvent.FAILED, MemberEvent.REMOVED
+        )
+
+        for at, observer, event, member_id in self.events:
+            crashed_at = self.crash_times.get(member_id)
+            if event not in detections:
+                continue
+            if crashed_at is None or at < crashed_at:
+                continue
+            first.setdefault(member_id, at - crashed_at)
+            per_observer.setdefault((observer, member_id), at - crashed_at)
+
+        observers = [node.engine.id for node in self.live_nodes()]
+        everyone = []
+        undetected = 0
+        for member_id in self.crash_times:
+            latencies = [
+                per_observer.get((observer, member_id))
+                for observer in observers
+            ]
+            missing = sum(latency is None for latency in latencies)
+            undetected += missing
+            if not missing:
+                everyone.append(max(latencies))  # type: ignore
+
+        return {
+            "crashed": len(self.crash_times),
+            "first_detection_mean": mean(list(first.values())),
+            "first_detection_max": max(first.values(), default=None),
+            "all_detected_mean": mean(everyone),
+            "all_detected_max": max(everyone, default=None),
+            "undetected_pairs": undetected,
+        }
+
+    def false_positives(self, partitioned: set[tuple[str, str]]) -> dict:
+        suspicions = failures = 0
+        declared_failures = 0
+        for at, observer, event, member_id in self.events:
+            if event not in (MemberEvent.SUSPECTED, MemberEvent.FAILED):
+                continue
+            if event == MemberEvent.FAILED:
+                declared_failures += 1
+            crashed_at = self.crash_times.get(member_id)
+            if crashed_at is not None and at >= crashed_at:
+                continue
+            if (observer, member_id) in partitioned:
+                continue
+            if event == MemberEvent.SUSPECTED:
+                suspicions += 1
+            else:
+                failures += 1
+
+        return {
+            "false_suspicions": suspicions,
+            "false_failures": failures,
+            "false_failure_rate": (
+                failures / declared_failures if declared_failures else 0.0
+            ),
+        }
+
+    def run(
+        self,
+        duration: float,
+        join_window: float = 1.0,
+        crash_count: int = 0,
+        crash_at: float | None = None,
+        partition_at: float | None = None,
+        heal_at: float | None = None,
+        partition_fraction: float = 0.5,
+    ) -> dict:
+        """
+        Join the cluster, then run the scenario.  Times are in virtual
+        seconds after the join window.
+
+        Args:
+            duration (float): virtual seconds to run after the joins
+            join_window (float): joins are spread over this many seconds
+            crash_count (int): how many random non-introducer nodes crash
+            crash_at (float | None): when to crash them (default: half way
+                through the run)
+            partition_at (float | None): when to partition the network
+            heal_at (float | None): when to heal the partition
+            partition_fraction (float): share of nodes cut off
+
+        Returns:
+            dict: the metrics report
+        """
+        self.start(join_window)
+        self.network.run_until(join_window)
+        self.watch_convergence()
+        bytes_after_join = self.network.bytes_sent
+        end = join_window + duration
+
+        partitioned: set[tuple[str, str]] = set()
+
+        if crash_count:
+            victims = self.rng.sample(
+                list(self.nodes.values())[1:],
+                min(crash_count, len(self.nodes) - 1)
+            )
+
+            def crash_victims() -> None:
+                for node in victims:
+                    self.crash(node)
+
+            self.network.schedule(
+                with_fallback(crash_at, duration / 2),
+                crash_victims
+            )
+
+        if partition_at is not None:
+            cut = list(self.nodes.values())
+            cut = cut[len(cut) - int(len(cut) * partition_fraction):]
+            cut_ids = {node.engine.id for node in cut}
+
+            def split() -> None:
+                self.network.partition(
+                    [[node.engine.address for node in cut]]
+                )
+                for observer in self.nodes:
+                    for member_id in self.nodes:
+                        if (observer in cut_ids) != (member_id in cut_ids):
+                            partitioned.add((observer, member_id))
+
+            self.network.schedule(partition_at, split)
+            if heal_at is not None:
+                self.network.schedule(heal_at, self.network.heal)
+
+        self.network.run_until(end)
+
+        steady_seconds = max(duration, 1e-9)
+        return {
+            "nodes": len(self.nodes),
+            "virtual_seconds": end,
+            "convergence_time": self.convergence_time,
+            "detection": self.detection_latencies(),
+            "false_positives": self.false_positives(partitioned),
+            "bytes_per_node_per_second": (
+                self.network.bytes_sent / len(self.nodes) / end
+            ),
+            "steady_bytes_per_node_per_second": (
+                (self.network.bytes_sent - bytes_after_join) /
+                len(self.nodes) / steady_seconds
+            ),
+            "datagrams_sent": self.network.datagrams_sent,
+            "datagrams_dropped": self.network.datagrams_dropped,
+        }
+
+
+def mean(values: list[float]) -> float | None:
+    return sum(values) / len(values) if values else None
+
+
+def with_fallback(value: float | None, fallback: float) -> float:
+    return value if value is not None else fallback
+
+
+def main():
+    """ Run one simulated scenario and print its report """
+
+    parser = argparse.ArgumentParser(
+        description="In-process simulator for the gossip membership protocol"
+    )
+    parser.add_argument("-n", "--nodes", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20.0,
+                        help="Virtual seconds to run after the joins")
+    parser.add_argument("--join-window", type=float, default=1.0)
+    parser.add_argument("--crash", type=int, default=0,
+                        help="Number of nodes to crash")
+    parser.add_argument("--crash-at", type=float,
+                        help="Crash time, seconds after the joins")
+    parser.add_argument("--partition-at", type=float)
+    parser.add_argument("--heal-at", type=float)
+    parser.add_argument("--partition-fraction", type=float, default=0.5)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.001)
+    parser.add_argument("--jitter", type=float, default=0.001)
+    parser.add_argument("--t-gossip", type=float, default=DEFAULT_T_GOSSIP)
+    parser.add_argument("--t-update", type=float, default=DEFAULT_T_UPDATE)
+    parser.add_argument("--t-suspect", type=float, default=DEFAULT_T_SUSPECT)
+    parser.add_argument("--t-fail", type=float, default=DEFAULT_T_FAIL)
+    parser.add_argument("--t-cleanup", type=float, default=DEFAULT_T_CLEANUP)
+    parser.add_argument("--fanout", type=int, default=DEFAULT_FANOUT)
+    parser.add_argument("--no-suspicion", action="store_true",
+                        help="Disable the suspicion strategy")
+    parser.add_argument("--detector", type=str,
+                        choices=[detector.value for detector in Detector],
+                        default=Detector.HEARTBEAT.value)
+    parser.add_argument("--phi-threshold", type=float,
+                        default=DEFAULT_PHI_THRESHOLD)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true",
+                        help="Print the report as JSON")
+    args = parser.parse_args()
+
+    simulator = ClusterSimulator(
+        args.nodes,
+        t_gossip=args.t_gossip,
+        t_update=args.t_update,
+        t_suspect=args.t_suspect,
+        t_fail=args.t_fail,
+        t_cleanup=args.t_cleanup,
+        fanout=args.fanout,
+        enable_suspicion=not args.no_suspicion,
+        detector=Detector(args.detector),
+        phi_threshold=args.phi_threshold,
+        loss=args.loss,
+        latency=args.latency,
+        jitter=args.jitter,
+        seed=args.seed,
+    )
+    report = simulator.run(
+        args.duration,
+        join_window=args.join_window,
+        crash_count=args.crash,
+        crash_at=args.crash_at,
+        partition_at=args.partition_at,
+        heal_at=args.heal_at,
+        partition_fraction=args.partition_fraction,
+    )
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{key}:")
+            for sub_key, sub_value in value.items():
+                print(f"  {sub_key}: {sub_value}")
+        else:
+            print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Crash-safe membership snapshots on local disk, for warm restarts.
+
+A restarted member used to know nobody but itself and had to reach the
+introducer (or a seed) before doing anything.  With a state file it saves
+its member list every t_save seconds and, on a warm start, loads it back
+and contacts the members it knew directly, falling back to the introducer
+only if none of them answers.  Restarting a fleet then spreads the joins
+over the fleet instead of queueing them all at the introducer.
+
+A state file is a header followed by the member list in the binary wire
+format (an encoded gossip message, or a server.py node table):
+
+    magic:6s  version:u8  crc32:u32  length:u32  saved:f64  payload
+
+It is written to a temporary file, fsynced and renamed over the old one,
+so a crash leaves either the previous snapshot or the new one, never a
+torn file; a file that fails its checksum anyway is ignored.  Loading
+memory-maps the file and decodes the payload in place.
+"""
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from typing import Callable, TypeVar, cast
+
+from engine import MembershipEngine
+from protocol import (
+    DecodeError, GossipEncoder, GossipMessage, Member, Status, WireFormat,
+    decode_message
+)
+
+DEFAULT_T_SAVE = 5.0        # seconds between snapshots
+WARM_START_PEERS = 3        # known members tried before the introducer
+
+MAGIC = b"GMSNAP"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("!6sBIId")
+
+T = TypeVar("T")
+
+
+def write_state(path: str, payload: bytes | memoryview, saved: float) -> None:
+    """
+    Atomically replace the state file at path
+
+    Args:
+        path (str): the state file
+        payload (bytes | memoryview): the encoded member list
+        saved (float): when the member list was taken
+    """
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, zlib.crc32(payload), len(payload), saved
+    )
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(header)
+        file.write(payload)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+    # make the rename itself durable
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def read_state(
+    path: str,
+    decode: Callable[[memoryview], T]
+) -> tuple[T, float] | None:
+    """
+    Map the state file at path and decode its payload
+
+    Args:
+        path (str): the state file
+        decode (Callable[[memoryview], T]): decodes the payload
+
+    Returns:
+        tuple[T, float] | None: the decoded payload and when it was
+            saved, None if there is no usable state file
+    """
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+    with file:
+        if os.fstat(file.fileno()).st_size < _HEADER.size:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                magic, version, checksum, length, saved = _HEADER.unpack_from(
+                    view
+                )
+                payload = view[_HEADER.size:_HEADER.size + length]
+                try:
+                    if (
+                        magic != MAGIC or
+                        version != FORMAT_VERSION or
+                        len(payload) != length or
+                        zlib.crc32(payload) != checksum
+                    ):
+                        return None
+                    try:
+                        return decode(payload), saved
+                    except DecodeError:
+                        return None
+                finally:
+                    payload.release()
+
+
+def save_engine_state(engine: MembershipEngine, path: str) -> None:
+    """ Snapshot the engine's member list to path """
+    records = engine.member_records()
+    encoder = GossipEncoder(WireFormat.BINARY)
+    encoder.encode(None, 0, records)
+    write_state(path, encoder.payload(0), time.time())
+
+
+def load_engine_state(path: str) -> tuple[dict[str, Member], float] | None:
+    """ The member list saved at path and when, see read_state """
+    return read_state(
+        path,
+        lambda payload: cast(GossipMessage, decode_message(payload))["data"]
+    )
+
+
+def restore_engine_state(
+    engine: MembershipEngine,
+    members: dict[str, Member]
+) -> list[tuple[str, tuple[str, int]]]:
+    """
+    Load a saved member list into a freshly started engine.  Our own
+    heartbeat and incarnation continue past the saved ones, so members
+    that still remember us take our gossip as new and any suspicion of
+    us from before the restart is refuted.
+
+    Args:
+        engine (MembershipEngine): the new engine
+        members (dict[str, Member]): the saved member list
+
+    Returns:
+        list[tuple[str, tuple[str, int]]]: the known members to contact,
+            (id, address), in random order
+    """
+    saved_self = members.pop(engine.id, None)
+    if saved_self is not None:
+        incarnation, _ = saved_self["status"]
+        engine.lock.acquire()
+        me = engine.member_list[engine.id]
+        me.heartbeat = max(me.heartbeat, saved_self["heartbeat"] + 1)
+        me.incarnation = max(me.incarnation, incarnation + 1)
+        engine.touch(engine.id)
+        engine.lock.release()
+
+    known = {
+        member_id: member for member_id, member in members.items()
+        if member["status"][1] != Status.FAILED
+    }
+    engine.merge_to_member_list(known)
+
+    peers = [
+        (member_id, member["address"]) for member_id, member in known.items()
+    ]
+    engine.rng.shuffle(peers)
+    return peers
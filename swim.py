@@ -0,0 +1,132 @@
+"""
+SWIM style failure detection.
+
+Instead of waiting for a member's heartbeat to stop spreading through
+gossip, every protocol period a member probes one other member directly
+with a PING.  If no ACK arrives within the ack timeout it asks a few random
+members to probe the target on its behalf with a PING_REQ, and relays their
+ACK back.  A target that has answered neither by the end of the period is
+suspected (or failed, without the suspicion strategy).
+
+Every member sends one probe per period no matter how large the cluster
+is, and a crashed member is probed by someone within a few periods, so
+message load and first detection time do not grow with the member list.
+Targets are taken round-robin from a shuffled list (see peers.py), with
+new members inserted at random positions, which bounds how long any member
+can go unprobed.
+
+ProbeScheduler only keeps the probe state; MembershipEngine sends the
+messages and changes member status (see engine.probe_tick).
+"""
+import itertools
+import random
+
+from enum import Enum
+
+from peers import PeerSelector
+
+DEFAULT_T_PROBE = 1.0       # protocol period
+DEFAULT_T_ACK = 0.3         # wait this long for a direct ack
+DEFAULT_INDIRECT_PROBES = 3  # members asked to ping-req a silent target
+
+
+class Detector(Enum):
+    HEARTBEAT = "heartbeat"  # suspect members whose heartbeats stop
+    SWIM = "swim"            # probe members directly and indirectly
+    PHI = "phi"              # heartbeats judged by phi accrual, see phi.py
+
+
+class ProbeScheduler(object):
+    def __init__(
+        self,
+        t_probe: float = DEFAULT_T_PROBE,
+        t_ack: float = DEFAULT_T_ACK,
+        indirect_probes: int = DEFAULT_INDIRECT_PROBES,
+        rng: random.Random | None = None
+    ):
+        self.t_probe = t_probe
+        self.t_ack = t_ack
+        self.indirect_probes = indirect_probes
+        self.rng = rng if rng is not None else random.Random()
+        self.seqs = itertools.count(1)
+
+        # the probe in flight
+        self.target: str | None = None
+        self.seq = 0
+        self.started = 0.0
+        self.acked = False
+        self.requested = False  # ping-reqs sent
+
+        # shuffled round-robin order of probe targets, kept up to date
+        # by the engine as members join and fail
+        self.peers = PeerSelector(self.rng)
+
+        # relay seq -> (asker's seq, asker's address, expiry)
+        self.relays: dict[int, tuple[int, tuple[str, int], float]] = {}
+
+    def next_target(self) -> str | None:
+        """ Take the next probe target, None if there is nobody to probe """
+        taken = self.peers.take(1)
+        return taken[0] if taken else None
+
+    def start(self, target: str, now: float) -> int:
+        """ Begin probing target, returns the seq to ping with """
+        self.target = target
+        self.seq = next(self.seqs)
+        self.started = now
+        self.acked = False
+        self.requested = False
+        return self.seq
+
+    def finish(self) -> None:
+        self.target = None
+
+    def on_ack(self, seq: int) -> bool:
+        """ Whether seq answers the probe in flight """
+        if self.target is not None and seq == self.seq:
+            self.acked = True
+            return True
+        return False
+
+    def ack_overdue(self, now: float) -> bool:
+        """ Whether it is time to ask others to probe the target """
+        return (
+            self.target is not None and
+            not self.acked and
+            not self.requested and
+            now - self.started >= self.t_ack
+        )
+
+    def period_over(self, now: float) -> bool:
+        return self.target is None or now - self.started >= self.t_probe
+
+    def relay(self, seq: int, address: tuple[str, int], now: float) -> int:
+        """
+        Remember a ping-req so that the target's ack can be passed back
+
+        Args:
+            seq (int): the asker's probe seq
+            address (tuple[str, int]): where the asker is
+            now (float): the current time
+
+        Returns:
+            int: the seq to ping the target with
+        """
+        relay_seq = next(self.seqs)
+        self.relays[relay_seq] = (seq, address, now + self.t_probe)
+        return relay_seq
+
+    def take_relay(self, seq: int) -> tuple[int, tuple[str, int]] | None:
+        """ The asker's seq and address for a relayed ack, if any """
+        relay = self.relays.pop(seq, None)
+        if relay is None:
+            return None
+        return relay[0], relay[1]
+
+    def expire_relays(self, now: float) -> None:
+        expired = [
+            seq for seq, (_, _, expiry) in self.relays.items()
+            if expiry <= now
+        ]
+        for seq in expired:
+            del self.relays[seq]
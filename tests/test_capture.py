@@ -0,0 +1,141 @@
+"""
+Traces: what a member records reads back record for record, a killed
+member's truncated last record is skipped, and replaying a trace takes
+the recording member's place and ends in the state the traffic implies.
+"""
+import time
+
+import pytest
+
+import capture
+from capture import TraceError, TraceKind, TraceReader, TraceRecorder
+from protocol import (
+    Command, Member, Status, encode_message, encode_node_table
+)
+from replay import replay
+
+
+class FakeTime(object):
+    """ Stands in for the time module, so records get chosen times """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return time.monotonic()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(capture, "time", fake)
+    return fake
+
+
+def gossip(*members):
+    return encode_message({
+        "command": Command.GOSSIP,
+        "data": {
+            member_id: Member(
+                id=member_id,
+                address=("127.0.0.1", 8001),
+                heartbeat=heartbeat,
+                time=0.0,
+                status=(0, Status.ALIVE),
+                failed_time=0.0
+            )
+            for member_id, heartbeat in members
+        }
+    })
+
+
+def test_record_and_read(tmp_path, clock):
+    path = str(tmp_path / "node.trace")
+    recorder = TraceRecorder(path, TraceKind.ENGINE, "m0")
+    recorder.record(b"first", ("10.0.0.1", 9000))
+    clock.now += 0.5
+    recorder.record(memoryview(b"second"), ("not-an-ip", 9001))
+    recorder.close()
+    recorder.record(b"after close", ("10.0.0.1", 9000))
+
+    reader = TraceReader(path)
+    assert (reader.kind, reader.member_id) == (TraceKind.ENGINE, "m0")
+    assert list(reader) == [
+        (1000.0, b"first", ("10.0.0.1", 9000)),
+        (1000.5, b"second", ("0.0.0.0", 9001)),
+    ]
+    reader.close()
+
+
+def test_truncated_last_record_is_skipped(tmp_path, clock):
+    path = str(tmp_path / "node.trace")
+    recorder = TraceRecorder(path, TraceKind.ENGINE, "m0")
+    recorder.record(b"kept", ("10.0.0.1", 9000))
+    recorder.record(b"cut short", ("10.0.0.1", 9000))
+    recorder.close()
+    with open(path, "r+b") as file:
+        file.truncate(file.seek(0, 2) - 3)
+
+    reader = TraceReader(path)
+    assert [data for _, data, _ in reader] == [b"kept"]
+    reader.close()
+
+
+@pytest.mark.parametrize("data", [
+    b"", b"GTRACE", b"NOTRACE\x01\x00\x00\x00"
+])
+def test_not_a_trace_raises(tmp_path, data):
+    path = str(tmp_path / "node.trace")
+    with open(path, "wb") as file:
+        file.write(data)
+    with pytest.raises(TraceError):
+        TraceReader(path)
+
+
+def test_replay_engine_trace(tmp_path, clock):
+    path = str(tmp_path / "node.trace")
+    recorder = TraceRecorder(path, TraceKind.ENGINE, "m0")
+    # m1 goes quiet after its first heartbeat, m2 keeps beating
+    for second in range(10):
+        members = [("m2", second + 1)]
+        if second == 0:
+            members.append(("m1", 1))
+        recorder.record(gossip(*members), ("127.0.0.1", 8001))
+        clock.now += 1.0
+    recorder.record(b"\x00garbage", ("127.0.0.1", 8001))
+    recorder.close()
+
+    report = replay(
+        path, t_update=0.5, t_suspect=2.0, t_fail=4.0, t_cleanup=60.0,
+        enable_suspicion=True
+    )
+    assert (report["member"], report["kind"]) == ("m0", "engine")
+    assert (report["datagrams"], report["malformed"]) == (11, 1)
+    assert report["trace_seconds"] == 10.0
+    assert report["events"]["joined"] == 2
+    assert report["events"]["suspected"] == report["events"]["failed"] == 1
+    assert report["members"] == {"alive": 1, "suspected": 0, "failed": 1}
+
+
+def test_replay_node_table_trace(tmp_path, clock):
+    path = str(tmp_path / "node.trace")
+    recorder = TraceRecorder(path, TraceKind.NODE_TABLE, "node1")
+    recorder.record(encode_node_table({
+        "node2": {
+            "heartbeat_counter": 3, "local_clock": 4, "timestamp": 1.5,
+            "version_id": 1, "status": "online", "incarnation": 0
+        },
+        "node3": {"status": "joining"},
+    }), ("127.0.0.1", 8002))
+    recorder.record(b"\x00garbage", ("127.0.0.1", 8002))
+    recorder.close()
+
+    report = replay(path)
+    assert (report["member"], report["kind"]) == ("node1", "node_table")
+    assert report["malformed"] == 1
+    # the join request is not a member yet
+    assert report["members"]["alive"] == 1
+    assert report["events"]["joined"] == 1
@@ -0,0 +1,148 @@
+"""
+DeadlineQueue: keys expire in deadline order, and rescheduling or
+cancelling a key leaves no stale deadline behind.
+"""
+import random
+
+from deadlines import DeadlineQueue
+from engine import MembershipEngine
+from protocol import Member, Status
+
+
+def test_expires_in_deadline_order():
+    deadlines = DeadlineQueue()
+    for key, deadline in [("c", 3.0), ("a", 1.0), ("d", 4.0), ("b", 2.0)]:
+        deadlines.schedule(key, deadline)
+
+    assert deadlines.next_deadline() == 1.0
+    assert list(deadlines.pop_expired(3.5)) == ["a", "b", "c"]
+    assert len(deadlines) == 1 and "d" in deadlines
+    assert deadlines.next_deadline() == 4.0
+
+
+def test_deadline_is_exclusive():
+    deadlines = DeadlineQueue()
+    deadlines.schedule("a", 1.0)
+    assert list(deadlines.pop_expired(1.0)) == []
+    assert list(deadlines.pop_expired(1.5)) == ["a"]
+
+
+def test_reschedule_moves_the_only_deadline():
+    deadlines = DeadlineQueue()
+    deadlines.schedule("a", 1.0)
+    deadlines.schedule("b", 2.0)
+    deadlines.schedule("a", 5.0)    # pushed back
+    deadlines.schedule("b", 0.5)    # brought forward
+
+    assert deadlines.next_deadline() == 0.5
+    assert list(deadlines.pop_expired(3.0)) == ["b"]
+    assert list(deadlines.pop_expired(6.0)) == ["a"]
+    assert deadlines.next_deadline() is None
+
+
+def test_cancel():
+    deadlines = DeadlineQueue()
+    deadlines.schedule("a", 1.0)
+    deadlines.schedule("b", 2.0)
+    deadlines.cancel("a")
+    deadlines.cancel("missing")
+
+    assert "a" not in deadlines
+    assert deadlines.next_deadline() == 2.0
+    assert list(deadlines.pop_expired(10.0)) == ["b"]
+
+
+def test_reschedule_while_popping():
+    deadlines = DeadlineQueue()
+    for i in range(5):
+        deadlines.schedule(i, float(i))
+
+    popped = []
+    for key in deadlines.pop_expired(2.5):
+        popped.append(key)
+        deadlines.schedule(key, 10.0 + key)
+
+    assert popped == [0, 1, 2]
+    assert list(deadlines.pop_expired(11.5)) == [3, 4, 0, 1]
+
+
+def test_matches_a_sorted_reference():
+    # many reschedules force compactions, which must not lose a key
+    rng = random.Random(1)
+    deadlines = DeadlineQueue()
+    reference: dict[int, float] = {}
+    for _ in range(5000):
+        key = rng.randrange(50)
+        if rng.random() < 0.1:
+            deadlines.cancel(key)
+            reference.pop(key, None)
+        else:
+            deadline = rng.uniform(0, 100)
+            deadlines.schedule(key, deadline)
+            reference[key] = deadline
+    assert len(deadlines.heap) < 5000
+
+    now = 50.0
+    expired = list(deadlines.pop_expired(now))
+    assert expired == sorted(
+        (key for key, deadline in reference.items() if deadline < now),
+        key=reference.__getitem__
+    )
+    assert len(deadlines) == sum(
+        deadline >= now for deadline in reference.values()
+    )
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def member(member_id, heartbeat):
+    return Member(
+        id=member_id,
+        address=("127.0.0.1", 8001),
+        heartbeat=heartbeat,
+        time=0.0,
+        status=(0, Status.ALIVE),
+        failed_time=0.0
+    )
+
+
+def test_engine_sweeps_by_deadline():
+    clock = Clock()
+    engine = MembershipEngine(
+        "m0", ("127.0.0.1", 8000), ("127.0.0.1", 8000),
+        t_suspect=1.0, t_fail=2.0, t_cleanup=2.0, enable_suspicion=True,
+        clock=clock, rng=random.Random(0)
+    )
+    engine.merge_to_member_list({"m1": member("m1", 1)})
+
+    def status():
+        engine.update_member_list()
+        record = engine.member_list.get("m1")
+        return record.status if record is not None else None
+
+    clock.now = 0.9
+    assert status() == Status.ALIVE
+
+    # a heartbeat pushes the suspect deadline back
+    engine.merge_to_member_list({"m1": member("m1", 2)})
+    clock.now = 1.5
+    assert status() == Status.ALIVE
+    clock.now = 2.0
+    assert status() == Status.SUSPECTED
+
+    # failed t_fail after the last heartbeat, removed t_cleanup later
+    clock.now = 2.5
+    assert status() == Status.SUSPECTED
+    clock.now = 3.0
+    assert status() == Status.FAILED
+    assert engine.deadlines.next_deadline() == 5.0
+
+    clock.now = 5.1
+    assert status() is None
+    assert len(engine.deadlines) == 0
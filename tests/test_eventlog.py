@@ -0,0 +1,111 @@
+"""
+The background event log writer: what it writes, when it rotates, and that
+a failing disk does not stop it.
+"""
+import json
+import os
+import time
+
+from eventlog import EventLog
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def read(path):
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+
+def test_writes_events_in_order(tmp_path):
+    path = str(tmp_path / "events.log")
+    log = EventLog(path, flush_interval=0.01)
+    for i in range(100):
+        log.log(f"event {i}")
+    log.close()
+
+    assert read(path) == "".join(f"event {i}\n" for i in range(100))
+
+
+def test_structured_lines(tmp_path):
+    path = str(tmp_path / "events.log")
+    log = EventLog(path, structured=True, clock=lambda: 12.5)
+    log.log("node2 joined", member="node2")
+    log.close()
+
+    assert json.loads(read(path)) == {
+        "time": 12.5, "event": "node2 joined", "member": "node2"
+    }
+
+
+def test_rotates_by_bytes_not_characters(tmp_path):
+    path = str(tmp_path / "events.log")
+    # 7 bytes a line but only 4 characters: two lines fit in 10
+    # characters, not in 10 bytes
+    log = EventLog(path, max_bytes=10, flush_interval=0.01)
+    log.log("ééé")
+    wait_for(lambda: os.path.getsize(path) > 0)
+    log.log("ééé")
+    log.close()
+
+    assert read(path) == "ééé\n"
+    assert read(path + ".1") == "ééé\n"
+
+
+def test_keeps_only_backups_old_files(tmp_path):
+    path = str(tmp_path / "events.log")
+    log = EventLog(path, max_bytes=1, backups=2)
+    # write straight through, the writer thread is idle with nothing queued
+    for i in range(5):
+        log.write(f"{i}\n")
+    log.close()
+
+    assert [read(path), read(path + ".1"), read(path + ".2")] == [
+        "4\n", "3\n", "2\n"
+    ]
+    assert not os.path.exists(path + ".3")
+
+
+def test_rotates_by_age(tmp_path):
+    path = str(tmp_path / "events.log")
+    log = EventLog(path, max_age=60.0)
+    log.write("old\n")
+    log.opened -= 60.0
+    log.write("new\n")
+    log.close()
+
+    assert read(path + ".1") == "old\n"
+    assert read(path) == "new\n"
+
+
+class FullDisk(object):
+    closed = False
+
+    def write(self, data):
+        raise OSError(28, "No space left on device")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_writer_survives_a_failed_write(tmp_path, capsys):
+    path = str(tmp_path / "events.log")
+    log = EventLog(path, flush_interval=0.01)
+    full = FullDisk()
+    log.file.close()
+    log.file = full
+
+    log.log("lost")
+    wait_for(lambda: full.closed)
+    log.log("kept")
+    log.close()
+
+    assert read(path) == "kept\n"
+    assert "1 events lost" in capsys.readouterr().err
@@ -0,0 +1,146 @@
+"""
+Placement on the incremental ring, checked against a ring rebuilt from
+scratch, and how much of the key space moves when members come and go.
+"""
+import bisect
+import random
+
+from engine import MembershipEngine
+from hashring import HashRing, attach, key_hash
+from protocol import Member, Status
+
+KEYS = [f"key{i}" for i in range(2000)]
+
+
+def rebuilt_owner(members, vnodes, key):
+    # the first token clockwise from the key, on a ring sorted from scratch
+    ring = sorted(
+        (key_hash(f"{member_id}#{i}"), member_id)
+        for member_id in members for i in range(vnodes)
+    )
+    tokens = [token for token, _ in ring]
+    return ring[bisect.bisect_left(tokens, key_hash(key)) % len(ring)][1]
+
+
+def placement(ring):
+    return {key: ring.lookup(key) for key in KEYS}
+
+
+def test_empty_ring():
+    ring = HashRing()
+    assert ring.lookup("key") is None
+    assert ring.preference_list("key", 3) == []
+
+
+def test_lookup_matches_rebuilt_ring():
+    # enough tokens that the buckets split, then shrunk back to nothing
+    members = [f"m{i}" for i in range(40)]
+    ring = HashRing()
+    for member_id in members:
+        ring.add(member_id)
+    assert len(ring.maxes) > 1
+
+    for key in KEYS[:300]:
+        assert ring.lookup(key) == rebuilt_owner(members, 64, key)
+
+    for member_id in random.Random(1).sample(members, 30):
+        ring.remove(member_id)
+        members.remove(member_id)
+    for key in KEYS[:300]:
+        assert ring.lookup(key) == rebuilt_owner(members, 64, key)
+
+    for member_id in members:
+        ring.remove(member_id)
+    assert (ring.maxes, ring.size) == ([], 0)
+    assert ring.lookup("key") is None
+
+
+def test_preference_list():
+    ring = HashRing(8)
+    for member_id in ("a", "b", "c", "d"):
+        ring.add(member_id)
+
+    for key in KEYS[:100]:
+        replicas = ring.preference_list(key, 3)
+        assert len(set(replicas)) == 3
+        assert replicas[0] == ring.lookup(key)
+    # never more members than are on the ring
+    assert sorted(ring.preference_list("key", 10)) == ["a", "b", "c", "d"]
+
+
+def test_adding_a_member_only_moves_keys_to_it():
+    ring = HashRing()
+    for i in range(10):
+        ring.add(f"m{i}")
+    before = placement(ring)
+
+    ring.add("m10")
+    after = placement(ring)
+    moved = [key for key in KEYS if before[key] != after[key]]
+
+    assert all(after[key] == "m10" for key in moved)
+    # about a share of the keys, not a reshuffle
+    assert 0 < len(moved) < len(KEYS) // 5
+
+
+def test_removing_a_member_only_moves_its_keys():
+    ring = HashRing()
+    for i in range(10):
+        ring.add(f"m{i}")
+    before = placement(ring)
+
+    ring.remove("m3")
+    after = placement(ring)
+
+    for key in KEYS:
+        if before[key] != "m3":
+            assert after[key] == before[key]
+        assert after[key] != "m3"
+
+    # and taking it back restores the old placement
+    ring.add("m3")
+    assert placement(ring) == before
+
+
+def test_keys_spread_over_members():
+    ring = HashRing()
+    for i in range(10):
+        ring.add(f"m{i}")
+
+    counts: dict[str, int] = {}
+    for owner in placement(ring).values():
+        counts[owner] = counts.get(owner, 0) + 1
+    assert len(counts) == 10
+    assert max(counts.values()) < 2 * len(KEYS) // 10
+
+
+def member(member_id, port, status=Status.ALIVE):
+    return Member(
+        id=member_id,
+        address=("127.0.0.1", port),
+        heartbeat=1,
+        time=0.0,
+        status=(0, status),
+        failed_time=0.0
+    )
+
+
+def test_attach_follows_member_events():
+    engine = MembershipEngine(
+        "m0", ("127.0.0.1", 8000), ("127.0.0.1", 8000),
+        rng=random.Random(0)
+    )
+    ring = attach(engine)
+    assert "m0" in ring
+
+    engine.merge_to_member_list({
+        "m1": member("m1", 8001), "m2": member("m2", 8002)
+    })
+    assert "m1" in ring and "m2" in ring
+
+    # suspicion does not touch the ring, failing takes the member off it
+    engine.merge_to_member_list({"m1": member("m1", 8001, Status.SUSPECTED)})
+    assert "m1" in ring
+    engine.handle_leave_message({"id": "m2"})
+    assert "m2" not in ring
+    assert all(ring.lookup(key) != "m2" for key in KEYS[:100])
@@ -0,0 +1,171 @@
+"""
+PreMerger: many datagrams folded to one entry per member, by the engine's
+own merge rules, with other messages passed through and headers kept.
+"""
+import random
+
+import pytest
+
+from engine import MembershipEngine
+from ingest import IngestStats, PreMerger
+from protocol import Command, Member, Status, WireFormat, encode_message
+
+
+def member(member_id, heartbeat, incarnation=0, status=Status.ALIVE):
+    return Member(
+        id=member_id,
+        address=("127.0.0.1", 8001),
+        heartbeat=heartbeat,
+        time=0.0,
+        status=(incarnation, status),
+        failed_time=0.0
+    )
+
+
+def gossip(wire_format, *members, sender=None, version=0, ack=0):
+    message = {
+        "command": Command.GOSSIP,
+        "data": table(members)
+    }
+    if sender is not None:
+        message.update(sender=sender, version=version, ack=ack)
+    return memoryview(encode_message(message, wire_format))
+
+
+def premerge(*datagrams):
+    merger = PreMerger(rng=random.Random(0))
+    for data in datagrams:
+        merger.add(data, ("127.0.0.1", 9000))
+    return merger.take()
+
+
+def state(entry):
+    return entry["heartbeat"], entry["status"]
+
+
+def engine():
+    return MembershipEngine(
+        "m0", ("127.0.0.1", 8000), ("127.0.0.1", 8000),
+        enable_suspicion=True, rng=random.Random(0)
+    )
+
+
+def table(entries):
+    return {entry["id"]: entry for entry in entries}
+
+
+def merged(node):
+    return {
+        member_id: (record.heartbeat, record.incarnation, record.status)
+        for member_id, record in node.member_list.items()
+    }
+
+
+@pytest.mark.parametrize("wire_format", list(WireFormat))
+def test_failed_wins_over_any_incarnation(wire_format):
+    batch = [
+        [member("a", 5, 3), member("b", 2, 1, Status.FAILED)],
+        [member("a", 2, 1, Status.FAILED), member("b", 7, 4)],
+        [member("a", 4, 1), member("b", 3, 0, Status.SUSPECTED)],
+    ]
+    members, _, _, stats = premerge(*(
+        gossip(wire_format, *entries) for entries in batch
+    ))
+    # the highest heartbeat, and FAILED over everything before it, while a
+    # newer incarnation after it refutes it as in the engine
+    assert state(members["a"]) == (5, (1, Status.FAILED))
+    assert state(members["b"]) == (7, (4, Status.ALIVE))
+    assert stats == IngestStats(received=3, size=stats.size)
+
+    # members first heard of as FAILED are ignored, so start from known ones
+    known = {"a": member("a", 0), "b": member("b", 0)}
+    each = engine()
+    each.merge_to_member_list(known)
+    for entries in batch:
+        each.merge_to_member_list(table(entries))
+    once = engine()
+    once.merge_to_member_list(known)
+    once.merge_to_member_list(members)
+    assert merged(once) == merged(each)
+
+
+@pytest.mark.parametrize("wire_format", list(WireFormat))
+def test_incarnation_rule(wire_format):
+    members, _, _, _ = premerge(
+        gossip(wire_format, member("a", 5, 2), member("b", 1, 1)),
+        gossip(
+            wire_format, member("a", 4, 2, Status.SUSPECTED),
+            member("b", 3, 0, Status.SUSPECTED)
+        ),
+        gossip(wire_format, member("a", 3, 1), member("b", 2, 1)),
+    )
+    # suspicion wins at the same incarnation only, older ones are ignored
+    assert state(members["a"]) == (5, (2, Status.SUSPECTED))
+    assert state(members["b"]) == (3, (1, Status.ALIVE))
+
+
+def test_matches_merging_every_datagram():
+    # without FAILED entries the order of arrival does not matter
+    rng = random.Random(3)
+    for _ in range(200):
+        batch = [
+            [
+                member(
+                    f"m{i}", rng.randint(0, 9), rng.randint(0, 3),
+                    rng.choice([Status.ALIVE, Status.SUSPECTED])
+                )
+                for i in rng.sample(range(1, 6), rng.randint(1, 5))
+            ]
+            for _ in range(rng.randint(1, 6))
+        ]
+
+        each = engine()
+        for entries in batch:
+            each.merge_to_member_list(table(entries))
+        once = engine()
+        once.merge_to_member_list(premerge(*(
+            gossip(WireFormat.BINARY, *entries) for entries in batch
+        ))[0])
+
+        assert merged(once) == merged(each)
+
+
+@pytest.mark.parametrize("wire_format", list(WireFormat))
+def test_headers_keep_highest_version_and_last_ack(wire_format):
+    _, headers, _, _ = premerge(
+        gossip(wire_format, member("a", 1), sender="a", version=5, ack=2),
+        gossip(wire_format, member("a", 1), sender="a", version=3, ack=4),
+        gossip(wire_format, member("b", 1), sender="b", version=1, ack=1),
+        gossip(wire_format, member("c", 1)),
+    )
+    assert headers == {"a": (5, 4), "b": (1, 1)}
+
+
+def test_other_messages_pass_through():
+    ping = encode_message(
+        {"command": Command.PING, "data": {"id": "a", "seq": 5}}
+    )
+    merger = PreMerger(rng=random.Random(0))
+    merger.add(memoryview(ping), ("127.0.0.1", 9000))
+    merger.add(memoryview(b"\x00garbage"), ("127.0.0.1", 9000))
+    merger.add(memoryview(b"{}"), ("127.0.0.1", 9000))
+    members, headers, passthrough, stats = merger.take()
+
+    assert (members, headers) == ({}, {})
+    assert [entry.message["command"] for entry in passthrough] == [
+        Command.PING
+    ]
+    assert passthrough[0].size == len(ping)
+    assert passthrough[0].address == ("127.0.0.1", 9000)
+    assert stats == IngestStats(malformed=2)
+
+    # taking resets the batch
+    assert merger.take() == ({}, {}, [], IngestStats())
+
+
+def test_drop_rate():
+    merger = PreMerger(message_drop_rate=1.0, rng=random.Random(0))
+    merger.add(gossip(WireFormat.BINARY, member("a", 1)), ("127.0.0.1", 9000))
+    members, _, _, stats = merger.take()
+    assert members == {}
+    assert stats == IngestStats(dropped=1)
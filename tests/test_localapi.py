@@ -0,0 +1,152 @@
+"""
+The local API: the journal's catch-up window, and watches over the Unix
+socket that resume from a version, fall back to a snapshot when too far
+behind, and then follow member events as they happen.
+"""
+import json
+import random
+import socket
+
+import pytest
+
+from engine import MembershipEngine
+from hashring import attach as attach_ring
+from localapi import ViewJournal, serve_local_api
+from protocol import Member, Status
+
+
+def test_since():
+    journal = ViewJournal(history=3)
+    assert journal.since(0) == []
+    for i in range(5):
+        journal.append({"id": i})
+
+    assert journal.version == 5
+    assert journal.since(5) == []
+    assert [event["version"] for event in journal.since(2)] == [3, 4, 5]
+    assert [event["id"] for event in journal.since(4)] == [4]
+    # no longer kept, or never ours
+    assert journal.since(1) is None
+    assert journal.since(6) is None
+
+
+def test_wait_returns_events_or_times_out():
+    journal = ViewJournal()
+    assert journal.wait(0, 0.01) == []
+    journal.append({"id": "a"})
+    assert [event["id"] for event in journal.wait(0, 0.01)] == ["a"]
+
+
+def member(member_id, port, status=Status.ALIVE):
+    return Member(
+        id=member_id,
+        address=("127.0.0.1", port),
+        heartbeat=1,
+        time=0.0,
+        status=(0, status),
+        failed_time=0.0
+    )
+
+
+@pytest.fixture
+def api(tmp_path):
+    engine = MembershipEngine(
+        "m0", ("127.0.0.1", 8000), ("127.0.0.1", 8000),
+        enable_suspicion=True, rng=random.Random(0)
+    )
+    ring = attach_ring(engine)
+    path = str(tmp_path / "node.api")
+    server = serve_local_api(engine, path, history=4, ring=ring)
+    clients = []
+
+    def connect():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5.0)
+        sock.connect(path)
+        clients.append(sock)
+        lines = sock.makefile("rb")
+
+        def request(**fields):
+            sock.sendall(json.dumps(fields).encode() + b"\n")
+
+        def reply():
+            return json.loads(lines.readline())
+
+        return request, reply
+
+    yield engine, connect
+    for sock in clients:
+        sock.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests(api):
+    engine, connect = api
+    engine.merge_to_member_list({"m1": member("m1", 8001)})
+    request, reply = connect()
+
+    request(op="get", id="m1")
+    assert reply() == {
+        "type": "member", "version": 1, "member": {
+            "id": "m1", "host": "127.0.0.1", "port": 8001, "heartbeat": 1,
+            "incarnation": 0, "status": "alive"
+        }
+    }
+    request(op="get", id="missing")
+    assert reply()["member"] is None
+
+    request(op="snapshot")
+    snapshot = reply()
+    assert snapshot["version"] == 1
+    assert sorted(entry["id"] for entry in snapshot["members"]) == [
+        "m0", "m1"
+    ]
+
+    request(op="preference_list", key="user:42", n=5)
+    assert sorted(reply()["members"]) == ["m0", "m1"]
+
+    request(op="nope")
+    assert reply() == {"type": "error", "error": "unknown op nope"}
+
+
+def test_watch_catches_up_then_follows(api):
+    engine, connect = api
+    engine.merge_to_member_list({"m1": member("m1", 8001)})
+    engine.merge_to_member_list({"m2": member("m2", 8002)})
+    request, reply = connect()
+
+    # resumes right after the version it saw, without a snapshot
+    request(op="watch", since=1)
+    caught_up = reply()
+    assert (caught_up["type"], caught_up["version"]) == ("event", 2)
+    assert (caught_up["event"], caught_up["id"]) == ("joined", "m2")
+
+    engine.merge_to_member_list({"m1": member("m1", 8001, Status.FAILED)})
+    live = reply()
+    assert (live["version"], live["event"], live["id"]) == (3, "failed", "m1")
+    assert live["member"]["status"] == "failed"
+
+
+def test_watch_too_far_behind_gets_a_snapshot(api):
+    engine, connect = api
+    for i in range(1, 7):
+        engine.merge_to_member_list({f"m{i}": member(f"m{i}", 8000 + i)})
+    request, reply = connect()
+
+    # events 1 and 2 fell out of a history of 4
+    request(op="watch", since=1)
+    snapshot = reply()
+    assert (snapshot["type"], snapshot["version"]) == ("snapshot", 6)
+    assert len(snapshot["members"]) == 7
+
+    engine.merge_to_member_list({"m7": member("m7", 8007)})
+    event = reply()
+    assert (event["version"], event["id"]) == (7, "m7")
+
+
+def test_watch_without_since_starts_from_a_snapshot(api):
+    engine, connect = api
+    request, reply = connect()
+    request(op="watch")
+    assert reply()["type"] == "snapshot"
@@ -0,0 +1,145 @@
+"""
+MemberTable: a Mapping of slotted records whose handles are reused after
+removal, and which the engine updates in place; and the copy-on-write
+snapshots published from it.
+"""
+import random
+
+import pytest
+
+from engine import MembershipEngine
+from member_table import MemberTable, MembershipSnapshot
+from protocol import Member, Status
+
+
+def add(table, member_id, port=8001, heartbeat=1):
+    return table.add(
+        member_id, "127.0.0.1", port, heartbeat, 0.0, 0, Status.ALIVE
+    )
+
+
+def test_mapping():
+    table = MemberTable()
+    a = add(table, "a")
+    b = add(table, "b", 8002)
+
+    assert len(table) == 2
+    assert "a" in table and "c" not in table
+    assert list(table) == list(table.keys()) == ["a", "b"]
+    assert list(table.values()) == [a, b]
+    assert dict(table.items()) == {"a": a, "b": b}
+    assert table["b"] is b and table.get("c") is None
+    with pytest.raises(KeyError):
+        table["c"]
+
+
+def test_records_are_slotted():
+    record = add(MemberTable(), "a")
+    assert not hasattr(record, "__dict__")
+    with pytest.raises(AttributeError):
+        record.extra = 1
+
+
+def test_record_conversions():
+    record = add(MemberTable(), "a", 8001, 7)
+    record.failed_time = 3.0
+
+    assert record.address == ("127.0.0.1", 8001)
+    assert record.gossip_record() == (
+        "a", "127.0.0.1", 8001, 7, 0, Status.ALIVE
+    )
+    assert record.to_member() == Member(
+        id="a", address=("127.0.0.1", 8001), heartbeat=7, time=0.0,
+        status=(0, Status.ALIVE), failed_time=3.0
+    )
+
+
+def test_handles_are_reused_after_removal():
+    table = MemberTable()
+    a = add(table, "a")
+    b = add(table, "b")
+    assert (a.handle, b.handle) == (0, 1)
+
+    table.remove("a")
+    assert "a" not in table and table.record(a.handle) is None
+    with pytest.raises(KeyError):
+        table.remove("a")
+
+    c = add(table, "c")
+    assert c.handle == a.handle
+    assert table.record(c.handle) is c
+    assert len(table.records) == 2
+
+
+def member(member_id, heartbeat, status=Status.ALIVE, incarnation=0):
+    return Member(
+        id=member_id,
+        address=("127.0.0.1", 8001),
+        heartbeat=heartbeat,
+        time=0.0,
+        status=(incarnation, status),
+        failed_time=0.0
+    )
+
+
+def test_engine_updates_records_in_place():
+    engine = MembershipEngine(
+        "m0", ("127.0.0.1", 8000), ("127.0.0.1", 8000),
+        enable_suspicion=True, rng=random.Random(0)
+    )
+    engine.merge_to_member_list({"m1": member("m1", 1)})
+    record = engine.member_list["m1"]
+
+    engine.merge_to_member_list({"m1": member("m1", 5, Status.SUSPECTED)})
+    engine.merge_to_member_list({"m1": member("m1", 4, Status.ALIVE, 1)})
+
+    assert engine.member_list["m1"] is record
+    assert (record.heartbeat, record.incarnation, record.status) == (
+        5, 1, Status.ALIVE
+    )
+
+
+def view(member_id, heartbeat):
+    return add(MemberTable(), member_id, 8001, heartbeat).view()
+
+
+def test_snapshot_apply_is_copy_on_write():
+    first = MembershipSnapshot(0, {}, 0.0)
+    second = first.apply({"a": view("a", 1), "b": view("b", 1)}, 1.0)
+    third = second.apply({"a": view("a", 2), "b": None, "c": None}, 2.0)
+
+    assert (len(first), first.version) == (0, 0)
+    assert dict(second.members) == {"a": view("a", 1), "b": view("b", 1)}
+    assert (second.version, second.time) == (1, 1.0)
+    assert dict(third.members) == {"a": view("a", 2)}
+    assert (third.version, third.time) == (2, 2.0)
+    with pytest.raises(TypeError):
+        third.members["b"] = view("b", 1)   # type: ignore[index]
+
+
+def test_engine_publishes_batches():
+    engine = MembershipEngine(
+        "m0", ("127.0.0.1", 8000), ("127.0.0.1", 8000),
+        rng=random.Random(0)
+    )
+    first = engine.snapshot
+    assert list(first.members) == ["m0"]
+
+    engine.merge_to_member_list({"m1": member("m1", 1)})
+    engine.merge_to_member_list({"m2": member("m2", 1)})
+    # not visible until published, then all at once
+    assert engine.snapshot is first
+    second = engine.publish()
+    assert engine.snapshot is second
+    assert sorted(second.members) == ["m0", "m1", "m2"]
+    assert second.version == first.version + 1
+    assert second.members["m1"] == engine.member_list["m1"].view()
+
+    # nothing changed, nothing new to publish
+    assert engine.publish() is second
+
+    engine.merge_to_member_list({"m1": member("m1", 9)})
+    third = engine.publish()
+    assert third.members["m1"].heartbeat == 9
+    assert second.members["m1"].heartbeat == 1
+    assert list(first.members) == ["m0"]
@@ -0,0 +1,116 @@
+"""
+Several GossipNodes on one event loop, over real UDP sockets on
+localhost: they converge on one member list, a node that stops is failed
+by the rest, and NodeLoop runs the same from a plain thread.
+"""
+import asyncio
+import random
+import socket
+import time
+
+from engine import MembershipEngine
+from node import GossipNode, NodeLoop, shared_arena
+from protocol import Status
+from util import Logger
+
+TIMEOUT = 10.0
+
+
+def free_ports(count):
+    sockets = [
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(count)
+    ]
+    for sock in sockets:
+        sock.bind(("127.0.0.1", 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def nodes(count, seed=0):
+    addresses = [("127.0.0.1", port) for port in free_ports(count)]
+    return [
+        GossipNode(
+            MembershipEngine(
+                f"m{i}", address, addresses[0], t_suspect=2.0, t_fail=4.0,
+                enable_suspicion=True, rng=random.Random(seed + i),
+                logger=Logger(0)
+            ),
+            t_gossip=0.05, t_update=0.05, t_join=0.2
+        )
+        for i, address in enumerate(addresses)
+    ]
+
+
+def statuses(node):
+    node.engine.lock.acquire()
+    view = {
+        member_id: member.status
+        for member_id, member in node.engine.member_list.items()
+    }
+    node.engine.lock.release()
+    return view
+
+
+def converged(cluster, expected):
+    return all(statuses(node) == expected for node in cluster)
+
+
+async def wait_until(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+
+def test_nodes_converge_on_one_loop():
+    cluster = nodes(5)
+
+    async def run():
+        for node in cluster:
+            await node.start()
+        try:
+            everyone = {node.id: Status.ALIVE for node in cluster}
+            await wait_until(lambda: converged(cluster, everyone))
+            # joining ends with the first gossip heard after a join
+            await wait_until(lambda: all(node.joined for node in cluster))
+            # one arena for every node of the loop
+            loop = asyncio.get_running_loop()
+            assert all(
+                node.reader.arena is shared_arena(loop) for node in cluster
+            )
+
+            # a node that leaves is failed everywhere else at once
+            leaving = cluster.pop()
+            await leaving.stop()
+            assert leaving.socket is None and not leaving.running
+            await wait_until(lambda: all(
+                statuses(node).get(leaving.id) in (Status.FAILED, None)
+                for node in cluster
+            ))
+        finally:
+            for node in cluster:
+                await node.stop(leave=False)
+
+    asyncio.run(run())
+
+
+def test_node_loop_from_a_thread():
+    cluster = nodes(3, seed=10)
+    node_loop = NodeLoop()
+    try:
+        for node in cluster:
+            node_loop.add(node)
+        everyone = {node.id: Status.ALIVE for node in cluster}
+        deadline = time.monotonic() + TIMEOUT
+        while not converged(cluster, everyone):
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.05)
+
+        node_loop.remove(cluster[2], leave=False)
+        assert not cluster[2].running
+        assert node_loop.nodes == cluster[:2]
+    finally:
+        node_loop.close(leave=False)
+    assert not any(node.running for node in cluster)
@@ -0,0 +1,95 @@
+"""
+PeerSelector: every peer is taken exactly once per pass, however peers are
+added and removed mid-pass, and never waits longer than the bound.
+"""
+import math
+import random
+
+from peers import PeerSelector
+
+
+def selector(peers, seed=0):
+    order = PeerSelector(random.Random(seed))
+    for peer in peers:
+        order.add(peer)
+    return order
+
+
+def check_index(order):
+    assert len(order.index) == len(order.peers)
+    for slot, peer in enumerate(order.peers):
+        assert order.index[peer] == slot
+    assert 0 <= order.position <= len(order.peers)
+
+
+def test_empty_and_small():
+    assert PeerSelector(random.Random(0)).take(3) == []
+    one = selector(["a"])
+    assert one.take(3) == ["a"]
+    assert one.take(1) == ["a"]
+
+
+def test_every_peer_once_per_pass():
+    peers = [f"m{i}" for i in range(10)]
+    order = selector(peers)
+    for _ in range(20):
+        assert sorted(order.take(1)[0] for _ in range(10)) == peers
+
+
+def test_take_is_distinct_across_passes():
+    order = selector([f"m{i}" for i in range(5)])
+    for _ in range(50):
+        taken = order.take(3)
+        assert len(set(taken)) == 3
+        check_index(order)
+
+
+def test_added_peer_joins_the_current_pass():
+    peers = [f"m{i}" for i in range(6)]
+    for seed in range(20):
+        order = selector(peers, seed)
+        first = order.take(3)
+        order.add("new")
+        rest = order.take(4)
+        assert sorted(first + rest) == sorted(peers + ["new"])
+        check_index(order)
+
+
+def test_removed_peer_is_never_taken():
+    peers = [f"m{i}" for i in range(6)]
+    for seed in range(20):
+        order = selector(peers, seed)
+        first = order.take(3)
+        # one taken and one not yet taken this pass
+        order.remove(first[0])
+        order.remove(next(peer for peer in peers if peer not in first))
+        order.remove("missing")
+        rest = order.take(2)
+        assert len(set(first[1:] + rest)) == 4
+        assert sorted(first[1:] + rest) == sorted(order.peers)
+        check_index(order)
+
+
+def test_random_changes_keep_the_bound():
+    rng = random.Random(7)
+    order = selector([f"m{i}" for i in range(8)], 7)
+    fanout = 3
+    # never more than 12 peers: contacted at least every 2 * ceil(12 / 3)
+    bound = 2 * math.ceil(12 / fanout)
+    last_taken = {peer: 0 for peer in order.peers}
+    for round_number in range(1, 3000):
+        if rng.random() < 0.2:
+            peer = f"m{rng.randrange(12)}"
+            if peer in order:
+                order.remove(peer)
+                del last_taken[peer]
+            else:
+                order.add(peer)
+                last_taken[peer] = round_number
+        check_index(order)
+
+        for peer in order.take(fanout):
+            last_taken[peer] = round_number
+        assert all(
+            round_number - taken < bound for taken in last_taken.values()
+        )
@@ -0,0 +1,89 @@
+"""
+Phi accrual: phi for known arrival intervals, checked against the normal
+distribution by hand, and the timeout where it crosses the threshold.
+"""
+import math
+import statistics
+
+import pytest
+
+from phi import PhiAccrualDetector
+
+
+def detector_after(arrivals, **kwargs):
+    detector = PhiAccrualDetector(**kwargs)
+    for now in arrivals:
+        detector.heartbeat("m1", now)
+    return detector
+
+
+def test_unknown_member():
+    detector = PhiAccrualDetector(first_interval=2.0)
+    assert detector.phi("m1", 100.0) == 0.0
+    assert detector.timeout("m1") == 2.0
+
+
+def test_phi_of_regular_intervals():
+    # intervals of 1s (the prior and three arrivals), std at its floor
+    detector = detector_after([0.0, 1.0, 2.0, 3.0], min_std=0.1)
+
+    assert detector.phi("m1", 3.0) == pytest.approx(0.0, abs=1e-9)
+    # half the intervals are longer than the mean
+    assert detector.phi("m1", 4.0) == pytest.approx(math.log10(2))
+    # one standard deviation late: P(later) = 0.158655
+    assert detector.phi("m1", 4.1) == pytest.approx(
+        -math.log10(0.15865525393145707)
+    )
+    # three: P(later) = 0.0013499
+    assert detector.phi("m1", 4.3) == pytest.approx(
+        -math.log10(0.0013498980316301035)
+    )
+    assert detector.phi("m1", 100.0) == math.inf
+
+
+def test_phi_of_irregular_intervals():
+    # intervals 1.0 (prior), 0.5, 1.5, 0.5, 1.5: mean 1.0, std sqrt(0.2)
+    detector = detector_after([0.0, 0.5, 2.0, 2.5, 4.0])
+    mean, std = detector.distribution(detector.arrivals["m1"])
+    assert mean == pytest.approx(1.0)
+    assert std == pytest.approx(math.sqrt(0.2))
+
+    # a late heartbeat is much less suspicious than for a regular member
+    regular = detector_after([0.0, 1.0, 2.0, 3.0, 4.0])
+    assert detector.phi("m1", 5.5) == pytest.approx(
+        -math.log10(statistics.NormalDist(1.0, math.sqrt(0.2)).cdf(0.5))
+    )
+    assert detector.phi("m1", 5.5) < 1 < regular.phi("m1", 5.5)
+
+
+def test_window_keeps_the_latest_intervals():
+    arrivals = [0.0, 2.0, 2.5, 3.5, 3.7, 5.0]
+    detector = detector_after(arrivals, window=3, min_std=0.0)
+    intervals = [1.0] + [b - a for a, b in zip(arrivals, arrivals[1:])]
+
+    mean, std = detector.distribution(detector.arrivals["m1"])
+    assert mean == pytest.approx(statistics.mean(intervals[-3:]))
+    assert std == pytest.approx(statistics.pstdev(intervals[-3:]))
+
+
+def test_acceptable_pause_shifts_the_mean():
+    detector = detector_after([0.0, 1.0, 2.0], acceptable_pause=0.5)
+    assert detector.phi("m1", 3.5) == pytest.approx(math.log10(2))
+
+
+@pytest.mark.parametrize("threshold", [1.0, 3.0, 8.0])
+def test_timeout_is_where_phi_reaches_the_threshold(threshold):
+    detector = detector_after(
+        [0.0, 0.5, 2.0, 2.5, 4.0], threshold=threshold
+    )
+    timeout = detector.timeout("m1")
+    assert detector.phi("m1", 4.0 + timeout) == pytest.approx(threshold)
+    assert detector.phi("m1", 4.0 + timeout * 0.99) < threshold
+
+
+def test_forget_and_bad_threshold():
+    detector = detector_after([0.0, 1.0])
+    detector.forget("m1")
+    assert detector.phi("m1", 10.0) == 0.0
+    with pytest.raises(ValueError):
+        PhiAccrualDetector(threshold=0.0)
@@ -0,0 +1,229 @@
+"""
+Round trips through the wire codec in both formats, and the DecodeError
+every truncated or stray datagram must raise instead of anything else.
+"""
+import random
+
+import pytest
+
+from engine import MembershipEngine
+from protocol import (
+    Command, DecodeError, GossipEncoder, Member, Status, WireFormat,
+    decode_gossip_records, decode_message, decode_node_table,
+    encode_message, encode_node_table, member_record
+)
+
+
+def member(member_id, port, heartbeat, incarnation=0, status=Status.ALIVE):
+    # time and failed_time are local, they are never sent
+    return Member(
+        id=member_id,
+        address=("10.0.0.1", port),
+        heartbeat=heartbeat,
+        time=0.0,
+        status=(incarnation, status),
+        failed_time=0.0
+    )
+
+
+MEMBERS = {
+    "a": member("a", 9000, 12),
+    "b": member("b", 9001, 3, 2, Status.SUSPECTED),
+    "c": member("c", 9002, 7, 1, Status.FAILED),
+}
+
+MESSAGES = [
+    {"command": Command.JOIN, "data": {"id": "a", "host": "h", "port": 1}},
+    {"command": Command.LEAVE, "data": {"id": "a"}},
+    {"command": Command.GOSSIP, "data": MEMBERS},
+    {
+        "command": Command.GOSSIP, "data": MEMBERS,
+        "sender": "a", "version": 9, "ack": 4
+    },
+    {"command": Command.PING, "data": {"id": "a", "seq": 5}},
+    {
+        "command": Command.PING_REQ,
+        "data": {"id": "a", "seq": 5, "target": "b", "host": "h", "port": 2}
+    },
+    {"command": Command.ACK, "data": {"id": "b", "seq": 5}},
+]
+
+TABLE = {
+    "node1": {
+        "heartbeat_counter": 3, "local_clock": 4, "timestamp": 1.5,
+        "version_id": 1, "status": "online", "incarnation": 0
+    },
+    "node2": {
+        "heartbeat_counter": 8, "local_clock": 2, "timestamp": 0.0,
+        "version_id": 0, "status": "suspect", "incarnation": 2
+    },
+}
+
+
+@pytest.mark.parametrize("wire_format", list(WireFormat))
+@pytest.mark.parametrize("message", MESSAGES)
+def test_message_round_trip(message, wire_format):
+    assert decode_message(encode_message(message, wire_format)) == message
+
+
+@pytest.mark.parametrize("wire_format", list(WireFormat))
+def test_encoder_patches_ack_per_target(wire_format):
+    encoder = GossipEncoder(wire_format)
+    encoder.encode("a", 9, [member_record(m) for m in MEMBERS.values()])
+
+    for ack in (0, 4, 2 ** 40):
+        message = decode_message(bytes(encoder.payload(ack)))
+        assert message["data"] == MEMBERS
+        assert (message["sender"], message["version"], message["ack"]) == (
+            "a", 9, ack
+        )
+
+
+def test_gossip_records_match_decode_message():
+    data = encode_message(MESSAGES[3])
+    strings, sender, version, ack, records = decode_gossip_records(data)
+
+    assert (sender, version, ack) == ("a", 9, 4)
+    assert {
+        strings[id_index]: (
+            strings[host_index], port, heartbeat, incarnation, status
+        )
+        for id_index, host_index, port, heartbeat, incarnation, status
+        in records
+    } == {
+        m["id"]: (*m["address"], m["heartbeat"], m["status"][0],
+                  m["status"][1].value)
+        for m in MEMBERS.values()
+    }
+
+
+def test_gossip_records_leave_other_messages_to_decode_message():
+    assert decode_gossip_records(encode_message(MESSAGES[1])) is None
+    assert decode_gossip_records(
+        encode_message(MESSAGES[2], WireFormat.JSON)
+    ) is None
+
+
+@pytest.mark.parametrize("wire_format", list(WireFormat))
+def test_node_table_round_trip(wire_format):
+    assert decode_node_table(encode_node_table(TABLE, wire_format)) == TABLE
+
+    # a join request only carries a status
+    join = {"node3": {"status": "joining"}}
+    assert decode_node_table(encode_node_table(join, wire_format)) == join
+
+
+@pytest.mark.parametrize("wire_format", list(WireFormat))
+@pytest.mark.parametrize("message", MESSAGES)
+def test_truncated_message_raises(message, wire_format):
+    data = encode_message(message, wire_format)
+    for length in range(len(data)):
+        with pytest.raises(DecodeError):
+            decode_message(data[:length])
+
+
+def test_truncated_gossip_records_raise():
+    data = encode_message(MESSAGES[3])
+    for length in range(len(data)):
+        prefix = data[:length]
+        with pytest.raises(DecodeError):
+            # too short to tell it is gossip, it is left to decode_message
+            if decode_gossip_records(prefix) is None:
+                decode_message(prefix)
+
+
+@pytest.mark.parametrize("wire_format", list(WireFormat))
+def test_truncated_node_table_raises(wire_format):
+    data = encode_node_table(TABLE, wire_format)
+    for length in range(len(data)):
+        with pytest.raises(DecodeError):
+            decode_node_table(data[:length])
+
+
+@pytest.mark.parametrize("data", [
+    b"\xc5",                            # a bare magic byte
+    b"\xc5\x02\x7f\x00\x00\x00\x00",    # an unknown kind
+    b"\xff\xfe",                        # neither format
+    b"[1, 2, 3]",                       # JSON, but not a message
+])
+def test_stray_datagram_raises(data):
+    with pytest.raises(DecodeError):
+        decode_message(data)
+    with pytest.raises(DecodeError):
+        decode_node_table(data)
+
+
+def test_gossip_message_is_not_a_node_table():
+    # server.py and server_new.py nodes must not merge each other's gossip
+    for wire_format in WireFormat:
+        with pytest.raises(DecodeError):
+            decode_node_table(encode_message(MESSAGES[2], wire_format))
+
+
+STRAY_JSON = [
+    b'{"command": "GOSSIP", "data": []}',
+    b'{"command": "GOSSIP", "data": {"a": {"id": "a"}}}',
+    b'{"command": "GOSSIP", "data": {"a": {"id": "b", "address": ["h", 1],'
+    b' "heartbeat": 1, "status": [0, "ALIVE"]}}}',
+    b'{"command": "GOSSIP", "data": {"a": {"id": "a", "address": ["h", 1],'
+    b' "heartbeat": -1, "status": [0, "ALIVE"]}}}',
+    b'{"command": "GOSSIP", "data": {"a": {"id": "a", "address": ["h", 1],'
+    b' "heartbeat": 1, "status": [0, "GONE"]}}}',
+    b'{"command": "GOSSIP", "data": {}, "sender": "a"}',
+    b'{"command": "JOIN", "data": {}}',
+    b'{"command": "JOIN", "data": {"id": "a", "host": "h", "port": 70000}}',
+    b'{"command": "LEAVE", "data": {"id": 5}}',
+    b'{"command": "PING", "data": {"id": "a", "seq": "1"}}',
+    b'{"command": "PING_REQ", "data": {"id": "a", "seq": 1}}',
+    b'{"command": "ACK", "data": {"id": "a", "seq": true}}',
+    b'{"command": "SHOUT", "data": {}}',
+    b'{"command": ["GOSSIP"], "data": {}}',
+    b'{"data": {}}',
+    b'"GOSSIP"',
+]
+
+
+@pytest.mark.parametrize("data", STRAY_JSON)
+def test_stray_json_raises(data):
+    with pytest.raises(DecodeError):
+        decode_message(data)
+
+
+class NullSender(object):
+    def sendto(self, data, address):
+        return len(data)
+
+
+@pytest.mark.parametrize("data", STRAY_JSON)
+def test_engine_drops_stray_json(data):
+    engine = MembershipEngine(
+        "m0", ("127.0.0.1", 8000), ("127.0.0.1", 8000),
+        rng=random.Random(0)
+    )
+    engine.handle_datagram(NullSender(), memoryview(data), ("127.0.0.1", 1))
+
+    assert engine.metrics.decode_failures.value == 1
+    assert list(engine.member_list) == ["m0"]
+
+
+@pytest.mark.parametrize("field, value", [
+    ("heartbeat_counter", -1),
+    ("local_clock", 2 ** 64),
+    ("version_id", "1"),
+    ("incarnation", True),
+    ("timestamp", "yesterday"),
+    ("timestamp", 10 ** 400),
+    ("timestamp", float("inf")),
+])
+def test_node_table_out_of_binary_range_raises(field, value):
+    # what decodes must encode again when server.py gossips it on
+    entry = dict(TABLE["node1"], **{field: value})
+    with pytest.raises(DecodeError):
+        decode_node_table(
+            encode_node_table({"node1": entry}, WireFormat.JSON)
+        )
+
+
+def test_json_node_table_encodes_again():
+    table = decode_node_table(encode_node_table(TABLE, WireFormat.JSON))
+    assert decode_node_table(encode_node_table(table)) == TABLE
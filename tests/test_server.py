@@ -0,0 +1,133 @@
+"""
+server.py's receive path: a pre-merged batch must end where merging every
+received table in turn does, with and without suspicion.
+"""
+import copy
+import random
+
+import pytest
+
+import server
+from peers import PeerSelector
+
+NODES = {f"node{i}": ("127.0.0.1", 8010 + i) for i in range(1, 7)}
+
+
+class NullEventLog(object):
+    def log(self, output):
+        pass
+
+
+def entry(status, heartbeat, incarnation, local_clock=0):
+    return {
+        "heartbeat_counter": heartbeat,
+        "local_clock": local_clock,
+        "timestamp": 0.0,
+        "version_id": 0,
+        "status": status,
+        "incarnation": incarnation,
+    }
+
+
+@pytest.fixture
+def node(monkeypatch):
+    monkeypatch.setattr(server, "node_name", "node1", raising=False)
+    monkeypatch.setattr(server, "NODES", NODES, raising=False)
+    monkeypatch.setattr(server, "event_log", NullEventLog(), raising=False)
+
+    def reset(suspicion, membership_list):
+        monkeypatch.setattr(server, "suspicion", suspicion, raising=False)
+        monkeypatch.setattr(
+            server, "membership_list", copy.deepcopy(membership_list),
+            raising=False
+        )
+        monkeypatch.setattr(
+            server, "peers", PeerSelector(random.Random(0)), raising=False
+        )
+        monkeypatch.setattr(server, "pending_joins", set(), raising=False)
+
+    return reset
+
+
+def merged_in_order(node, suspicion, membership_list, batch):
+    node(suspicion, membership_list)
+    for received_list in copy.deepcopy(batch):
+        server.merge_received(received_list)
+    return outcome()
+
+
+def premerged(node, suspicion, membership_list, batch):
+    node(suspicion, membership_list)
+    joins, tables = server.premerge(copy.deepcopy(batch))
+    server.pending_joins.update(joins)
+    for table in tables:
+        server.merge_received(table)
+    return outcome()
+
+
+def outcome():
+    return (
+        server.membership_list, server.pending_joins, set(server.peers.index)
+    )
+
+
+@pytest.mark.parametrize("suspicion", [False, True])
+def test_refutation_is_not_lost(node, suspicion):
+    # a refuting entry with a lower heartbeat, then an older suspicion
+    membership_list = {
+        "node1": entry("online", 50, 0),
+        "node2": entry("suspect", 9, 1),
+    }
+    batch = [
+        {"node2": entry("online", 8, 2)},
+        {"node2": entry("suspect", 9, 1)},
+    ]
+
+    expected = merged_in_order(node, suspicion, membership_list, batch)
+    assert premerged(node, suspicion, membership_list, batch) == expected
+    if suspicion:
+        assert expected[0]["node2"]["status"] == "online"
+
+
+@pytest.mark.parametrize("suspicion", [False, True])
+def test_premerge_matches_merging_in_order(node, suspicion):
+    rng = random.Random(5)
+
+    def random_entry(status=None):
+        return entry(
+            status or rng.choice(["online", "online", "suspect", "failed"]),
+            rng.randint(0, 12), rng.randint(0, 3), rng.randint(0, 50)
+        )
+
+    def random_table():
+        if rng.random() < 0.1:
+            return {f"node{rng.randint(1, 6)}": {"status": "joining"}}
+        return {
+            f"node{i}": random_entry()
+            for i in rng.sample(range(1, 7), rng.randint(1, 4))
+        }
+
+    for _ in range(3000):
+        membership_list = {"node1": random_entry("online")}
+        for i in rng.sample(range(2, 7), rng.randint(0, 4)):
+            membership_list[f"node{i}"] = random_entry()
+        batch = [random_table() for _ in range(rng.randint(1, 6))]
+
+        assert premerged(
+            node, suspicion, membership_list, batch
+        ) == merged_in_order(node, suspicion, membership_list, batch)
+
+
+@pytest.mark.parametrize("suspicion", [False, True])
+def test_premerge_drops_superseded_entries(node, suspicion):
+    node(suspicion, {"node1": entry("online", 50, 0)})
+    batch = [
+        {f"node{i}": entry("online", heartbeat, 0) for i in range(2, 7)}
+        for heartbeat in (3, 5, 4, 5)
+    ]
+
+    joins, tables = server.premerge(batch)
+    assert joins == []
+    assert sum(len(table) for table in tables) == (
+        5 if not suspicion else 10
+    )
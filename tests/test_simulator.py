@@ -0,0 +1,27 @@
+"""
+Cluster level regression checks, run in the simulator at sizes where one
+gossip datagram cannot carry the whole member list.
+"""
+from simulator import ClusterSimulator
+
+
+def test_200_nodes_stay_up():
+    report = ClusterSimulator(200, seed=1).run(5.0)
+
+    # rounds that only covered a slice of the list failed tens of thousands
+    assert report["false_positives"]["false_failures"] < 50
+
+
+def test_truncated_rounds_advance_acks():
+    simulator = ClusterSimulator(200, seed=1)
+    for node in simulator.nodes.values():
+        node.engine.max_pages = 1
+    simulator.run(2.0)
+
+    acked = [
+        ack
+        for node in simulator.nodes.values()
+        for ack in node.engine.deltas.acked.values()
+    ]
+    # advertising the round's base instead left all but a handful at 0
+    assert sum(ack > 0 for ack in acked) > len(acked) // 20
@@ -0,0 +1,111 @@
+"""
+State files: what is written reads back, a corrupt or truncated file is
+ignored rather than loaded, and a restored engine continues past its
+saved self.
+"""
+import os
+import random
+import struct
+
+from engine import MembershipEngine
+from protocol import Member, Status, decode_node_table, encode_node_table
+from statefile import (
+    load_engine_state, read_state, restore_engine_state, save_engine_state,
+    write_state
+)
+
+TABLE = {
+    "node1": {
+        "heartbeat_counter": 3, "local_clock": 4, "timestamp": 1.5,
+        "version_id": 1, "status": "online", "incarnation": 0
+    },
+}
+
+
+def member(member_id, port, heartbeat=1, incarnation=0, status=Status.ALIVE):
+    return Member(
+        id=member_id,
+        address=("127.0.0.1", port),
+        heartbeat=heartbeat,
+        time=0.0,
+        status=(incarnation, status),
+        failed_time=0.0
+    )
+
+
+def engine(member_id="m0"):
+    return MembershipEngine(
+        member_id, ("127.0.0.1", 8000), ("127.0.0.1", 8000),
+        rng=random.Random(0)
+    )
+
+
+def test_node_table_round_trip(tmp_path):
+    path = str(tmp_path / "state")
+    write_state(path, encode_node_table(TABLE), 12.5)
+    assert read_state(path, decode_node_table) == (TABLE, 12.5)
+    assert not os.path.exists(path + ".tmp")
+
+    # replaced whole, not appended to
+    smaller = {"node2": dict(TABLE["node1"], status="failed")}
+    write_state(path, encode_node_table(smaller), 13.0)
+    assert read_state(path, decode_node_table) == (smaller, 13.0)
+
+
+def test_missing_file(tmp_path):
+    assert read_state(str(tmp_path / "state"), decode_node_table) is None
+
+
+def corrupt(data):
+    return [
+        ("empty", b""),
+        ("short header", data[:10]),
+        ("truncated payload", data[:-3]),
+        ("flipped payload bit", data[:-1] + bytes([data[-1] ^ 1])),
+        ("bad magic", b"X" + data[1:]),
+        ("new version", data[:6] + b"\x02" + data[7:]),
+        ("bad checksum", data[:7] + struct.pack("!I", 1) + data[11:]),
+    ]
+
+
+def test_corrupt_files_are_ignored(tmp_path):
+    path = str(tmp_path / "state")
+    write_state(path, encode_node_table(TABLE), 12.5)
+    with open(path, "rb") as file:
+        data = file.read()
+
+    for name, bad in corrupt(data):
+        with open(path, "wb") as file:
+            file.write(bad)
+        assert read_state(path, decode_node_table) is None, name
+
+
+def test_undecodable_payload_is_ignored(tmp_path):
+    path = str(tmp_path / "state")
+    write_state(path, b"\x00not a node table", 1.0)
+    assert read_state(path, decode_node_table) is None
+
+
+def test_engine_round_trip(tmp_path):
+    path = str(tmp_path / "state")
+    before = engine()
+    before.merge_to_member_list({
+        "m1": member("m1", 8001, 4, 2),
+        "m2": member("m2", 8002, status=Status.FAILED),
+    })
+    me = before.member_list["m0"]
+    me.heartbeat, me.incarnation = 10, 3
+    save_engine_state(before, path)
+
+    members, _ = load_engine_state(path)
+    assert members["m1"]["status"] == (2, Status.ALIVE)
+    assert members["m1"]["heartbeat"] == 4
+
+    after = engine()
+    peers = restore_engine_state(after, members)
+    # failed members are not contacted or restored
+    assert peers == [("m1", ("127.0.0.1", 8001))]
+    assert sorted(after.member_list) == ["m0", "m1"]
+    # our own entry continues past the saved one
+    me = after.member_list["m0"]
+    assert (me.heartbeat, me.incarnation) == (11, 4)
@@ -0,0 +1,173 @@
+"""
+SWIM probing between engines on an in-memory network: a target that only
+answers through a helper stays up, a silent one is suspected, and a
+suspected member that is still running refutes it.
+"""
+import random
+
+from engine import MembershipEngine
+from protocol import Command, Member, Status
+from swim import Detector, ProbeScheduler
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Network(object):
+    """ Delivers datagrams between engines, except over cut links """
+
+    def __init__(self):
+        self.engines: dict[tuple[str, int], MembershipEngine] = {}
+        self.queue: list[tuple[tuple[str, int], tuple[str, int], bytes]] = []
+        self.cut: set[tuple[tuple[str, int], tuple[str, int]]] = set()
+        self.down: set[tuple[str, int]] = set()
+
+    def sender(self, address):
+        network = self
+
+        class Sender(object):
+            def sendto(self, data, target):
+                network.queue.append((address, target, bytes(data)))
+                return len(data)
+
+        return Sender()
+
+    def deliver(self):
+        while self.queue:
+            source, target, data = self.queue.pop(0)
+            if (source, target) in self.cut or target in self.down:
+                continue
+            self.engines[target].handle_datagram(
+                self.sender(target), memoryview(data), source
+            )
+
+
+def cluster(size, clock, network):
+    addresses = [("127.0.0.1", 8000 + i) for i in range(size)]
+    members = {
+        f"m{i}": Member(
+            id=f"m{i}", address=address, heartbeat=1, time=0.0,
+            status=(0, Status.ALIVE), failed_time=0.0
+        )
+        for i, address in enumerate(addresses)
+    }
+    engines = []
+    for i, address in enumerate(addresses):
+        engine = MembershipEngine(
+            f"m{i}", address, addresses[0], detector=Detector.SWIM,
+            t_probe=1.0, t_ack=0.3, indirect_probes=2,
+            enable_suspicion=True, clock=clock, rng=random.Random(i)
+        )
+        engine.merge_to_member_list({
+            member_id: member for member_id, member in members.items()
+            if member_id != engine.id
+        })
+        network.engines[address] = engine
+        engines.append(engine)
+    return engines
+
+
+def probe_period(engine, clock, network):
+    """ Run one protocol period of engine's probing, returns the target """
+    sender = network.sender(engine.address)
+    engine.probe_tick(sender)
+    network.deliver()
+    target = engine.probes.target
+    for step in (0.35, 1.0):
+        clock.now = engine.probes.started + step
+        engine.probe_tick(sender)
+        network.deliver()
+    return target
+
+
+def status(engine, member_id):
+    return engine.member_list[member_id].status
+
+
+def test_probe_scheduler_state():
+    probes = ProbeScheduler(t_probe=1.0, t_ack=0.3, rng=random.Random(0))
+    assert probes.next_target() is None
+    probes.peers.add("a")
+
+    seq = probes.start(probes.next_target(), 10.0)
+    assert not probes.ack_overdue(10.2)
+    assert probes.ack_overdue(10.3)
+    assert not probes.on_ack(seq + 1)
+    assert probes.on_ack(seq)
+    assert not probes.ack_overdue(10.5)
+    assert not probes.period_over(10.9) and probes.period_over(11.0)
+
+    relay = probes.relay(7, ("127.0.0.1", 9000), 10.0)
+    assert probes.take_relay(relay) == (7, ("127.0.0.1", 9000))
+    assert probes.take_relay(relay) is None
+    probes.relay(8, ("127.0.0.1", 9000), 10.0)
+    probes.expire_relays(11.0)
+    assert probes.relays == {}
+
+
+def test_direct_ack_keeps_target_alive():
+    clock, network = Clock(), Network()
+    engines = cluster(3, clock, network)
+
+    target = probe_period(engines[0], clock, network)
+    assert target is not None
+    assert status(engines[0], target) == Status.ALIVE
+    # nobody had to be asked to help
+    assert engines[0].metrics.messages_sent[Command.PING_REQ].value == 0
+
+
+def test_indirect_probe_through_a_helper():
+    clock, network = Clock(), Network()
+    engines = cluster(3, clock, network)
+    prober = engines[0]
+
+    # m1 never gets the prober's pings, only m2's on its behalf
+    network.cut.add((prober.address, engines[1].address))
+
+    probed = [probe_period(prober, clock, network) for _ in range(2)]
+    assert sorted(probed) == ["m1", "m2"]
+    assert status(prober, "m1") == Status.ALIVE
+    assert prober.metrics.messages_sent[Command.PING_REQ].value == 1
+    assert engines[2].probes.relays == {}
+
+
+def test_silent_target_is_suspected():
+    clock, network = Clock(), Network()
+    engines = cluster(3, clock, network)
+    prober = engines[0]
+    network.down.add(engines[1].address)
+
+    # each member is probed once in two periods, the period that ends
+    # without any ack suspects m1
+    probed = [probe_period(prober, clock, network) for _ in range(2)]
+    assert sorted(probed) == ["m1", "m2"]
+    assert status(prober, "m1") == Status.SUSPECTED
+    assert prober.metrics.messages_sent[Command.PING_REQ].value == 1
+    assert status(prober, "m2") == Status.ALIVE
+
+
+def test_suspected_member_refutes():
+    clock, network = Clock(), Network()
+    engines = cluster(2, clock, network)
+    prober, suspect = engines
+
+    network.down.add(suspect.address)
+    probe_period(prober, clock, network)
+    assert status(prober, "m1") == Status.SUSPECTED
+    network.down.clear()
+
+    # the suspicion reaches m1, which gossips itself back with a higher
+    # incarnation
+    prober.gossip_round(network.sender(prober.address))
+    network.deliver()
+    suspect.update_member_list()
+    suspect.gossip_round(network.sender(suspect.address))
+    network.deliver()
+
+    assert status(prober, "m1") == Status.ALIVE
+    assert prober.member_list["m1"].incarnation > 0
@@ -0,0 +1,124 @@
+"""
+State transfer over TCP: frames survive a socket, truncated or oversized
+frames are refused, and a push/pull exchange leaves both members knowing
+each other's lists, chunk by chunk.
+"""
+import random
+import socket
+import struct
+
+import pytest
+
+from engine import MembershipEngine
+from protocol import Command, DecodeError, Member, Status, encode_message
+from transfer import (
+    MAX_FRAME_SIZE, exchange_state, receive_state, recv_frame, send_frame,
+    serve_state_transfer
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def engine(member_id, port=None):
+    address = ("127.0.0.1", port if port is not None else free_port())
+    return MembershipEngine(
+        member_id, address, address, rng=random.Random(0)
+    )
+
+
+def member(member_id, port):
+    return Member(
+        id=member_id,
+        address=("127.0.0.1", port),
+        heartbeat=3,
+        time=0.0,
+        status=(1, Status.ALIVE),
+        failed_time=0.0
+    )
+
+
+@pytest.fixture
+def pair():
+    a, b = socket.socketpair()
+    a.settimeout(5.0)
+    b.settimeout(5.0)
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_frame_round_trip(pair):
+    a, b = pair
+    send_frame(a, b"hello")
+    send_frame(a, b"x" * 4000)
+    send_frame(a, b"")
+
+    assert recv_frame(b) == b"hello"
+    assert recv_frame(b) == b"x" * 4000
+    assert recv_frame(b) is None
+
+
+@pytest.mark.parametrize("data", [
+    b"\x00\x00",                        # inside the length
+    struct.pack("!I", 10) + b"short",   # inside the frame
+])
+def test_truncated_frame_raises(pair, data):
+    a, b = pair
+    a.sendall(data)
+    a.shutdown(socket.SHUT_WR)
+    with pytest.raises(ConnectionError):
+        recv_frame(b)
+
+
+def test_oversized_frame_raises(pair):
+    a, b = pair
+    a.sendall(struct.pack("!I", MAX_FRAME_SIZE + 1))
+    with pytest.raises(DecodeError):
+        recv_frame(b)
+
+
+@pytest.mark.parametrize("frame", [
+    b"\x00garbage",
+    encode_message({"command": Command.LEAVE, "data": {"id": "m1"}}),
+])
+def test_receive_state_refuses_anything_but_gossip(pair, frame):
+    a, b = pair
+    send_frame(a, frame)
+    with pytest.raises(DecodeError):
+        receive_state(b, engine("m0", 8000))
+
+
+def test_exchange_state():
+    server = engine("m0")
+    server.merge_to_member_list({
+        f"s{i}": member(f"s{i}", 9000 + i) for i in range(200)
+    })
+    client = engine("m1")
+    client.merge_to_member_list({"c0": member("c0", 9500)})
+
+    transfer = serve_state_transfer(server, chunk_size=1024)
+    try:
+        entries = exchange_state(client, server.address, chunk_size=512)
+    finally:
+        transfer.shutdown()
+        transfer.server_close()
+
+    # the server's list came back in several chunks, ours went across
+    assert entries == len(server.member_list) == 203
+    assert client.metrics.messages_received[Command.GOSSIP].value > 1
+    assert set(client.member_list) == set(server.member_list)
+    assert server.member_list["m1"].address == client.address
+    assert server.member_list["c0"].heartbeat == 3
+    assert client.metrics.state_transfers["fetched"].value == 1
+    assert server.metrics.state_transfers["served"].value == 1
+
+
+def test_exchange_with_nobody_raises():
+    client = engine("m1")
+    with pytest.raises(OSError):
+        exchange_state(client, ("127.0.0.1", free_port()), timeout=1.0)
+    assert client.metrics.state_transfer_failures.value == 1
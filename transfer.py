@@ -0,0 +1,209 @@
+"""
+Bulk state transfer over TCP.
+
+Gossip stays on UDP, but a whole member list does not belong in datagrams:
+a joiner that only waits for one reply datagram loses the rest of a large
+list, and any of the pages may be dropped.  Joins and full resyncs instead
+exchange member lists over a TCP connection to the same port as the
+member's UDP socket, push/pull style:
+
+    requester -> server   JOIN frame, then the requester's member list
+    server -> requester   the server's member list
+
+A member list is sent as a stream of frames, each a length:u32 (network
+byte order) followed by an encoded gossip message of at most chunk_size
+bytes (see encode_message), and ends with an empty frame.  Every chunk is
+merged as it arrives, so memory stays bounded by one chunk however large
+the cluster, and the whole exchange takes one connection and one round
+trip.
+
+The JOIN frame admits the requester as a UDP join does.  A member that
+already knows the requester simply merges what it pushed, which is how a
+periodic resync (anti-entropy, every t_resync seconds) repairs whatever
+delta gossip missed.
+"""
+import socket
+import socketserver
+import struct
+import threading
+
+from typing import cast
+
+from engine import MembershipEngine
+from protocol import (
+    Command, DecodeError, GossipMessage, JoinMessage, decode_message
+)
+
+DEFAULT_CHUNK_SIZE = 64 << 10
+DEFAULT_TRANSFER_TIMEOUT = 5.0
+DEFAULT_T_RESYNC = 0.0          # seconds, 0 disables periodic resyncs
+MAX_FRAME_SIZE = 16 << 20       # refuse anything larger than this
+
+_FRAME = struct.Struct("!I")
+
+
+def send_frame(sock: socket.socket, data: bytes) -> None:
+    sock.sendall(_FRAME.pack(len(data)) + data)
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytearray:
+    """ Read exactly size bytes, raising ConnectionError on early EOF """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("connection closed mid-frame")
+        received += count
+    return buffer
+
+
+def recv_frame(sock: socket.socket) -> bytearray | None:
+    """
+    Read one frame
+
+    Args:
+        sock (socket.socket): the connection
+
+    Returns:
+        bytearray | None: the frame, None for the end of a member list
+    """
+    (size,) = _FRAME.unpack(recv_exactly(sock, _FRAME.size))
+    if size == 0:
+        return None
+    if size > MAX_FRAME_SIZE:
+        raise DecodeError(f"frame of {size} bytes is too large")
+    return recv_exactly(sock, size)
+
+
+def send_state(
+    sock: socket.socket,
+    engine: MembershipEngine,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> None:
+    """ Stream the engine's member list, then the end frame """
+    for chunk in engine.encode_pages(engine.member_records(), chunk_size):
+        send_frame(sock, chunk)
+    send_frame(sock, b"")
+
+
+def receive_state(sock: socket.socket, engine: MembershipEngine) -> int:
+    """
+    Merge a streamed member list chunk by chunk
+
+    Args:
+        sock (socket.socket): the connection
+        engine (MembershipEngine): where the entries are merged
+
+    Returns:
+        int: the number of entries received
+    """
+    entries = 0
+    while True:
+        frame = recv_frame(sock)
+        if frame is None:
+            return entries
+        message = decode_message(frame)
+        if message["command"] != Command.GOSSIP:
+            raise DecodeError(f"expected gossip, got {message['command']}")
+        members = cast(GossipMessage, message)["data"]
+        engine.merge_to_member_list(members)
+        engine.metrics.received(Command.GOSSIP, len(frame))
+        entries += len(members)
+
+
+def exchange_state(
+    engine: MembershipEngine,
+    address: tuple[str, int],
+    timeout: float = DEFAULT_TRANSFER_TIMEOUT,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> int:
+    """
+    Push our member list to a member and merge its list back
+
+    Args:
+        engine (MembershipEngine): our engine
+        address (tuple[str, int]): the member (or seed) to sync with
+        timeout (float): for connecting and for every read
+        chunk_size (int): the largest chunk we send
+
+    Raises:
+        OSError: the member could not be reached or hung up
+        DecodeError: the member sent something that is not a member list
+
+    Returns:
+        int: the number of entries received
+    """
+    try:
+        with socket.create_connection(address, timeout=timeout) as sock:
+            send_frame(sock, engine.join_message())
+            send_state(sock, engine, chunk_size)
+            entries = receive_state(sock, engine)
+    except (OSError, DecodeError):
+        engine.metrics.state_transfer_failures.inc()
+        raise
+
+    engine.metrics.state_transfers["fetched"].inc()
+    return entries
+
+
+class _TransferHandler(socketserver.BaseRequestHandler):
+    engine: MembershipEngine
+    timeout: float
+    chunk_size: int
+
+    def handle(self) -> None:
+        engine = self.engine
+        sock: socket.socket = self.request
+        sock.settimeout(self.timeout)
+
+        try:
+            frame = recv_frame(sock)
+            if frame is None:
+                return
+            message = decode_message(frame)
+            if message["command"] != Command.JOIN:
+                raise DecodeError(f"expected join, got {message['command']}")
+            engine.admit(cast(JoinMessage, message)["data"])
+
+            receive_state(sock, engine)
+            send_state(sock, engine, self.chunk_size)
+        except (OSError, DecodeError) as e:
+            engine.metrics.state_transfer_failures.inc()
+            engine.logger.log(
+                f"State transfer with {self.client_address} failed: {e}",
+                verbosity=2
+            )
+            return
+
+        engine.metrics.state_transfers["served"].inc()
+
+
+class _TransferServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve_state_transfer(
+    engine: MembershipEngine,
+    timeout: float = DEFAULT_TRANSFER_TIMEOUT,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> socketserver.BaseServer:
+    """
+    Answer state transfers on the engine's address (TCP) on a daemon thread
+
+    Args:
+        engine (MembershipEngine): the engine whose member list is served
+        timeout (float): for every read from a requester
+        chunk_size (int): the largest chunk we send
+
+    Returns:
+        socketserver.BaseServer: the server started
+    """
+    handler = type("Handler", (_TransferHandler,), {
+        "engine": engine, "timeout": timeout, "chunk_size": chunk_size
+    })
+    server = _TransferServer(engine.address, handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server